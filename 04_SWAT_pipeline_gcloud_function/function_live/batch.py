@@ -0,0 +1,200 @@
+import os
+import sys
+import time
+import argparse
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+import config as cfg
+import main
+import swat_load
+import swat_cache
+import swat_io
+import swat_scratch
+import swat_trace
+
+
+def list_run(folder):
+    """Function to find the output files of a model run folder
+
+    Args:
+        folder: a local folder, or a bucket prefix as 'gs://<bucket>/SWAT_outputs/<ModelInfo_TimeInterval>'
+    Returns:
+        Tuple: (run_name, bucket, prefix, blobs) - the folder name in
+        'ModelInfo_TimeInterval' format, the bucket (a LocalBucket over a
+        local folder), the prefix of the folder in it and the blobs directly in it
+    """
+
+    if folder.startswith('gs://'):
+        bucket_nm, prefix = folder[len('gs://'):].strip('/').split('/', 1)
+        bucket = swat_io.get_bucket(bucket_nm)
+        prefix += '/'
+    else:
+        folder = os.path.abspath(folder)
+        bucket = swat_io.LocalBucket(None, folder)
+        prefix = ''
+
+    blobs = [blob for blob in bucket.list_blobs(prefix = prefix) if '/' not in blob.name[len(prefix):]]
+    run_name = os.path.basename(prefix.rstrip('/') if prefix else folder)
+
+    return run_name, bucket, prefix, blobs
+
+
+def file_event(blob, run_name, local):
+    """Function to build the Cloud Storage event the upload of a file would trigger,
+    with the generation and hashes the load would otherwise look up
+
+    A file in a local folder is named as if it had been uploaded to
+    SWAT_outputs/<run_name>/, so its runs table row and checkpoint match
+    those of the same file loaded from the bucket.
+    """
+
+    return {'bucket' : None if local else blob.bucket.name,
+            'name' : '/'.join(['SWAT_outputs', run_name, blob.name]) if local else blob.name,
+            'generation' : blob.generation,
+            'md5Hash' : blob.md5_hash,
+            'crc32c' : blob.crc32c,
+            'size' : blob.size}
+
+
+def load_one(blob, ftype, run_name, local, cio_dict, budget_mb, upload_pool, scratch, compression=None):
+    """Function to load one file of a batch, catching its errors so the other files carry on
+
+    Args:
+        blob: the blob of the file, a LocalBlob read where it is if local
+        ftype: the file type, e.g. 'hru'
+        run_name: the run folder name in 'ModelInfo_TimeInterval' format
+        local: the file is in a local folder
+        cio_dict: the run period read from the run's file.cio
+        budget_mb: memory the file's chunks are sized to fit in
+        upload_pool: thread pool shared by the uploads of the batch
+        scratch: swat_scratch.Scratch folder of the batch, for downloaded files
+        compression: 'gzip' or 'zstd' for a compressed file
+    Returns:
+        Dict: the file, its status ('loaded', 'duplicate' or 'error'), size, rows loaded and seconds taken
+    """
+
+    start = time.perf_counter()
+    model_desc, model_period = run_name.rsplit('_', 1)
+    result = {'file' : blob.name.split('/')[-1], 'ftype' : ftype, 'status' : 'loaded', 'bytes' : blob.size or 0, 'rows' : 0}
+
+    try:
+        event = file_event(blob, run_name, local)
+        hashes, loaded = swat_load.find_duplicate(event, ftype, model_desc)
+        if loaded is not None:
+            result['status'] = 'duplicate'
+        else:
+            result['rows'] = swat_load.load_file(event, ftype, model_desc, model_period, cio_dict, hashes, blob if local else None,
+                                            budget_mb, upload_pool, scratch, compression)
+
+    except Exception as e:
+        traceback.print_exc()
+        result['status'] = 'error'
+        result['error'] = repr(e)
+
+    result['seconds'] = time.perf_counter() - start
+
+    return result
+
+
+def load_run(folder, workers=3, upload_workers=None):
+    """Function to load every target file of a model run folder into BigQuery,
+    several files at once
+
+    file.cio is read once for the run, and the files are loaded on a pool of
+    `workers` threads, largest first. Their chunk uploads share one pool of
+    upload threads, and each file's chunks are sized to its share of the
+    memory budget. Files are downloaded to a scratch folder of the batch,
+    except those in a local folder, which are read where they are.
+
+    Args:
+        folder: a local folder, or a bucket prefix as for list_run
+        workers: number of files loaded at once
+        upload_workers: number of upload threads shared by the files, defaults
+            to cfg.upload_workers more than workers
+    Returns:
+        List: a result dict per file, as from load_one
+    """
+
+    run_name, bucket, prefix, blobs = list_run(folder)
+    local = not folder.startswith('gs://')
+
+    if run_name.split('_')[-1] not in ['monthly', 'daily']:
+        raise ValueError("Run folder '{}' isn't in 'ModelInfo_TimeInterval' format, with a monthly or daily interval".format(run_name))
+
+    names = {blob.name[len(prefix):] : blob for blob in blobs}
+    if 'file.cio' not in names:
+        raise FileNotFoundError("No file.cio in run folder '{}'".format(folder))
+
+    # output files, raw or compressed, e.g. output.hru or output.hru.gz
+    outputs = [(blob,) + main.file_type(blob.name) for blob in blobs]
+    outputs = [o for o in outputs if o[1] in cfg.target_files]
+    ftypes = [o[1] for o in outputs]
+    if len(set(ftypes)) < len(ftypes):
+        raise ValueError("Run folder '{}' has more than one {} file, e.g. raw and compressed copies".format(
+            run_name, sorted({t for t in ftypes if ftypes.count(t) > 1})))
+    outputs.sort(key = lambda o: -(o[0].size or 0))
+    print("Loading {} files of run {} ({:.1f}MB), {} at a time".format(
+        len(outputs), run_name, sum(o[0].size or 0 for o in outputs) / 10**6, workers))
+
+    swat_trace.start('bq_batch', run = run_name, files = len(outputs), workers = workers)
+    scratch = swat_scratch.Scratch('swat_batch_')
+
+    try:
+        with swat_trace.span('header'):
+            cio_dict = swat_load.read_cio(names['file.cio'].path) if local else swat_load.run_cio(bucket.name, prefix + 'file.cio')
+
+        budget_mb = scratch.budget_mb() / workers
+        with ThreadPoolExecutor(upload_workers or (cfg.upload_workers + workers)) as upload_pool:
+            with ThreadPoolExecutor(workers) as pool:
+                futures = [pool.submit(swat_trace.bind(load_one), blob, ftype, run_name, local, cio_dict, budget_mb, upload_pool, scratch, compression)
+                           for blob, ftype, compression in outputs]
+                results = [future.result() for future in futures]
+
+    except Exception as e:
+        swat_trace.finish('error', repr(e))
+        raise
+
+    finally:
+        scratch.close()
+
+    swat_trace.note(failed = sum(r['status'] == 'error' for r in results))
+    swat_cache.report()
+    swat_trace.finish()
+
+    return results
+
+
+def print_summary(run_name, results, wall_s):
+    """Function to print the throughput of each file of a batch, and of the whole run"""
+
+    print("{:<14} {:>4} {:>9} {:>9} {:>11} {:>8} {:>7} {:>10}".format('file', 'type', 'status', 'MB', 'rows', 'seconds', 'MB/s', 'rows/s'))
+    for r in results:
+        mb = r['bytes'] / 10**6
+        print("{:<14} {:>4} {:>9} {:>9.1f} {:>11} {:>8.1f} {:>7.1f} {:>10.0f}".format(
+            r['file'], r['ftype'], r['status'], mb, r['rows'], r['seconds'], mb / r['seconds'], r['rows'] / r['seconds']))
+
+    mb = sum(r['bytes'] for r in results if r['status'] == 'loaded') / 10**6
+    rows = sum(r['rows'] for r in results)
+    print("{}: {} files loaded, {} duplicates skipped, {} failed. {:.1f}MB and {} rows in {:.1f}s ({:.1f}MB/s, {:.0f} rows/s)".format(
+        run_name, sum(r['status'] == 'loaded' for r in results), sum(r['status'] == 'duplicate' for r in results),
+        sum(r['status'] == 'error' for r in results), mb, rows, wall_s, mb / wall_s, rows / wall_s))
+
+
+if __name__ == '__main__':
+
+    # e.g. python batch.py gs://healthy_gulf/SWAT_outputs/Run_daily gs://healthy_gulf/SWAT_outputs/Run_monthly --workers 4
+    # or python batch.py runs/Run_daily
+    parser = argparse.ArgumentParser(description='Load the output files of model run folders into BigQuery, several files at once')
+    parser.add_argument('folders', nargs='+', help='local run folders, or bucket prefixes as gs://<bucket>/SWAT_outputs/<run>')
+    parser.add_argument('--workers', type=int, default=3, help='files loaded at once')
+    parser.add_argument('--upload-workers', type=int, default=None, help='upload threads shared by the files')
+    args = parser.parse_args()
+
+    failed = 0
+    for folder in args.folders:
+        start = time.perf_counter()
+        results = load_run(folder, args.workers, args.upload_workers)
+        print_summary(folder.rstrip('/').split('/')[-1], results, time.perf_counter() - start)
+        failed += sum(r['status'] == 'error' for r in results)
+
+    sys.exit(1 if failed else 0)
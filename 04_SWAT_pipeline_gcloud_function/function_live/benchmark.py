@@ -0,0 +1,728 @@
+import os
+import sys
+import json
+import time
+import platform
+import threading
+import resource
+import subprocess
+import multiprocessing
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+import config as cfg
+import main
+import swat_load
+import swat_decode
+import swat_format
+import swat_io
+import swat_memory
+import swat_layout
+import swat_state
+import swat_scratch
+import swat_trace
+import synthetic
+import pyarrow as pa
+
+
+def time_engine(fpath, ftype, engine, workers=1, chunk_s=None):
+    """Function to time a full decode of an output file with one engine
+
+    Args:
+        fpath: the output file location
+        ftype: the file type, e.g. 'hru'
+        engine: 'numpy' or 'pandas'
+        workers: number of decoding processes, numpy engine only
+        chunk_s: rows per chunk, sized from the memory budget as in the loader if None
+    Returns:
+        Tuple: (seconds, rows, peak RSS in MB) for the decode
+    """
+
+    start = time.perf_counter()
+    rows = 0
+
+    for chunk in swat_load.chunks_SWAT(fpath, ftype, chunk_s or swat_memory.ChunkSizer(ftype), engine, workers = workers):
+        rows += len(chunk)
+
+    return time.perf_counter() - start, rows, swat_trace.peak_rss_mb()
+
+
+def run_isolated(fn, *args):
+    """Function to run a benchmark in a fresh process so its peak RSS isn't
+    inflated by earlier runs
+
+    Args:
+        fn: the benchmark function
+        *args: arguments passed to fn
+    Returns:
+        the return value of fn
+    """
+
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return pool.submit(fn, *args).result()
+
+
+def bench_decode(paths, engines=('pandas', 'numpy')):
+    """Function to compare decode throughput and peak memory of the read engines on each file
+
+    Args:
+        paths: list of output file locations, the file type is taken from the extension
+        engines: the engines to compare
+    Returns:
+        List: dicts of ftype, engine, rows, seconds, MB/s and peak RSS
+    """
+
+    results = []
+    for fpath in paths:
+        ftype = fpath.split('.')[-1]
+        mb = os.path.getsize(fpath) / 10**6
+
+        for engine in engines:
+            secs, rows, rss = run_isolated(time_engine, fpath, ftype, engine)
+            results.append({'ftype' : ftype, 'engine' : engine, 'rows' : rows, 'seconds' : round(secs, 3),
+                            'MB/s' : round(mb / secs, 1), 'peak_rss_MB' : rss, 'file_MB' : round(mb, 1)})
+            print("{:>4} {:>7}: {:>10} rows in {:8.3f}s, {:7.1f} MB/s, peak RSS {:8.1f} MB for a {:.1f} MB file".format(
+                ftype, engine, rows, secs, mb / secs, rss, mb))
+
+    return results
+
+
+def bench_workers(paths, workers=(1, 2, 4, 8), chunk_s=250000):
+    """Function to measure how numpy engine decode throughput scales with worker processes
+
+    Args:
+        paths: list of output file locations, the file type is taken from the extension
+        workers: the worker counts to compare
+        chunk_s: rows per chunk, small enough to give every worker several chunks
+    Returns:
+        List: dicts of ftype, workers, rows, seconds and MB/s
+    """
+
+    print("{} CPUs available".format(os.cpu_count()))
+
+    results = []
+    for fpath in paths:
+        ftype = fpath.split('.')[-1]
+        mb = os.path.getsize(fpath) / 10**6
+
+        for n in workers:
+            secs, rows, rss = run_isolated(time_engine, fpath, ftype, 'numpy', n, chunk_s)
+            results.append({'ftype' : ftype, 'workers' : n, 'rows' : rows, 'seconds' : round(secs, 3), 'MB/s' : round(mb / secs, 1)})
+            print("{:>4} {} workers: {:>10} rows in {:8.3f}s, {:7.1f} MB/s".format(ftype, n, rows, secs, mb / secs))
+
+    return results
+
+
+def cpu_seconds():
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+
+    return usage.ru_utime + usage.ru_stime
+
+
+def bench_index(ftype, n_rows, n_loc):
+    """Function to make a daily DateIndex matching an output file of n_rows rows,
+    keeping the n_loc locations of its layout where they divide the rows evenly"""
+
+    if n_rows % n_loc:
+        n_loc = next(d for d in range(max(1, n_rows // 36500), n_rows + 1) if n_rows % d == 0)
+
+    start = datetime(2000, 1, 1)
+    cio_dict = {'start' : start, 'end' : start + timedelta(days=(n_rows // n_loc) - 1)}
+
+    return swat_format.DateIndex(cio_dict, 'daily', n_loc)
+
+
+def time_format(fpath, ftype, chunk_format, chunk_s=None):
+    """Function to time the ingestion hot loop for one chunk format: decode,
+    format, add metadata and serialise each chunk as the upload stage would
+
+    Args:
+        fpath: the output file location
+        ftype: the file type, any but pst
+        chunk_format: 'pandas' or 'arrow'
+        chunk_s: rows per chunk, sized from the memory budget as in the loader if None
+    Returns:
+        Tuple: (seconds, CPU seconds, rows, parquet MB, peak RSS in MB)
+    """
+
+    layout = swat_layout.file_layout(ftype, fpath)
+    with open(fpath, 'rb') as file:
+        n_rows = sum(1 for line in file) - layout.skip_rows
+    date_index = bench_index(ftype, n_rows, layout.n_locations)
+    load_time = datetime.now().strftime("%Y/%m/%d %H:%M:%S")
+
+    start = time.perf_counter()
+    cpu_start = cpu_seconds()
+    rows = 0
+    n_bytes = 0
+
+    formatter = getattr(swat_format, 'format_' + ftype)
+    chunks = swat_load.chunks_SWAT(fpath, ftype, chunk_s or swat_memory.ChunkSizer(ftype), chunk_format = chunk_format, layout = layout)
+
+    for chunk in chunks:
+        df = formatter(chunk, 'daily', date_index, rows)
+        df = swat_format.add_metadata(df, load_time, 'Bench', 'daily')
+        n_bytes += len(swat_io.parquet_bytes(df))
+        rows += len(chunk)
+
+    return time.perf_counter() - start, cpu_seconds() - cpu_start, rows, n_bytes / 10**6, swat_trace.peak_rss_mb()
+
+
+def bench_formats(paths, formats=('pandas', 'arrow')):
+    """Function to compare the DataFrame and Arrow RecordBatch chunk paths on each file
+
+    Args:
+        paths: list of hru, sub or rch output file locations, the file type is taken from the extension
+        formats: the chunk formats to compare
+    Returns:
+        List: dicts of ftype, format, rows, seconds, CPU seconds and peak RSS
+    """
+
+    results = []
+    for fpath in paths:
+        ftype = fpath.split('.')[-1]
+        mb = os.path.getsize(fpath) / 10**6
+
+        for chunk_format in formats:
+            secs, cpu, rows, out_mb, rss = run_isolated(time_format, fpath, ftype, chunk_format)
+            results.append({'ftype' : ftype, 'format' : chunk_format, 'rows' : rows, 'seconds' : round(secs, 3),
+                            'cpu_seconds' : round(cpu, 3), 'MB/s' : round(mb / secs, 1), 'peak_rss_MB' : rss})
+            print("{:>4} {:>7}: {:>10} rows in {:8.3f}s ({:8.3f}s CPU), {:7.1f} MB/s, peak RSS {:8.1f} MB, {:.1f} MB parquet".format(
+                ftype, chunk_format, rows, secs, cpu, mb / secs, rss, out_mb))
+
+    return results
+
+
+def time_text(fpath, ftype, text_dtype, chunk_format='pandas'):
+    """Function to time decoding an hru or sub file with its text fields decoded as text_dtype
+
+    Args:
+        fpath: the output file location
+        ftype: 'hru' or 'sub'
+        text_dtype: dtype of the text fields, 'category' for dictionary codes, or 'str' or 'string'
+        chunk_format: 'pandas' or 'arrow'
+    Returns:
+        Tuple: (seconds, rows, decoded MB summed over chunks, peak RSS in MB)
+    """
+
+    cfg.fixed_col_dtypes[ftype] = [text_dtype if swat_decode.is_text(t) else t for t in cfg.fixed_col_dtypes[ftype]]
+    swat_layout.layouts.clear()
+
+    start = time.perf_counter()
+    rows = 0
+    n_bytes = 0
+
+    for chunk in swat_load.chunks_SWAT(fpath, ftype, swat_memory.ChunkSizer(ftype), chunk_format = chunk_format):
+        rows += len(chunk)
+        n_bytes += chunk.memory_usage(index=False, deep=True).sum() if chunk_format == 'pandas' else chunk.nbytes
+
+    return time.perf_counter() - start, rows, n_bytes / 10**6, swat_trace.peak_rss_mb()
+
+
+def bench_categories(paths, text_dtypes=('str', 'string', 'category')):
+    """Function to measure the memory saved by decoding the repeated text fields
+    of hru and sub files (LULC, GIS) as dictionary codes
+
+    Args:
+        paths: list of hru or sub output file locations, the file type is taken from the extension
+        text_dtypes: the text dtypes to compare, the last is compared against the first
+    Returns:
+        List: dicts of ftype, format, text dtype, rows, seconds, decoded MB and peak RSS
+    """
+
+    results = []
+    for fpath in paths:
+        ftype = fpath.split('.')[-1]
+
+        for chunk_format in ['pandas', 'arrow']:
+            decoded = {}
+            for text_dtype in text_dtypes:
+                if (chunk_format == 'arrow') and (text_dtype == 'string'):
+                    continue
+                secs, rows, mb, rss = run_isolated(time_text, fpath, ftype, text_dtype, chunk_format)
+                decoded[text_dtype] = mb
+                results.append({'ftype' : ftype, 'format' : chunk_format, 'text_dtype' : text_dtype, 'rows' : rows,
+                                'seconds' : round(secs, 3), 'decoded_MB' : round(mb, 1), 'peak_rss_MB' : rss})
+                print("{:>4} {:>6} {:>8}: {:>10} rows in {:8.3f}s, {:8.1f} MB decoded, peak RSS {:8.1f} MB".format(
+                    ftype, chunk_format, text_dtype, rows, secs, mb, rss))
+
+            saved = decoded[text_dtypes[0]] - decoded[text_dtypes[-1]]
+            print("{:>4} {:>6}: {} saves {:.1f} MB ({:.0f}%) over {}".format(
+                ftype, chunk_format, text_dtypes[-1], saved, 100 * saved / decoded[text_dtypes[0]], text_dtypes[0]))
+
+    return results
+
+
+def time_load(event, stream):
+    """Function to time a full bq_load of one output file against the local stand-ins
+
+    Args:
+        event: dict with the 'bucket' and 'name' of the output file
+        stream: whether to stream the file rather than stage it in tmp
+    Returns:
+        Tuple: (seconds, peak RSS in MB) for the load
+    """
+
+    cfg.stream_files = ['hru', 'sub'] if stream else []
+
+    # each file is loaded more than once, so its checkpoint is cleared and content dedup is off,
+    # rather than the load skipped as done
+    cfg.dedup_files = []
+    swat_state.clear(event['name'])
+
+    start = time.perf_counter()
+    main.bq_load(event)
+
+    return time.perf_counter() - start, swat_trace.peak_rss_mb()
+
+
+def bench_stream(events):
+    """Function to compare end-to-end load time of staged and streamed downloads
+
+    Needs the local stand-ins set up through the environment, e.g.
+    SWAT_LOCAL_BUCKETS, SWAT_LOCAL_BQ and SWAT_TMP_DIR, plus
+    SWAT_LOCAL_BANDWIDTH to simulate the download speed of the bucket.
+
+    Args:
+        events: list of dicts with the 'bucket' and 'name' of each output file
+    Returns:
+        List: dicts of file name, mode, seconds and peak RSS
+    """
+
+    results = []
+    for event in events:
+        for stream in [False, True]:
+            secs, rss = run_isolated(time_load, event, stream)
+            mode = 'stream' if stream else 'staged'
+            results.append({'name' : event['name'], 'mode' : mode, 'seconds' : round(secs, 3), 'peak_rss_MB' : rss})
+            print("{}: {:>6} load took {:8.3f}s, peak RSS {:8.1f} MB".format(event['name'], mode, secs, rss))
+
+    return results
+
+
+def bench_download(events, workers=(2, 4, 8)):
+    """Function to compare the time to download output files to tmp over one stream
+    and as parallel slices, for each number of slices downloaded at once
+
+    Needs the local stand-ins set up through the environment as for
+    bench_stream, with SWAT_LOCAL_BANDWIDTH set to the speed of one stream
+    (30MB/s if it isn't).
+
+    Args:
+        events: list of dicts with the 'bucket' and 'name' of each output file
+        workers: numbers of slices downloaded at once to time
+    Returns:
+        List: dicts of file name, mode, seconds, MB/s and speed up over one stream
+    """
+
+    cfg.local_bucket_bandwidth = cfg.local_bucket_bandwidth or 30 * 10**6
+
+    results = []
+    for event in events:
+        blob = swat_io.get_bucket(event['bucket']).get_blob(event['name'])
+        mb = blob.size / 10**6
+
+        with swat_scratch.Scratch() as scratch:
+            fpath = scratch.file(event['name'].split('/')[-1])
+            for n in (1,) + tuple(workers):
+                start = time.perf_counter()
+                if n == 1:
+                    blob.download_to_filename(fpath)
+                else:
+                    swat_io.download_sliced(blob, fpath, workers = n)
+                secs = time.perf_counter() - start
+                os.remove(fpath)
+
+                mode = 'single' if n == 1 else '{} slices'.format(n)
+                single = secs if n == 1 else single
+                results.append({'name' : event['name'], 'mode' : mode, 'seconds' : round(secs, 3), 'MB/s' : round(mb / secs, 1),
+                                'speedup' : round(single / secs, 2)})
+                print("{}: {:>9} download of {:.1f}MB took {:8.3f}s, {:7.1f} MB/s ({:.2f}x)".format(
+                    event['name'], mode, mb, secs, mb / secs, single / secs))
+
+    return results
+
+
+def compress_copy(event, compression):
+    """Function to write a compressed copy of an output file in a local bucket next
+    to the file, e.g. output.hru.gz, if there isn't one already
+
+    Returns:
+        Dict: the event of the compressed copy
+    """
+
+    suffix = {c : ext for ext, c in cfg.compressed_files.items()}[compression]
+    blob = swat_io.get_bucket(event['bucket']).get_blob(event['name'])
+    copy = blob.bucket.blob(event['name'] + '.' + suffix)
+
+    if not copy.exists():
+        tmp_path = swat_io.hidden_path(copy.path)
+        with open(blob.path, 'rb') as src, pa.CompressedOutputStream(tmp_path, compression) as dst:
+            for data in iter(lambda: src.read(16 * 2**20), b''):
+                dst.write(data)
+        os.replace(tmp_path, copy.path)
+
+    return {'bucket' : event['bucket'], 'name' : copy.name}
+
+
+def time_compressed(event):
+    """Function to time a full bq_load of one output file against the local stand-ins,
+    sampling how much of tmp_dir it uses
+
+    Returns:
+        Tuple: (seconds, peak RSS in MB, peak MB in tmp_dir) for the load
+    """
+
+    stop = threading.Event()
+    peak = [0]
+
+    def sample():
+        while not stop.wait(0.02):
+            used = sum(os.path.getsize(os.path.join(folder, nm)) for folder, _, files in os.walk(cfg.tmp_dir) for nm in files)
+            peak[0] = max(peak[0], used)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        secs, rss = time_load(event, False)
+    finally:
+        stop.set()
+        sampler.join()
+
+    return secs, rss, peak[0] / 10**6
+
+
+def bench_compressed(events, compressions=('gzip', 'zstd')):
+    """Function to compare the end-to-end load of output files uploaded raw and compressed,
+    and the space each takes in tmp_dir
+
+    Compressed copies are written next to the files in the local bucket, so
+    this needs the local stand-ins set up through the environment as for
+    bench_stream, with SWAT_LOCAL_BANDWIDTH set to the speed of the bucket
+    (30MB/s if it isn't).
+
+    Args:
+        events: list of dicts with the 'bucket' and 'name' of each raw output file
+        compressions: compressions to compare against the raw file
+    Returns:
+        List: dicts of file name, upload size, seconds, peak RSS and peak MB in tmp_dir
+    """
+
+    if not cfg.local_bucket_bandwidth:
+        os.environ['SWAT_LOCAL_BANDWIDTH'] = str(30 * 10**6)
+
+    results = []
+    for event in events:
+        for copy in [event] + [compress_copy(event, c) for c in compressions]:
+            mb = swat_io.get_bucket(copy['bucket']).get_blob(copy['name']).size / 10**6
+            secs, rss, tmp_mb = run_isolated(time_compressed, copy)
+            results.append({'name' : copy['name'], 'upload_MB' : round(mb, 1), 'seconds' : round(secs, 3), 'peak_rss_MB' : rss,
+                            'peak_tmp_MB' : round(tmp_mb, 1)})
+            print("{}: {:8.1f}MB upload loaded in {:8.3f}s, peak RSS {:8.1f} MB, peak tmp {:8.1f} MB".format(
+                copy['name'], mb, secs, rss, tmp_mb))
+
+    return results
+
+
+# runs generated by bench_suite, as (run folder name, synthetic.generate arguments)
+suite_runs = [('Bench_daily', {'n_years' : 2, 'locations' : {'hru' : 1000}}),
+              ('Bench_monthly', {'n_years' : 10})]
+
+
+def time_pipeline(event, ftype, model_period):
+    """Function to time each stage of loading one output file, run one after the
+    other rather than overlapped, against the local stand-ins
+
+    Args:
+        event: dict with the 'bucket' and 'name' of the output file
+        ftype: the file type, e.g. 'rch'
+        model_period: either 'monthly' or 'daily'
+    Returns:
+        Dict: stage name to (seconds, rows, peak RSS in MB at the end of the stage)
+    """
+
+    stages = {}
+    clock = {'decode' : 0.0, 'format' : 0.0, 'upload' : 0.0}
+    table_nm = "SWAT_output_" + ftype
+    load_time = datetime.now().strftime("%Y/%m/%d %H:%M:%S")
+
+    def finish(stage, start, rows):
+        stages[stage] = (time.perf_counter() - start, rows, swat_trace.peak_rss_mb())
+
+    start = time.perf_counter()
+    scratch = swat_scratch.Scratch()
+    tmp_path = swat_load.write_to_tmp(event['bucket'], event['name'], scratch)
+    cio_dict = swat_load.read_cio(swat_load.write_to_tmp(event['bucket'], os.path.split(event['name'])[0] + '/file.cio', scratch))
+    finish('download', start, 0)
+
+    start = time.perf_counter()
+    layout = swat_layout.file_layout(ftype, tmp_path)
+    date_index = swat_format.DateIndex(cio_dict, model_period, layout.n_locations)
+    finish('header', start, 0)
+
+    rows = 0
+    formatter = getattr(swat_format, 'format_' + ftype)
+    peak = {}
+
+    if ftype != 'pst':
+        chunks = swat_load.chunks_SWAT(tmp_path, ftype, swat_memory.ChunkSizer(ftype), layout = layout,
+                                  summaries = swat_load.summary_filter(layout, model_period, date_index))
+        while True:
+            start = time.perf_counter()
+            chunk = next(chunks, None)
+            clock['decode'] += time.perf_counter() - start
+            peak['decode'] = swat_trace.peak_rss_mb()
+            if chunk is None:
+                break
+
+            start = time.perf_counter()
+            df = swat_format.add_metadata(formatter(chunk, model_period, date_index, rows), load_time, 'Bench', model_period)
+            clock['format'] += time.perf_counter() - start
+            peak['format'] = swat_trace.peak_rss_mb()
+            rows += len(chunk)
+
+            start = time.perf_counter()
+            swat_load.push_to_bq(df, "healthy_gulf", table_nm)
+            clock['upload'] += time.perf_counter() - start
+            peak['upload'] = swat_trace.peak_rss_mb()
+            del df, chunk
+
+    else:
+        start = time.perf_counter()
+        df = swat_load.read_SWAT_pst(tmp_path, layout)
+        clock['decode'] += time.perf_counter() - start
+        peak['decode'] = swat_trace.peak_rss_mb()
+
+        start = time.perf_counter()
+        df = swat_format.add_metadata(formatter(df, model_period, date_index), load_time, 'Bench', model_period)
+        clock['format'] += time.perf_counter() - start
+        peak['format'] = swat_trace.peak_rss_mb()
+        rows = len(df)
+
+        start = time.perf_counter()
+        swat_load.push_to_bq(df, "healthy_gulf", table_nm)
+        clock['upload'] += time.perf_counter() - start
+        peak['upload'] = swat_trace.peak_rss_mb()
+
+    for stage in ['decode', 'format', 'upload']:
+        stages[stage] = (clock[stage], rows, peak.get(stage))
+
+    scratch.close()
+
+    return stages
+
+
+def import_profile(code):
+    """Function to run code in a fresh interpreter with -X importtime, timing what
+    it imports as a cold-started function instance would
+
+    Args:
+        code: python code to run, e.g. 'import main'
+    Returns:
+        Dict: wall seconds of the process, total import seconds, number of
+        modules imported and the 10 slowest packages
+    """
+
+    import re
+
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True,
+                          cwd=os.path.dirname(os.path.abspath(__file__)))
+    wall_s = time.perf_counter() - start
+    if proc.returncode:
+        raise RuntimeError(proc.stderr.strip().split('\n')[-1])
+
+    # lines of 'import time: self [us] | cumulative | <indent>module', indented by import depth
+    imports = []
+    for line in proc.stderr.splitlines():
+        match = re.match(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)', line)
+        if match:
+            imports.append((match.group(4), int(match.group(2)) / 10**6, len(match.group(3))))
+
+    # packages (names without a dot) are listed by their cumulative time wherever they were first imported
+    top = [secs for nm, secs, depth in imports if depth == 1]
+    packages = [(nm, secs) for nm, secs, depth in imports if ('.' not in nm) and (depth > 1 or nm not in ('site', 'encodings'))]
+
+    return {'wall_s' : round(wall_s, 3), 'import_s' : round(sum(top), 3), 'modules' : len(imports),
+            'slowest' : [(nm, round(secs, 3)) for nm, secs in sorted(packages, key = lambda t: -t[1])[:10]]}
+
+
+def bench_imports():
+    """Function to benchmark the cold start of the function: importing main and
+    handling an event for a file that isn't loaded, and importing the loading code
+
+    Returns:
+        Dict: import_profile of each, by name
+    """
+
+    cases = {'main' : 'import main',
+             'ignored event' : "import main; main.bq_load({'bucket' : 'healthy_gulf', 'name' : 'SWAT_outputs/file_metadata_headers.csv'})",
+             'swat_load' : 'import swat_load'}
+
+    results = {}
+    for name, code in cases.items():
+        results[name] = import_profile(code)
+        r = results[name]
+        print("{:>13}: {:7.3f}s imports ({} modules), {:7.3f}s process wall time".format(name, r['import_s'], r['modules'], r['wall_s']))
+        print("{:>13}  slowest: {}".format('', ', '.join("{} {:.3f}s".format(nm, secs) for nm, secs in r['slowest'][:5])))
+
+    return results
+
+
+def git_revision():
+
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return None
+
+
+def bench_suite(work_dir, results_dir='bench_results', runs=None, ftypes=None):
+    """Function to benchmark the full load of every target file type on synthetic
+    model runs, and save the results so versions can be compared
+
+    Synthetic runs are generated into a local bucket under work_dir (kept and
+    reused on later runs of the suite), and loaded into local parquet tables.
+    For each file the stages are timed one after the other in a fresh process,
+    then the whole bq_load is timed in another, with uploads overlapped.
+
+    Args:
+        work_dir: folder for the local bucket, tables and tmp files
+        results_dir: folder the results are saved to, as <time>_<git revision>.json
+        runs: list of (run folder name, synthetic.generate arguments), defaults to suite_runs
+        ftypes: file types to benchmark, all of cfg.target_files if None
+    Returns:
+        String: the location of the saved results
+    """
+
+    bucket_root = os.path.join(work_dir, 'buckets')
+    os.environ['SWAT_LOCAL_BUCKETS'] = bucket_root
+    os.environ['SWAT_LOCAL_BQ'] = os.path.join(work_dir, 'bq')
+    os.environ['SWAT_TMP_DIR'] = os.path.join(work_dir, 'tmp', '')
+    os.makedirs(os.environ['SWAT_TMP_DIR'], exist_ok=True)
+
+    results = []
+    for run_name, kwargs in (runs or suite_runs):
+
+        model_period = run_name.split('_')[-1]
+        run_dir = os.path.join(bucket_root, 'healthy_gulf', 'SWAT_outputs', run_name)
+        if not os.path.isdir(run_dir):
+            print("Generating synthetic run {}".format(run_name))
+            synthetic.generate_bucket(bucket_root, run_name, **kwargs)
+
+        for ftype in (ftypes or cfg.target_files):
+
+            event = {'bucket' : 'healthy_gulf', 'name' : '/'.join(['SWAT_outputs', run_name, 'output.' + ftype])}
+            mb = os.path.getsize(os.path.join(run_dir, 'output.' + ftype)) / 10**6
+
+            try:
+                stages = run_isolated(time_pipeline, event, ftype, model_period)
+                secs, rss = run_isolated(time_load, event, False)
+                stages['load'] = (secs, stages['decode'][1], rss)
+
+            except Exception as e:
+                print("{} {}: {}".format(run_name, ftype, e))
+                results.append({'run' : run_name, 'ftype' : ftype, 'file_MB' : round(mb, 1), 'error' : str(e)})
+                continue
+
+            for stage, (secs, rows, rss) in stages.items():
+                rows = rows or stages['decode'][1]
+                results.append({'run' : run_name, 'ftype' : ftype, 'stage' : stage, 'file_MB' : round(mb, 1), 'rows' : rows,
+                                'seconds' : round(secs, 3), 'rows/s' : round(rows / secs) if secs else None,
+                                'MB/s' : round(mb / secs, 1) if secs else None, 'peak_rss_MB' : rss})
+                print("{:>13} {:>4} {:>8}: {:>9} rows in {:8.3f}s, {:>10} rows/s, {:7.1f} MB/s, peak RSS {:8.1f} MB".format(
+                    run_name, ftype, stage, rows, secs, round(rows / secs) if secs else '-', mb / secs if secs else 0, rss or 0))
+
+    os.makedirs(results_dir, exist_ok=True)
+    revision = git_revision()
+    fpath = os.path.join(results_dir, '{}_{}.json'.format(datetime.now().strftime("%Y%m%d_%H%M%S"), revision or 'unknown'))
+
+    settings = {k : getattr(cfg, k) for k in ['read_engine', 'chunk_format', 'parse_workers', 'upload_workers',
+                                              'upload_queue', 'staged_load_files', 'stream_files']}
+    with open(fpath, 'w') as file:
+        json.dump({'revision' : revision, 'time' : datetime.now().isoformat(), 'python' : platform.python_version(),
+                   'cpus' : os.cpu_count(), 'config' : settings, 'runs' : runs or suite_runs, 'results' : results,
+                   'imports' : bench_imports()}, file, indent=1)
+
+    print("Results saved to {}".format(fpath))
+
+    return fpath
+
+
+def compare_results(old_path, new_path):
+    """Function to compare two saved bench_suite results, stage by stage
+
+    Args:
+        old_path: the earlier results file
+        new_path: the later results file
+    Returns:
+        List: dicts of run, ftype, stage, both timings and peak RSS, and the speed up
+    """
+
+    def keyed(fpath):
+        with open(fpath) as file:
+            saved = json.load(file)
+        return saved, {(r['run'], r['ftype'], r['stage']) : r for r in saved['results'] if 'stage' in r}
+
+    old, old_results = keyed(old_path)
+    new, new_results = keyed(new_path)
+    print("{} ({}) vs {} ({})".format(old['revision'], old['time'], new['revision'], new['time']))
+
+    rows = []
+    for key in sorted(set(old_results) & set(new_results)):
+        a, b = old_results[key], new_results[key]
+        speedup = a['seconds'] / b['seconds'] if b['seconds'] else None
+        rows.append({'run' : key[0], 'ftype' : key[1], 'stage' : key[2], 'old_seconds' : a['seconds'], 'new_seconds' : b['seconds'],
+                     'speedup' : speedup, 'old_peak_rss_MB' : a['peak_rss_MB'], 'new_peak_rss_MB' : b['peak_rss_MB']})
+        print("{:>13} {:>4} {:>8}: {:8.3f}s -> {:8.3f}s ({:5.2f}x), peak RSS {:8.1f} -> {:8.1f} MB".format(
+            key[0], key[1], key[2], a['seconds'], b['seconds'], speedup or 0, a['peak_rss_MB'] or 0, b['peak_rss_MB'] or 0))
+
+    # import times, saved by suites run since they were added
+    for name in sorted(set(old.get('imports', {})) & set(new.get('imports', {}))):
+        print("{:>13}: {:7.3f}s -> {:7.3f}s imports".format(name, old['imports'][name]['import_s'], new['imports'][name]['import_s']))
+
+    return rows
+
+
+if __name__ == '__main__':
+
+    # e.g. python benchmark.py tmp/output.hru tmp/output.sub tmp/output.rch
+    # or python benchmark.py --stream healthy_gulf/SWAT_outputs/Run_daily/output.hru
+    # or python benchmark.py --download healthy_gulf/SWAT_outputs/Run_daily/output.hru
+    # or python benchmark.py --compressed healthy_gulf/SWAT_outputs/Run_daily/output.hru
+    # or python benchmark.py --workers tmp/output.hru
+    # or python benchmark.py --formats tmp/output.hru tmp/output.sub tmp/output.rch
+    # or python benchmark.py --categories tmp/output.hru tmp/output.sub
+    # or python benchmark.py --suite tmp/bench [rch hru ...]
+    # or python benchmark.py --compare bench_results/old.json bench_results/new.json
+    # or python benchmark.py --imports
+    if sys.argv[1] == '--stream':
+        bench_stream([{'bucket' : p.split('/')[0], 'name' : p.split('/', 1)[1]} for p in sys.argv[2:]])
+
+    elif sys.argv[1] == '--download':
+        bench_download([{'bucket' : p.split('/')[0], 'name' : p.split('/', 1)[1]} for p in sys.argv[2:]])
+
+    elif sys.argv[1] == '--compressed':
+        bench_compressed([{'bucket' : p.split('/')[0], 'name' : p.split('/', 1)[1]} for p in sys.argv[2:]])
+
+    elif sys.argv[1] == '--workers':
+        bench_workers(sys.argv[2:])
+
+    elif sys.argv[1] == '--formats':
+        bench_formats(sys.argv[2:])
+
+    elif sys.argv[1] == '--categories':
+        bench_categories(sys.argv[2:])
+
+    elif sys.argv[1] == '--suite':
+        bench_suite(sys.argv[2], ftypes = sys.argv[3:] or None)
+
+    elif sys.argv[1] == '--compare':
+        compare_results(sys.argv[2], sys.argv[3])
+
+    elif sys.argv[1] == '--imports':
+        bench_imports()
+
+    else:
+        bench_decode(sys.argv[1:])
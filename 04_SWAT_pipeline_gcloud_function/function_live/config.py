@@ -1,7 +1,11 @@
-import numpy as np
+import os
 
 target_files = ['rsv', 'rch', 'sed', 'vel', 'hru', 'sub', 'pst']
 
+# extensions of compressed uploads of the target files, e.g. output.hru.gz, and their compression.
+# these are decompressed as they're downloaded, and never written to tmp
+compressed_files = {'gz' : 'gzip', 'zst' : 'zstd'}
+
 unique_locations = {'rsv' : 4,
                     'rch' : 332,
                     'sed' : 332,
@@ -34,12 +38,14 @@ fixed_col_widths = {'rsv' : [11, 3, 5],
                     'sub' : [7, 3, 9, 5, 10],
 		    'pst' : [10, 5, 4, 17, 17]}
 
-fixed_col_dtypes = {'rsv' : ['str', np.int32, np.int32],
-                    'rch' : ['str', np.int32, 'str', np.int32, np.float64],
-                    'sed' : ['str', np.int32, 'str', np.int32],
-                    'vel' : [np.int32, np.int32],
-                    'hru' : ['string', np.int16, 'string', np.int16, np.int8, np.int16, np.float32],
-                    'sub' : ['str', np.int16, 'str', np.int16, np.float32]}
+# numpy dtype names, kept as strings so the function can read its settings without importing numpy.
+# 'category' text fields repeat a few values for every time step, and are decoded as dictionary codes (pandas Categorical / Arrow dictionary)
+fixed_col_dtypes = {'rsv' : ['category', 'int64', 'int64'],
+                    'rch' : ['category', 'int64', 'int64', 'int64', 'float64'],
+                    'sed' : ['category', 'int64', 'int64', 'int64'],
+                    'vel' : ['int64', 'int64'],
+                    'hru' : ['category', 'int16', 'category', 'int16', 'int8', 'int16', 'float32'],
+                    'sub' : ['category', 'int16', 'category', 'int16', 'float32']}
 
 var_col_width = {'rsv' : 12,
                 'rch' : 12,
@@ -49,4 +55,129 @@ var_col_width = {'rsv' : 12,
                 'sub' : 10}
 
 
-file_cut = ['rsv', 'rch', 'sed', 'sub']
\ No newline at end of file
+file_cut = ['rsv', 'rch', 'sed', 'sub']
+
+# first field name of the header line of each file type, used to find the header and the start of the data
+header_first_field = {'rsv' : 'RES',
+                      'rch' : 'RCH',
+                      'sed' : 'RCH',
+                      'vel' : 'Day',
+                      'hru' : 'LULC',
+                      'sub' : 'SUB',
+                      'pst' : 'GIS'}
+
+# dtype of the variable columns of each file type, decoded with the fixed column dtypes above. Types not listed (pst) have their dtypes inferred
+var_col_dtypes = {'rsv' : 'float64',
+                  'rch' : 'float64',
+                  'sed' : 'float64',
+                  'vel' : 'float64',
+                  'hru' : 'float32',
+                  'sub' : 'float32'}
+
+# file types named from file_metadata_headers.csv rather than their own header, and where the csv is kept
+csv_header_files = ['rsv', 'rch', 'sed', 'vel', 'pst']
+headers_bucket = 'healthy_gulf'
+headers_path = 'SWAT_outputs/file_metadata_headers.csv'
+
+# seconds an instance uses its copy of file_metadata_headers.csv before checking it for a new version. A run's file.cio
+# is checked on every load, with a download that only transfers it if it has changed
+cache_ttl_s = 600
+
+# data lines sampled to work out a file's columns, and the most bytes read from the top of a file to count its locations
+layout_sample_lines = 200
+layout_sample_bytes = 16 * 2**20
+
+# engine used to decode fixed width output files, 'numpy' (swat_decode) or 'pandas' (pd.read_fwf)
+read_engine = 'numpy'
+
+
+# file types downloaded as ranged reads and parsed as they arrive, rather than staged in tmp (any but pst)
+stream_files = []
+stream_range_size = 16 * 2**20
+stream_max_buffers = 4
+
+# objects of at least sliced_download_mb staged in tmp are downloaded as slices of slice_mb, download_workers at a time,
+# and checked against their CRC32C. Smaller objects are downloaded over one stream
+sliced_download_mb = 256
+slice_mb = 32
+download_workers = 8
+
+# local folder for temporary copies of downloaded files, each invocation keeps its own in a sub-folder (see swat_scratch.py)
+tmp_dir = os.environ.get('SWAT_TMP_DIR', '/tmp/')
+
+# local stand-ins for cloud storage and BigQuery, for offline runs and benchmarks.
+# buckets are sub-folders of local_bucket_root, tables are folders of parquet files under local_bq_root
+local_bucket_root = os.environ.get('SWAT_LOCAL_BUCKETS')
+local_bq_root = os.environ.get('SWAT_LOCAL_BQ')
+
+# simulated download bandwidth of each local bucket stream in bytes/s, 0 for no limit
+local_bucket_bandwidth = float(os.environ.get('SWAT_LOCAL_BANDWIDTH', 0))
+
+# number of processes decoding chunks of a staged output file in parallel (numpy engine), 1 to decode serially
+parse_workers = 1
+
+# number of chunk uploads running at once, and number of parsed chunks allowed to wait for an upload
+upload_workers = 2
+upload_queue = 1
+
+# file types whose chunks are staged as parquet files and loaded into BigQuery with one load job per file
+staged_load_files = ['hru', 'sub']
+staging_bucket = 'healthy_gulf'
+staging_prefix = 'SWAT_staging'
+staging_compression = 'zstd'
+
+# file types loaded with chunk checkpoints, so a retried load resumes from its first uncommitted chunk, and where the checkpoints are kept
+checkpoint_files = ['rsv', 'rch', 'sed', 'vel', 'hru', 'sub']
+state_bucket = 'healthy_gulf'
+state_prefix = 'SWAT_state'
+
+# minimum seconds between writes of a checkpoint object, as GCS allows about one write a second to the same object
+checkpoint_interval_s = 1
+
+# file types skipped when a file with the same content (its MD5, or CRC32C for composite objects) has already been loaded
+# for the same model_info, e.g. when a folder copy is rerun. Finished loads are recorded under <state_prefix>/loaded/
+dedup_files = ['rsv', 'rch', 'sed', 'vel', 'hru', 'sub', 'pst']
+
+# form of the chunks passed from the numpy decoder to the upload stage: 'pandas' DataFrames or 'arrow' RecordBatches (vel chunks are always DataFrames)
+chunk_format = 'pandas'
+
+# local folder of parquet files each loaded run is also written to, partitioned by file type, model_info and year. None to turn off
+store_root = os.environ.get('SWAT_STORE')
+store_row_group_size = 100000
+
+# location id field of each output table, used to sort and filter the store
+location_cols = {'rsv' : 'RES',
+                 'rch' : 'RCH',
+                 'sed' : 'RCH',
+                 'vel' : 'sub',
+                 'hru' : 'HRU',
+                 'sub' : 'SUB',
+                 'pst' : 'GIS'}
+
+# instrumentation: seconds between RSS samples, whether to log a JSON line per chunk, and whether to run tracemalloc (slow)
+trace_sample_interval = 0.1
+trace_chunks = False
+trace_tracemalloc = False
+
+# memory available to the function in MB (set to the function's memory allocation), and the share of it chunked loads aim to use
+memory_budget_mb = float(os.environ.get('SWAT_MEMORY_MB', os.environ.get('FUNCTION_MEMORY_MB', 2048)))
+memory_target = 0.7
+
+# MB of downloaded files the invocations running at once on an instance may keep in tmp_dir (held in memory on Cloud Functions),
+# seconds a download waits for space before failing, and age in seconds of scratch folders left by stopped invocations that are removed
+scratch_quota_mb = float(os.environ.get('SWAT_SCRATCH_MB', memory_budget_mb / 2))
+scratch_wait_s = 120
+scratch_stale_s = 3600
+
+# bounds on the rows per chunk picked from the memory budget, and the bytes of temporaries per byte of text while a chunk is decoded
+chunk_min_rows = 50000
+chunk_max_rows = 5000000
+decode_overhead = 6
+
+# per-row model run metadata: 'run_id' to register each load in the runs table and write only its integer id on each row,
+# 'strings' to write model_run_datetime, model_info and model_time_interval on every row as before
+row_metadata = 'run_id'
+runs_table = 'SWAT_runs'
+
+# suffix of the views giving output tables their metadata fields back, e.g. SWAT_output_rch_view
+runs_view_suffix = '_view'
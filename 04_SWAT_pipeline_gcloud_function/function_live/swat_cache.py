@@ -0,0 +1,129 @@
+import time
+import threading
+import swat_trace
+
+
+# clients, buckets and parsed objects kept by this instance between invocations, and the hits and misses of each kind
+values = {}
+objects = {}
+stats = {}
+lock = threading.Lock()
+
+
+def count(kind, hit):
+
+    with lock:
+        kind_stats = stats.setdefault(kind, {'hits' : 0, 'misses' : 0})
+        kind_stats['hits' if hit else 'misses'] += 1
+
+
+def memo(kind, key, make_fn):
+    """Function to get a value kept by the instance, e.g. a client, making it with
+    make_fn() the first time it's asked for
+
+    Args:
+        kind: what the value is, e.g. 'bucket', for the hit rates
+        key: key of the value within its kind, e.g. the bucket name
+        make_fn: function making the value
+    Returns:
+        the value
+    """
+
+    with lock:
+        value = values.get((kind, key))
+    count(kind, value is not None)
+
+    if value is None:
+        value = make_fn()
+        with lock:
+            value = values.setdefault((kind, key), value)
+
+    return value
+
+
+def storage_client():
+    """Function to get the instance's Cloud Storage client"""
+
+    from google.cloud import storage
+
+    return memo('client', 'storage', storage.Client)
+
+
+def bq_client():
+    """Function to get the instance's BigQuery client"""
+
+    from google.cloud import bigquery
+
+    return memo('client', 'bigquery', bigquery.Client)
+
+
+def read_object(kind, blob, parse_fn, ttl_s=0):
+    """Function to get the parsed contents of a small object, such as a run's file.cio,
+    downloading and parsing it only if the instance has no copy of its current generation
+
+    A cached copy less than ttl_s seconds old is used as it is. An older
+    one is checked with a download conditional on the generation having
+    changed, which costs one request but transfers nothing if it hasn't.
+
+    Args:
+        kind: what the object is, e.g. 'cio', for the hit rates
+        blob: the Blob (or LocalBlob) of the object
+        parse_fn: function of the object's bytes returning its parsed contents,
+            which are shared by every invocation so shouldn't be changed
+        ttl_s: seconds a copy is used without checking its generation
+    Returns:
+        the parsed contents of the object
+    """
+
+    key = (kind, blob.bucket.name, blob.name)
+    with lock:
+        entry = objects.get(key)
+
+    if (entry is not None) and (time.monotonic() - entry['checked'] < ttl_s):
+        count(kind, True)
+        return entry['value']
+
+    if entry is None:
+        data = blob.download_as_bytes()
+
+    else:
+        from google.api_core.exceptions import NotModified
+
+        try:
+            data = blob.download_as_bytes(if_generation_not_match = entry['generation'])
+
+        except NotModified:
+            entry['checked'] = time.monotonic()
+            count(kind, True)
+            return entry['value']
+
+    # the download sets the generation of a Blob, a LocalBlob reads it from its file
+    value = parse_fn(data)
+    with lock:
+        objects[key] = {'generation' : blob.generation, 'value' : value, 'checked' : time.monotonic()}
+    count(kind, False)
+
+    if entry is not None:
+        print("{} '{}' has changed since it was cached, reloaded generation {}".format(kind, blob.name, blob.generation))
+
+    return value
+
+
+def summary():
+    """Function to get the hits, misses and hit rate of each kind of cached value on this instance
+
+    Returns:
+        Dict: kind to a dict of 'hits', 'misses' and 'hit_rate'
+    """
+
+    with lock:
+        return {kind : dict(s, hit_rate = round(s['hits'] / (s['hits'] + s['misses']), 3)) for kind, s in sorted(stats.items())}
+
+
+def report():
+    """Function to log the hit rates of the instance's caches, and add them to the active trace"""
+
+    rates = summary()
+    if rates:
+        print("Instance cache hits: " + ", ".join("{} {}/{}".format(kind, s['hits'], s['hits'] + s['misses']) for kind, s in rates.items()))
+        swat_trace.note(cache = rates)
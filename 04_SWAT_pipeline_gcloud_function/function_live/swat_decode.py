@@ -0,0 +1,748 @@
+
+import copy
+import mmap
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+
+# exact powers of ten used to scale decoded mantissas
+POW10 = 10.0 ** np.arange(0, 309)
+
+
+def col_specs(col_widths):
+    """Function to convert a list of column widths into (start, end) offsets
+
+    Args:
+        col_widths: list of fixed column widths, in characters
+    Returns:
+        List: (start, end) character offsets of each column within a line
+    """
+
+    ends = np.cumsum(col_widths)
+
+    return [(int(e - w), int(e)) for e, w in zip(ends, col_widths)]
+
+
+def header_names(line, col_widths):
+    """Function to split a fixed width header line into column names,
+    following the same rules as pd.read_fwf
+
+    Args:
+        line: the header line of the output file
+        col_widths: list of fixed column widths, in characters
+    Returns:
+        List: stripped column names, with duplicates suffixed '.1', '.2' etc.
+    """
+
+    names = []
+    for i, (s, e) in enumerate(col_specs(col_widths)):
+        nm = line[s:e].strip() or 'Unnamed: {}'.format(i)
+        dupe = nm
+        k = 1
+        while dupe in names:
+            dupe = '{}.{}'.format(nm, k)
+            k += 1
+        names.append(dupe)
+
+    return names
+
+
+def data_offset(buf, skip_rows):
+    """Function to find the byte offset of the first data line
+
+    Args:
+        buf: the raw file contents
+        skip_rows: number of lines (including the header) before the data
+    Returns:
+        Int: byte offset of the first data line
+    """
+
+    pos = 0
+    for i in range(skip_rows):
+        pos = buf.find(b'\n', pos) + 1
+        if pos == 0:
+            raise ValueError("File has fewer than {} header lines".format(skip_rows))
+
+    return pos
+
+
+def line_stride(buf, start):
+    """Function to measure the fixed line length (including line ending) of the data
+
+    Args:
+        buf: the raw file contents
+        start: byte offset of the first data line
+    Returns:
+        Tuple: (stride, eol) - bytes per line and bytes in the line ending
+    """
+
+    end = buf.find(b'\n', start)
+    if end == -1:
+        raise ValueError("No complete data lines found after the file header")
+
+    eol = 2 if (end > start) and (buf[end - 1] == 13) else 1
+
+    return end - start + 1, eol
+
+
+def chunk_rows(chunksize):
+    """Function to get the number of lines in the next chunk, where chunksize
+    is either a number or a function returning one (e.g. a swat_memory.ChunkSizer)"""
+
+    return chunksize() if callable(chunksize) else chunksize
+
+
+def row_blocks(buf, start, stride, eol, chunksize=None):
+    """Generator yielding the data lines of a fixed width file as 2-D uint8 arrays
+
+    The data is viewed in place as a (n_lines, stride) array, so no line is
+    copied unless it is the last line of a file with no trailing line ending.
+    When buf is an mmap, the pages behind each block are released once the
+    next block is requested, so resident memory doesn't grow with file size.
+
+    Args:
+        buf: the raw file contents (bytes, bytearray or mmap)
+        start: byte offset of the first data line
+        stride: bytes per line, including the line ending
+        eol: bytes in the line ending
+        chunksize: max lines per block, or a function called for the size of
+            each block, all lines in one block if None
+    Yields:
+        ndarray: uint8 array of shape (n_lines, stride)
+    """
+
+    n_bytes = len(buf) - start
+    n_rows = n_bytes // stride
+    tail = n_bytes - (n_rows * stride)
+
+    rows = np.frombuffer(buf, dtype=np.uint8, count=n_rows * stride, offset=start).reshape(n_rows, stride)
+
+    # every line must end in the same place for the 2-D view to line up
+    if not (rows[:, -1] == 10).all():
+        raise ValueError("Output file lines are not all {} characters wide".format(stride - eol))
+
+    # a final line without a line ending is padded out, anything else is an error
+    last = None
+    if tail:
+        tail_bytes = bytes(buf[len(buf) - tail:])
+        if tail == stride - eol:
+            last = np.frombuffer(tail_bytes + b'\r\n'[2 - eol:], dtype=np.uint8).reshape(1, stride)
+        elif tail_bytes.strip():
+            raise ValueError("Output file lines are not all {} characters wide".format(stride - eol))
+
+    # release the pages touched by the line check before decoding starts
+    release_pages(buf, 0, len(buf))
+
+    i = 0
+    while i < max(n_rows, 1):
+        step = chunk_rows(chunksize) or max(n_rows, 1)
+        block = rows[i:i + step]
+        if (last is not None) and (i + step >= n_rows):
+            block = np.concatenate([block, last])
+        if len(block):
+            yield block
+        release_pages(buf, start + (i * stride), start + ((i + step) * stride))
+        i += step
+
+
+def release_pages(buf, start, end):
+    """Function to drop the pages of a memory-mapped file from resident memory
+
+    The file contents are untouched and will be paged back in if read again.
+    Does nothing for in-memory buffers or where madvise isn't available.
+
+    Args:
+        buf: the mapped file
+        start: first byte offset of the range to release
+        end: last byte offset of the range to release
+    """
+
+    if not hasattr(buf, 'madvise') or not hasattr(mmap, 'MADV_DONTNEED'):
+        return
+
+    # madvise works on whole pages inside the range
+    first = -(-start // mmap.PAGESIZE) * mmap.PAGESIZE
+    last = min(end, len(buf)) // mmap.PAGESIZE * mmap.PAGESIZE
+
+    if last > first:
+        buf.madvise(mmap.MADV_DONTNEED, first, last - first)
+
+
+def parse_numeric(block):
+    """Function to decode fixed width ASCII numbers in bulk
+
+    Handles plain integers, fixed point and Fortran E notation (including
+    exponents written without the 'E', e.g. 0.1234-100). Fields with no
+    digits (blanks) decode to NaN.
+
+    Args:
+        block: uint8 array of shape (..., width) holding the field characters
+    Returns:
+        Tuple: (values, integral) - float64 array of shape block.shape[:-1] and
+        a bool array flagging fields with no decimal point or exponent
+    """
+
+    shape = block.shape[:-1]
+    mant = np.zeros(shape, dtype=np.int64)
+    expo = np.zeros(shape, dtype=np.int64)
+    frac = np.zeros(shape, dtype=np.int64)
+    neg = np.zeros(shape, dtype=bool)
+    eneg = np.zeros(shape, dtype=bool)
+    in_exp = np.zeros(shape, dtype=bool)
+    seen_dot = np.zeros(shape, dtype=bool)
+    any_digit = np.zeros(shape, dtype=bool)
+
+    # walk the field one character position at a time, across every row at once
+    for j in range(block.shape[-1]):
+        ch = block[..., j]
+        dig = ch - np.uint8(48)
+        is_dig = dig < 10
+
+        d_mant = is_dig & ~in_exp
+        mant *= np.where(d_mant, 10, 1)
+        mant += dig * d_mant
+        frac += d_mant & seen_dot
+        any_digit |= d_mant
+
+        d_exp = is_dig & in_exp
+        expo *= np.where(d_exp, 10, 1)
+        expo += dig * d_exp
+
+        # a sign after the mantissa digits starts an exponent
+        sign = (ch == 45) | (ch == 43)
+        exp_sign = sign & any_digit & ~in_exp
+        neg |= (ch == 45) & ~any_digit
+        eneg |= (ch == 45) & (exp_sign | in_exp)
+        in_exp |= exp_sign | (ch == 69) | (ch == 101) | (ch == 68) | (ch == 100)
+        seen_dot |= (ch == 46) & ~in_exp
+
+    scale = np.where(eneg, -expo, expo) - frac
+
+    values = mant.astype(np.float64)
+    values *= POW10[np.clip(scale, 0, 308)]
+    values /= POW10[np.clip(-scale, 0, 308)]
+    np.negative(values, out=values, where=neg)
+    np.copyto(values, np.nan, where=~any_digit)
+
+    return values, ~(seen_dot | in_exp)
+
+
+def decode_strings(block):
+    """Function to decode fixed width ASCII text fields
+
+    Args:
+        block: uint8 array of shape (n_lines, width)
+    Returns:
+        ndarray: unicode array of the stripped field values
+    """
+
+    n, w = block.shape
+
+    return np.char.strip(np.ascontiguousarray(block).view('S{}'.format(w)).reshape(n)).astype(str)
+
+
+class TextDictionary:
+    """Dictionary of the values of one text column of a file, such as the LULC
+    or GIS fields, which repeat the same few values for every time step
+
+    Fields are matched as raw fixed width bytes against the sorted keys seen
+    so far, so each distinct value is only stripped and decoded once, and the
+    column is carried as integer codes into the dictionary. The keys come
+    from the first block decoded, which holds at least the first day of the
+    file, and are added to if a later block holds a new value, so the code
+    of a value never changes within a file.
+    """
+
+    def __init__(self):
+
+        self.keys = None
+        self.codes = np.empty(0, dtype=np.int32)
+        self.values = []
+        self.index = {}
+
+    def extend(self, keys):
+
+        codes = []
+        for key in keys:
+            value = key.decode('ascii', errors='replace').strip()
+            if value not in self.index:
+                self.index[value] = len(self.values)
+                self.values.append(value)
+            codes.append(self.index[value])
+
+        keys = np.concatenate([self.keys, keys]) if self.keys is not None else keys
+        codes = np.concatenate([self.codes, np.array(codes, dtype=np.int32)])
+
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        self.codes = codes[order]
+
+    def encode(self, block):
+        """Function to get the codes of the fields in a block
+
+        Args:
+            block: uint8 array of shape (n_lines, width)
+        Returns:
+            ndarray: int32 code of each field, indexing self.values
+        """
+
+        n, w = block.shape
+        raw = np.ascontiguousarray(block).view('S{}'.format(w)).reshape(n)
+
+        if self.keys is None:
+            self.extend(np.unique(raw))
+
+        pos = np.minimum(np.searchsorted(self.keys, raw), len(self.keys) - 1)
+        hit = self.keys[pos] == raw
+        if not hit.all():
+            self.extend(np.unique(raw[~hit]))
+            pos = np.searchsorted(self.keys, raw)
+
+        return self.codes[pos]
+
+
+def is_text(dtype):
+
+    return isinstance(dtype, str) and dtype in ('str', 'string', 'object', 'category')
+
+
+def decode_rows(rows, col_widths, dtypes=None, names=None, usecols=None, arrow=False, dictionaries=None):
+    """Function to decode a block of fixed width lines into a DataFrame, or an
+    Arrow RecordBatch built straight from the decoded arrays
+
+    Runs of adjacent numeric columns of the same width are decoded together
+    as one (n_lines, n_cols, width) view of the block.
+
+    Args:
+        rows: uint8 array of shape (n_lines, stride), e.g. from row_blocks
+        col_widths: list of fixed column widths, in characters
+        dtypes: dict of column index to dtype, as for pd.read_fwf. If None,
+            numeric columns are inferred as int64 or float64 like pd.read_fwf
+        names: list of column names, defaults to the column index
+        usecols: column indexes to decode, all columns if None
+        arrow: return a pyarrow RecordBatch rather than a DataFrame, with
+            blank float fields as nulls, as they'd be loaded from a DataFrame
+        dictionaries: dict of column index to the TextDictionary of each
+            'category' column, shared by the blocks of a file. Added to as
+            columns are first seen, a new dictionary per block if None
+    Returns:
+        DataFrame or RecordBatch: the decoded columns
+    """
+
+    specs = col_specs(col_widths)
+    names = names if names is not None else list(range(len(col_widths)))
+    usecols = list(usecols) if usecols is not None else list(range(len(col_widths)))
+    dtypes = dtypes if dtypes is not None else {}
+
+    if specs[-1][1] > rows.shape[1]:
+        raise ValueError("Column widths total {} characters but lines are only {} wide".format(specs[-1][1], rows.shape[1]))
+
+    cols = {}
+    i = 0
+    while i < len(usecols):
+
+        c = usecols[i]
+        start, end = specs[c]
+        width = end - start
+
+        if dtypes.get(c) == 'category':
+            dictionary = dictionaries.setdefault(c, TextDictionary()) if dictionaries is not None else TextDictionary()
+            codes = dictionary.encode(rows[:, start:end])
+            if arrow:
+                cols[c] = pa.DictionaryArray.from_arrays(codes, pa.array(dictionary.values, pa.string()))
+            else:
+                cols[c] = pd.Categorical.from_codes(codes, dtype=pd.CategoricalDtype(dictionary.values))
+            i += 1
+            continue
+
+        if is_text(dtypes.get(c)):
+            text = decode_strings(rows[:, start:end])
+            if arrow:
+                cols[c] = pa.array(text, pa.string())
+            else:
+                cols[c] = pd.array(text, dtype='string') if dtypes[c] == 'string' else text.astype(object)
+            i += 1
+            continue
+
+        # gather the run of adjacent numeric columns sharing this width
+        k = 1
+        while (i + k < len(usecols)) and (usecols[i + k] == c + k) \
+                and (col_widths[c + k] == width) and not is_text(dtypes.get(c + k)):
+            k += 1
+
+        values, integral = parse_numeric(rows[:, start:start + (k * width)].reshape(len(rows), k, width))
+
+        for j in range(k):
+            v = values[:, j]
+            dtype = dtypes.get(c + j)
+            if dtype is None:
+                dtype = np.int64 if (integral[:, j].all() and len(v) and not np.isnan(v).any()) else np.float64
+            elif np.issubdtype(np.dtype(dtype), np.integer) and np.isnan(v).any():
+                raise ValueError("Integer column '{}' contains blank or non-numeric values".format(names[c + j]))
+            cols[c + j] = pa.array(v.astype(dtype), from_pandas=True) if arrow else v.astype(dtype)
+
+        i += k
+
+    if arrow:
+        return pa.RecordBatch.from_arrays([cols[c] for c in usecols], names=[str(names[c]) for c in usecols])
+
+    return pd.DataFrame({names[c] : cols[c] for c in usecols})
+
+
+def text_dictionaries(rows, col_widths, dtypes=None, usecols=None):
+    """Function to start the TextDictionary of each 'category' column from a block of lines
+
+    Args:
+        rows: uint8 array of shape (n_lines, stride), holding at least the first time step
+        other args as for decode_rows
+    Returns:
+        Dict: column index to TextDictionary
+    """
+
+    specs = col_specs(col_widths)
+    dtypes = dtypes if dtypes is not None else {}
+    dictionaries = {}
+
+    for c in (usecols if usecols is not None else range(len(col_widths))):
+        if dtypes.get(c) == 'category':
+            start, end = specs[c]
+            dictionaries[c] = TextDictionary()
+            dictionaries[c].encode(rows[:, start:end])
+
+    return dictionaries
+
+
+def merge_dictionaries(df, dictionaries, names=None, arrow=False):
+    """Function to recode the 'category' columns of a chunk decoded by a worker
+    into the file's dictionaries
+
+    A worker starts from a copy of the file's dictionaries, so its codes only
+    differ for values it found that the copy didn't have. Those are added to
+    the file's dictionaries, and the chunk's codes are mapped onto them.
+
+    Args:
+        df: DataFrame or RecordBatch decoded by a worker
+        dictionaries: dict of column index to the file's TextDictionary
+        names: list of column names, defaults to the column index
+        arrow: df is a RecordBatch
+    Returns:
+        Tuple: (df, added) - the chunk with codes into the file's dictionaries,
+        and whether any values were added to them
+    """
+
+    added = False
+    for c, dictionary in dictionaries.items():
+
+        name = names[c] if names is not None else c
+        if arrow:
+            i = df.schema.get_field_index(str(name))
+            column = df.column(i)
+            values, codes = column.dictionary.to_pylist(), column.indices.to_numpy(zero_copy_only=False)
+        else:
+            values, codes = list(df[name].cat.categories), df[name].cat.codes.to_numpy()
+
+        if values == dictionary.values[:len(values)]:
+            continue
+
+        for value in values:
+            if value not in dictionary.index:
+                dictionary.index[value] = len(dictionary.values)
+                dictionary.values.append(value)
+                added = True
+
+        codes = np.array([dictionary.index[value] for value in values], dtype=np.int32)[codes]
+        if arrow:
+            column = pa.DictionaryArray.from_arrays(codes, pa.array(dictionary.values, pa.string()))
+            df = pa.RecordBatch.from_arrays([column if j == i else df.column(j) for j in range(df.num_columns)],
+                                            names=df.schema.names)
+        else:
+            df[name] = pd.Categorical.from_codes(codes, dtype=pd.CategoricalDtype(dictionary.values))
+
+    return df, added
+
+
+def map_file(fpath):
+    """Function to memory-map a file for reading
+
+    Args:
+        fpath: the file location
+    Returns:
+        mmap: read-only mapping of the file contents
+    """
+
+    with open(fpath, 'rb') as file:
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def filter_rows(rows, row_filter):
+    """Function to apply a row filter to a block of lines before it's decoded
+
+    Args:
+        rows: uint8 array of shape (n_lines, stride)
+        row_filter: function of a block returning a bool array of the lines to
+            keep, or None to keep them all, e.g. a swat_format.SummaryFilter
+    Returns:
+        ndarray: the lines kept, copied only if some were dropped
+    """
+
+    keep = row_filter(rows) if row_filter is not None else None
+
+    return rows if keep is None else rows[keep]
+
+
+def close_map(buf):
+    """Function to close a file mapping once the array views of it are gone
+
+    If an error is being raised, its traceback can still hold views of the
+    mapping (e.g. the block a row filter failed on). The mapping is then left
+    to be closed when they're freed, so the original error isn't replaced.
+    """
+
+    try:
+        buf.close()
+    except BufferError:
+        pass
+
+
+def iter_fixed(fpath, skip_rows, col_widths, dtypes=None, names=None, usecols=None, chunksize=None, arrow=False, row_filter=None, start_line=0):
+    """Generator decoding a memory-mapped fixed width file block by block
+
+    Lines are decoded straight from the mapping, so the only copies held in
+    memory are the decoded columns of the current block.
+
+    Args:
+        as for read_fixed
+    Yields:
+        DataFrame or RecordBatch: the decoded columns of each block of lines
+    """
+
+    buf = map_file(fpath)
+    blocks = None
+    dictionaries = {}
+
+    try:
+        start = data_offset(buf, skip_rows)
+        stride, eol = line_stride(buf, start)
+
+        blocks = row_blocks(buf, min(start + (start_line * stride), len(buf)), stride, eol, chunksize)
+        for block in blocks:
+            block = filter_rows(block, row_filter)
+            if not len(block):
+                continue
+            df = decode_rows(block, col_widths, dtypes, names, usecols, arrow, dictionaries)
+            del block
+            yield df
+
+    finally:
+        # array views of the mapping must be gone before it can be closed
+        if blocks is not None:
+            blocks.close()
+        del blocks
+        block = None
+        close_map(buf)
+
+
+def decode_span(fpath, offset, length, stride, eol, col_widths, dtypes=None, names=None, usecols=None, arrow=False, keep=None,
+                dictionaries=None):
+    """Function to decode the lines in one byte range of a fixed width file,
+    run by the workers of iter_fixed_parallel
+
+    Args:
+        fpath: the file location
+        offset: byte offset of the first line in the range
+        length: bytes in the range, a whole number of lines unless it runs to the end of the file
+        stride: bytes per line, including the line ending
+        eol: bytes in the line ending
+        keep: bool array of the lines in the range to decode, all of them if None
+        dictionaries: copy of the file's TextDictionaries to encode the 'category' columns with
+        other args as for read_fixed
+    Returns:
+        DataFrame or RecordBatch: the decoded columns of the lines in the range
+    """
+
+    buf = map_file(fpath)
+    span = memoryview(buf)[offset:offset + length]
+
+    try:
+        blocks = list(row_blocks(span, 0, stride, eol))
+        df = decode_rows(blocks[0] if keep is None else blocks[0][keep], col_widths, dtypes, names, usecols, arrow, dictionaries)
+
+    finally:
+        # array views of the mapping must be gone before it can be closed
+        blocks = None
+        span.release()
+        buf.close()
+
+    return df
+
+
+def iter_fixed_parallel(fpath, skip_rows, col_widths, dtypes=None, names=None, usecols=None, chunksize=None, workers=2, arrow=False, row_filter=None, start_line=0):
+    """Generator decoding a fixed width file in a pool of worker processes
+
+    Every data line has the same width, so the byte range of each chunk is
+    known up front. Chunks are decoded in parallel and yielded in file order,
+    with at most two chunks per worker decoded ahead of the consumer. The
+    TextDictionaries of the 'category' columns are started here from the
+    first chunk, and each worker encodes with a copy, so a value has the
+    same code in every chunk. Values a worker finds that its copy doesn't
+    have are merged back in file order. The row filter runs in this process,
+    in file order, and the workers are handed the lines it keeps.
+
+    Args:
+        workers: number of worker processes
+        other args as for read_fixed
+    Yields:
+        DataFrame or RecordBatch: the decoded columns of each chunk of lines
+    """
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    buf = map_file(fpath)
+    try:
+        start = data_offset(buf, skip_rows)
+        stride, eol = line_stride(buf, start)
+        start = min(start + (start_line * stride), len(buf))
+        size = len(buf)
+
+        n_rows = -(-(size - start) // stride)
+        chunksize = chunksize or -(-n_rows // workers)
+
+        # the file's dictionaries, and the copy handed to the workers, replaced
+        # rather than changed once submitted as it's pickled in the background
+        dictionaries = None
+        shared = None
+
+        with ProcessPoolExecutor(workers) as pool:
+
+            def merged(future):
+                nonlocal shared
+                df, added = merge_dictionaries(future.result(), dictionaries, names, arrow)
+                if added:
+                    shared = copy.deepcopy(dictionaries)
+                return df
+
+            pending = []
+            i = 0
+            while i < n_rows:
+
+                # byte range of the next chunk, the last running to the end of the file
+                step = chunk_rows(chunksize)
+                offset = start + (i * stride)
+                length = min(step * stride, size - offset)
+                i += step
+
+                keep = None
+                if (row_filter is not None) or (dictionaries is None):
+                    blocks = list(row_blocks(memoryview(buf)[offset:offset + length], 0, stride, eol))
+                    keep = row_filter(blocks[0]) if row_filter is not None else None
+                    if (dictionaries is None) and ((keep is None) or keep.any()):
+                        dictionaries = text_dictionaries(blocks[0] if keep is None else blocks[0][keep], col_widths, dtypes, usecols)
+                        shared = copy.deepcopy(dictionaries)
+                    # array views of the mapping must be gone before it can be closed
+                    blocks = None
+                    if (keep is not None) and not keep.any():
+                        continue
+
+                pending.append(pool.submit(decode_span, fpath, offset, length, stride, eol, col_widths, dtypes, names, usecols, arrow, keep,
+                                           shared))
+
+                if len(pending) >= workers * 2:
+                    yield merged(pending.pop(0))
+
+            while pending:
+                yield merged(pending.pop(0))
+
+    finally:
+        blocks = None
+        close_map(buf)
+
+
+def iter_fixed_blocks(blocks, skip_rows, col_widths, dtypes=None, names=None, usecols=None, chunksize=None, arrow=False, row_filter=None):
+    """Generator decoding fixed width lines that arrive as a sequence of byte blocks,
+    e.g. from swat_io.stream_lines
+
+    Lines are buffered until a full chunk is available, so at most one chunk
+    plus one block of undecoded lines is held in memory.
+
+    Args:
+        blocks: iterable of bytes, split on line boundaries, starting with the file header
+        other args as for read_fixed
+    Yields:
+        DataFrame or RecordBatch: the decoded columns of each chunk of lines
+    """
+
+    pending = bytearray()
+    start = None
+    dictionaries = {}
+
+    for block in blocks:
+        pending += block
+
+        # find the start and width of the data lines once the header has arrived
+        if start is None:
+            if pending.count(b'\n') <= skip_rows:
+                continue
+            start = data_offset(pending, skip_rows)
+            stride, eol = line_stride(pending, start)
+            del pending[:start]
+
+        while chunksize and (len(pending) >= chunk_rows(chunksize) * stride):
+            step = chunk_rows(chunksize) * stride
+            chunk = bytes(pending[:step])
+            del pending[:step]
+            for rows in row_blocks(chunk, 0, stride, eol):
+                rows = filter_rows(rows, row_filter)
+                if len(rows):
+                    yield decode_rows(rows, col_widths, dtypes, names, usecols, arrow, dictionaries)
+
+    if start is None:
+        raise ValueError("No complete data lines found after the file header")
+
+    if pending:
+        for rows in row_blocks(bytes(pending), 0, stride, eol):
+            rows = filter_rows(rows, row_filter)
+            if len(rows):
+                yield decode_rows(rows, col_widths, dtypes, names, usecols, arrow, dictionaries)
+
+
+def read_fixed(fpath, skip_rows, col_widths, dtypes=None, names=None, usecols=None, chunksize=None, workers=1, arrow=False, row_filter=None, start_line=0):
+    """Function to read a fixed width SWAT output file, a NumPy alternative to pd.read_fwf
+
+    Args:
+        fpath: the file location
+        skip_rows: number of lines (including the header) before the data
+        col_widths: list of fixed column widths, in characters
+        dtypes: dict of column index to dtype, as for pd.read_fwf
+        names: list of column names, defaults to the column index
+        usecols: column indexes to decode, all columns if None
+        chunksize: if set, return an iterator of DataFrames with this many rows,
+            or a function called for the rows in each one
+        workers: number of processes decoding chunks in parallel
+        arrow: decode to pyarrow RecordBatches rather than DataFrames
+        row_filter: function called with each block of lines, in file order,
+            returning a bool array of the lines to decode (or None for all),
+            so unwanted lines are skipped rather than decoded and dropped
+        start_line: number of data lines to seek past before decoding, e.g.
+            to resume a load from a checkpoint
+    Returns:
+        DataFrame, or an iterator of DataFrames if chunksize is set. With
+        arrow, a pyarrow Table or an iterator of RecordBatches
+    """
+
+    if workers > 1:
+        chunks = iter_fixed_parallel(fpath, skip_rows, col_widths, dtypes, names, usecols, chunksize, workers, arrow, row_filter, start_line)
+    else:
+        chunks = iter_fixed(fpath, skip_rows, col_widths, dtypes, names, usecols, chunksize, arrow, row_filter, start_line)
+
+    if chunksize:
+        return chunks
+
+    if arrow:
+        return pa.Table.from_batches(list(chunks))
+
+    frames = list(chunks)
+    if len(frames) == 1:
+        return frames[0]
+
+    return pd.concat(frames, ignore_index=True)
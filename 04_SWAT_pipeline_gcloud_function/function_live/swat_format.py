@@ -1,112 +1,283 @@
 
-import config as cfg
-import pandas as pd
+import numpy as np
+import pyarrow as pa
+import swat_decode
 
-def format_rsv(df, model_period, cio_dict):
 
-    if model_period == 'monthly':
-            
-        try:
-            # pull min and max year values from MON field (which contains days, months & years)
-            year_start = int(min(df[df['MON'] > 100].MON))
-            year_end = int(max(df[df['MON'] > 100].MON))
-        
-        except:
-            print("Expecting annual averages in monthly file but none found. Is model time interval defined correctly?")
-            raise
-                
-        # remove annual summaries throughout file, i.e. where MON is not a month or day value
-        df = df[df['MON'] < 1000]
-    
-        # create array of year values to match date sequence in monthly file
-        df['year'] = [i for i in range(year_start, year_end + 1) for k in range(0, (cfg.unique_locations['rsv'] * 12))]
+class DateIndex:
+    """Temporal index of a model run, built once from the read_cio dict.
+
+    Maps row numbers of an output file (with summary rows removed) to the
+    time step they belong to by integer arithmetic, row // n_locations, so
+    the dates for any range of rows can be computed without building a
+    list for the whole run.
+
+    Args:
+        cio_dict: dict of run start and end dates, from read_cio
+        model_period: either 'monthly' or 'daily'
+        n_locations: number of rows per time step, e.g. cfg.unique_locations['hru']
+    """
+
+    def __init__(self, cio_dict, model_period, n_locations):
+
+        self.model_period = model_period
+        self.n_locations = n_locations
+        self.start = np.datetime64(cio_dict['start'].date(), 'D')
+        self.end = np.datetime64(cio_dict['end'].date(), 'D')
+
+        if model_period == 'monthly':
+            self.n_steps = int((self.end.astype('M8[M]') - self.start.astype('M8[M]')).astype(int)) + 1
+        else:
+            self.n_steps = int((self.end - self.start).astype(int)) + 1
+
+        self.n_rows = self.n_steps * n_locations
+
+    def dates(self, row_offset, n_rows):
+        """Dates of n_rows rows starting at row number row_offset, as datetime64[D]"""
+
+        if row_offset + n_rows > self.n_rows:
+            raise ValueError("Rows {} to {} are beyond the {} rows expected from the file.cio".format(
+                row_offset, row_offset + n_rows, self.n_rows))
+
+        steps = np.arange(row_offset, row_offset + n_rows, dtype=np.int64) // self.n_locations
+
+        if self.model_period == 'monthly':
+            return (self.start.astype('M8[M]') + steps).astype('M8[D]')
+
+        return self.start + steps
+
+    def summary_mask(self, mon, row_offset=0):
+        """Boolean mask of the summary rows of a chunk of a monthly output file
+
+        Monthly files have a block of yearly summary rows after the twelve
+        months of each year, with MON holding the year, so those rows are the
+        ones with MON > 12. The file can end with a block of averages over the
+        whole run, whose MON holds the number of years and can't always be told
+        from a month. It's picked out by position instead, as the rows after the
+        last time step of the run. Positions count on from row_offset, so the
+        block is found even when it's split across chunks.
+
+        Args:
+            mon: the MON values of the chunk
+            row_offset: number of data rows, with summary rows removed, before the chunk
+        Returns:
+            Array: True for each summary row
+        """
+
+        yearly = np.asarray(mon) > 12
+        rows = row_offset + np.cumsum(~yearly) - 1
+        final = ~yearly & (rows >= self.n_rows)
+
+        if final.any() and (rows[final].max() >= self.n_rows + self.n_locations):
+            raise ValueError("Rows past the {} expected from the file.cio are more than a block of run averages".format(self.n_rows))
+
+        return yearly | final
+
+    def years(self, row_offset, n_rows):
+        """Calendar years of n_rows rows starting at row number row_offset"""
+
+        return self.dates(row_offset, n_rows).astype('M8[Y]').astype(np.int64) + 1970
+
+    def days(self, row_offset, n_rows):
+        """Days of the year (1-366) of n_rows rows starting at row number row_offset"""
+
+        dates = self.dates(row_offset, n_rows)
+
+        return (dates - dates.astype('M8[Y]')).astype(np.int64) + 1
+
+    def add_dates(self, df, row_offset=0):
+        """Add year and date fields to df (a DataFrame, or an Arrow RecordBatch or Table),
+        whose first row is row number row_offset"""
+
+        dates = self.dates(row_offset, len(df))
+        years = dates.astype('M8[Y]').astype(np.int64) + 1970
 
-    if model_period == 'daily': 
-        
-        # year column already exists, no need to add in
-        df = df
+        if isinstance(df, (pa.RecordBatch, pa.Table)):
+            return append_columns(df, {'year' : pa.array(years), 'date' : pa.array(dates, pa.date32())})
+
+        df['year'] = years
+        df['date'] = dates
+
+        return df
+
+
+def append_columns(batch, cols):
+    """Function to add columns to an Arrow RecordBatch or Table, which are immutable
+
+    Args:
+        batch: the RecordBatch or Table
+        cols: dict of column name to Arrow array, each as long as batch
+    Returns:
+        RecordBatch or Table: a new batch holding the columns of both
+    """
+
+    return type(batch).from_arrays(list(batch.columns) + list(cols.values()),
+                                   names=batch.schema.names + list(cols.keys()))
+
+
+def slice_rows(df, start, end):
+    """Function to take rows start to end of a chunk, a DataFrame or an Arrow RecordBatch or Table"""
+
+    if isinstance(df, (pa.RecordBatch, pa.Table)):
+        return df.slice(start, end - start)
+
+    return df.iloc[start:end].reset_index(drop=True)
+
+
+def constant_array(value, n_rows):
+    """Function to build an Arrow string column holding one value in every row,
+    as a dictionary array so no per-row Python strings are created
+
+    Args:
+        value: the string value
+        n_rows: the length of the column
+    Returns:
+        DictionaryArray: int8 indices, all 0, into a one entry dictionary
+    """
+
+    return pa.DictionaryArray.from_arrays(pa.array(np.zeros(n_rows, dtype=np.int8)), pa.array([value], pa.string()))
+
+
+def add_metadata(df, load_time, model_desc, model_period, run_id=None):
+    """Function to add the model run metadata fields to an output table
+
+    Args:
+        df: a DataFrame, or an Arrow RecordBatch or Table
+        load_time: time of the load, as a string
+        model_desc: model information from the folder name
+        model_period: either 'monthly' or 'daily'
+        run_id: if given, only this id of the run in the SWAT_runs table is
+            added, in place of the three metadata fields
+    Returns:
+        DataFrame, RecordBatch or Table: df with the metadata fields added
+    """
+
+    if run_id is not None:
+        if isinstance(df, (pa.RecordBatch, pa.Table)):
+            return append_columns(df, {'run_id' : pa.array(np.full(len(df), run_id, dtype=np.int64))})
+        df['run_id'] = np.int64(run_id)
+        return df
+
+    meta = {'model_run_datetime' : load_time, 'model_info' : model_desc, 'model_time_interval' : model_period}
+
+    if isinstance(df, (pa.RecordBatch, pa.Table)):
+        return append_columns(df, {k : constant_array(v, len(df)) for k, v in meta.items()})
+
+    for k, v in meta.items():
+        df[k] = v
 
     return df
 
 
-def format_rch(df, model_period, cio_dict):
+class SummaryFilter:
+    """Row filter picking the summary rows out of a monthly output file as its
+    lines are decoded, so they're skipped rather than decoded and dropped
 
-    if model_period == 'monthly':
-            
-        try:
-            # pull min and max year values from MON field (which contains days, months & years)
-            year_start = int(min(df[df['MON'] > 100].MON))
-            year_end = int(max(df[df['MON'] > 100].MON))
-        
-        except:
-            print("Expecting annual averages in monthly file but none found. Is model time interval defined correctly?")
-            raise
-                
-        # remove annual summaries throughout file, i.e. where MON is not a month or day value
-        df = df[df['MON'] < 1000]
+    Only the MON field of each block of lines is parsed to find them (see
+    DateIndex.summary_mask). Blocks must be filtered in file order, as the
+    count of data rows so far is what places the final block of run averages.
 
-        # cut off total average summary from bottom of file
-        df = df.iloc[0:len(df)-332, :]
-    
-        # create array of year values to match date sequence in monthly file
-        df['year'] = [i for i in range(year_start, year_end + 1) for k in range(0, (cfg.unique_locations['rch'] * 12))]
+    Args:
+        date_index: DateIndex for the file
+        mon_spec: (start, end) character offsets of the MON field in a line
+        row_offset: data rows before the first line filtered, when a load
+            resumes part way through the file
+    """
 
-        # create empty conc field for previous table format
-        df['SEDCONC'] = 0
+    def __init__(self, date_index, mon_spec, row_offset=0):
+
+        self.date_index = date_index
+        self.start, self.end = mon_spec
+        self.n_data = row_offset
+        self.n_summary = 0
+
+    def line_offset(self, row_offset):
+        """Number of lines of the file before data row row_offset, with the
+        block of yearly summary rows that follows each twelve months"""
 
+        n_loc = self.date_index.n_locations
+
+        return row_offset + ((row_offset // (12 * n_loc)) * n_loc)
+
+    def keep(self, mon):
 
-    if model_period == 'daily': 
-        
         try:
-            # create array of year values to match date sequence in daily file
-            print(cio_dict['start'])
-            print(cio_dict['end'])
-            y_arr = [i for i in pd.date_range(start = cio_dict['start'], end = cio_dict['end'], freq = 'D').year for k in range(0, (cfg.unique_locations['rch']))]
-            df['year'] = y_arr
-    
+            summary = self.date_index.summary_mask(mon, self.n_data)
+
         except:
-            print("Length of daily output file is not as expected from the file.cio, please check they're from the same model run")
+            print("Summary rows of monthly output file are not as expected from the file.cio, please check they're from the same model run")
             raise
 
+        n = int(summary.sum())
+        self.n_data += len(summary) - n
+        self.n_summary += n
+
+        return ~summary
+
+    def __call__(self, rows):
+        """Lines of a block (a uint8 array, as from swat_decode.row_blocks) to
+        decode, or None if there are no summary rows in it"""
+
+        keep = self.keep(swat_decode.parse_numeric(rows[:, self.start:self.end])[0])
+
+        return None if keep.all() else keep
+
+    def drop(self, df):
+        """Remove the summary rows from a decoded chunk, for readers that can't skip them (pd.read_fwf)"""
+
+        keep = self.keep(df['MON'].to_numpy())
+
+        return df if keep.all() else df[keep]
+
+
+def format_rsv(df, model_period, date_index, row_offset=0):
+
+    try:
+        # add year and date values for the rows of the current chunk
+        df = date_index.add_dates(df, row_offset)
+
+    except:
+        print("Length of {} output file is not as expected from the file.cio, please check they're from the same model run".format(model_period))
+        raise
+
     return df
 
 
-def format_sed(df, model_period, cio_dict):
+def format_rch(df, model_period, date_index, row_offset=0):
 
     if model_period == 'monthly':
-            
-        try:
-            # pull min and max year values from MON field (which contains days, months & years)
-            year_start = int(min(df[df['MON'] > 100].MON))
-            year_end = int(max(df[df['MON'] > 100].MON))
-        
-        except:
-            print("Expecting annual averages in monthly file but none found. Is model time interval defined correctly?")
-            raise
-                
-        # remove annual summaries throughout file, i.e. where MON is not a month or day value
-        df = df[df['MON'] < 1000]
 
-        # cut off total average summary from bottom of file
-        df = df.iloc[0:len(df)-332, :]
-    
-        # create array of year values to match date sequence in monthly file
-        df['year'] = [i for i in range(year_start, year_end + 1) for k in range(0, (cfg.unique_locations['sed'] * 12))]
+        # create empty conc field for previous table format
+        if isinstance(df, (pa.RecordBatch, pa.Table)):
+            df = append_columns(df, {'SEDCONC' : pa.array(np.zeros(len(df), dtype=np.int64))})
+        else:
+            df['SEDCONC'] = 0
 
-    if model_period == 'daily': 
-        
-        try:
-            # create array of year values to match date sequence in daily file
-            df['year'] = [i for i in pd.date_range(start = cio_dict['start'], end = cio_dict['end'], freq = 'D').year for k in range(0, (cfg.unique_locations['sed']))]
-    
-        except:
-            print("Length of daily output file is not as expected from the file.cio, please check they're from the same model run")
-            raise
+    try:
+        # add year and date values for the rows of the current chunk
+        df = date_index.add_dates(df, row_offset)
+
+    except:
+        print("Length of {} output file is not as expected from the file.cio, please check they're from the same model run".format(model_period))
+        raise
 
     return df
 
 
-def format_vel(df, model_period, cio_dict):
+def format_sed(df, model_period, date_index, row_offset=0):
+
+    try:
+        # add year and date values for the rows of the current chunk
+        df = date_index.add_dates(df, row_offset)
+
+    except:
+        print("Length of {} output file is not as expected from the file.cio, please check they're from the same model run".format(model_period))
+        raise
+
+    return df
+
+
+def format_vel(df, model_period, date_index, row_offset=0):
 
     df = df.melt(id_vars = ['Day', 'Year'], var_name = "sub", value_name = "velocity")
 
@@ -114,61 +285,33 @@ def format_vel(df, model_period, cio_dict):
 
 
 
-def format_hru(df, model_period, cio_dict, chunk_s, chunk_n, chunk_l):
+def format_hru(df, model_period, date_index, row_offset):
 
-    if model_period == 'monthly':
-            
-        raise ValueError("Unable to process hru files in monthly format, please try daily.")
+    try:
+        # add year and date values for the rows of the current chunk
+        df = date_index.add_dates(df, row_offset)
+
+    except:
+        print("Length of {} output file is not as expected from the file.cio, please check they're from the same model run".format(model_period))
+        raise
 
-    if model_period == 'daily': 
-        
-        try:
-            year_rng = pd.date_range(start = cio_dict['start'], 
-                                     end = cio_dict['end'], 
-                                     freq = 'D').year
-            
-            # create array of year values to match date sequence in daily file
-            year_arr = [i for i in year_rng for k in range(0, (cfg.unique_locations['hru']))]
-            
-            # take just year values for current chunk and add to df
-            targ = year_arr[chunk_n * chunk_s : (chunk_n * chunk_s) + chunk_l]
-            df['year'] = targ
-    
-        except:
-            print("Length of daily output file is not as expected from the file.cio, please check they're from the same model run")
-            raise
-            
     return df
 
 
-def format_sub(df, model_period, cio_dict, chunk_s, chunk_n, chunk_l):
+def format_sub(df, model_period, date_index, row_offset):
 
-    if model_period == 'monthly':
-            
-        raise ValueError("Unable to process sub files in monthly format, please try daily.")
+    try:
+        # add year and date values for the rows of the current chunk
+        df = date_index.add_dates(df, row_offset)
 
-    if model_period == 'daily': 
-        
-        try:
-            year_rng = pd.date_range(start = cio_dict['start'], 
-                                     end = cio_dict['end'], 
-                                     freq = 'D').year
-            
-            # create array of year values to match date sequence in daily file
-            year_arr = [i for i in year_rng for k in range(0, (cfg.unique_locations['sub']))]
-            
-            # take just year values for current chunk and add to df
-            targ = year_arr[chunk_n * chunk_s : (chunk_n * chunk_s) + chunk_l]
-            df['year'] = targ
-    
-        except:
-            print("Length of daily output file is not as expected from the file.cio, please check they're from the same model run")
-            raise
+    except:
+        print("Length of {} output file is not as expected from the file.cio, please check they're from the same model run".format(model_period))
+        raise
 
     return df
 
 
-def format_pst(df, model_period, cio_dict):
+def format_pst(df, model_period, date_index):
 
     # formatting here is very simple
     # the file contains YEAR so no need to do fiddly date inference from cio file.
@@ -0,0 +1,640 @@
+
+import io
+import os
+import time
+import base64
+import hashlib
+import queue
+import threading
+import pyarrow as pa
+import pyarrow.parquet as pq
+import config as cfg
+import swat_cache
+import swat_trace
+
+
+# serialises naming of local table files between upload threads
+table_lock = threading.Lock()
+
+class LocalBlob:
+    """Stand-in for a google.cloud.storage Blob, backed by a local file.
+
+    Supports the parts of the Blob API used by the pipeline. Reads can be
+    throttled to a per-stream bandwidth (cfg.local_bucket_bandwidth, bytes/s)
+    to mimic downloads from a bucket.
+    """
+
+    def __init__(self, bucket, name):
+
+        self.bucket = bucket
+        self.name = name
+        self.path = os.path.join(bucket.root, *name.split('/'))
+        self.size = None
+
+    def exists(self):
+
+        return os.path.isfile(self.path)
+
+    def reload(self):
+
+        self.size = os.path.getsize(self.path)
+
+    @property
+    def generation(self):
+        """Version of the object, from the modification time of the file as Cloud
+        Storage gives each upload of an object a new generation"""
+
+        return os.stat(self.path).st_mtime_ns
+
+    @property
+    def md5_hash(self):
+        """Base64 MD5 of the file, as held by Cloud Storage for every object"""
+
+        md5 = hashlib.md5()
+        with open(self.path, 'rb') as file:
+            for data in iter(lambda: file.read(2**20), b''):
+                md5.update(data)
+
+        return base64.b64encode(md5.digest()).decode('ascii')
+
+    @property
+    def crc32c(self):
+        """Base64 big-endian CRC32C of the file, held by Cloud Storage for every object
+        (including composite objects, which have no MD5)"""
+
+        return file_crc32c(self.path)
+
+    def check_generation(self, if_generation_match=None, if_generation_not_match=None):
+
+        if (if_generation_not_match is not None) and (self.generation == int(if_generation_not_match)):
+            from google.api_core.exceptions import NotModified
+            raise NotModified('{} is at generation {}'.format(self.name, if_generation_not_match))
+
+        if (if_generation_match is not None) and (self.generation != int(if_generation_match)):
+            from google.api_core.exceptions import PreconditionFailed
+            raise PreconditionFailed('{} is no longer at generation {}'.format(self.name, if_generation_match))
+
+    def download_as_bytes(self, start=None, end=None, if_generation_match=None, if_generation_not_match=None):
+        """Read the object, or the inclusive byte range start-end of it, raising
+        NotModified if its generation is if_generation_not_match, or
+        PreconditionFailed if it isn't if_generation_match"""
+
+        self.check_generation(if_generation_match, if_generation_not_match)
+
+        with open(self.path, 'rb') as file:
+            file.seek(start or 0)
+            data = file.read(-1 if end is None else end - (start or 0) + 1)
+
+        throttle(len(data))
+
+        return data
+
+    def download_to_file(self, file_obj, start=None, end=None, if_generation_match=None, checksum=None):
+        """Write the object, or the inclusive byte range start-end of it, to an open
+        file 1MB at a time, at the simulated bandwidth of one stream"""
+
+        self.check_generation(if_generation_match)
+
+        with open(self.path, 'rb') as file:
+            file.seek(start or 0)
+            left = (os.path.getsize(self.path) if end is None else end + 1) - (start or 0)
+            while left > 0:
+                data = file.read(min(left, 2**20))
+                if not data:
+                    break
+                throttle(len(data))
+                file_obj.write(data)
+                left -= len(data)
+
+    def download_to_filename(self, filename):
+
+        with open(filename, 'wb') as file:
+            self.download_to_file(file)
+
+    def upload_from_filename(self, filename):
+
+        with open(filename, 'rb') as file:
+            self.upload_from_string(file.read())
+
+    def upload_from_string(self, data):
+
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+
+        # written under a temporary name then renamed, so like a Cloud Storage
+        # upload the object only exists once it's complete
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = hidden_path(self.path)
+        with open(tmp_path, 'wb') as file:
+            file.write(data)
+        os.replace(tmp_path, self.path)
+
+    def delete(self):
+
+        os.remove(self.path)
+
+
+class LocalBucket:
+    """Stand-in for a google.cloud.storage Bucket, backed by a local directory"""
+
+    def __init__(self, name, root):
+
+        self.name = name
+        self.root = root
+
+    def blob(self, name):
+
+        return LocalBlob(self, name)
+
+    def get_blob(self, name):
+
+        blob = LocalBlob(self, name)
+        if not blob.exists():
+            return None
+        blob.reload()
+
+        return blob
+
+    def list_blobs(self, prefix=''):
+        """Blobs of the objects whose names start with prefix, in name order, skipping
+        files still being written"""
+
+        names = []
+        for folder, _, files in os.walk(self.root):
+            rel = os.path.relpath(folder, self.root).replace(os.sep, '/')
+            names += [name if rel == '.' else rel + '/' + name for name in files if not name.startswith('.')]
+
+        return [self.get_blob(name) for name in sorted(names) if name.startswith(prefix)]
+
+
+def hidden_path(fpath):
+    """Function to get a temporary name to write a file under before it's renamed
+    to fpath, with a leading '.' so readers of the folder (e.g. pyarrow
+    datasets) skip it while it's incomplete"""
+
+    folder, name = os.path.split(fpath)
+
+    return os.path.join(folder, '.{}.{}.tmp'.format(name, threading.get_ident()))
+
+
+def file_crc32c(fpath):
+    """Function to get the base64 big-endian CRC32C of a file, as Cloud Storage gives it"""
+
+    import google_crc32c
+
+    crc = google_crc32c.Checksum()
+    with open(fpath, 'rb') as file:
+        for data in iter(lambda: file.read(2**20), b''):
+            crc.update(data)
+
+    return base64.b64encode(crc.digest()).decode('ascii')
+
+
+def throttle(n_bytes):
+    """Function to sleep for as long as n_bytes would take at the simulated bandwidth"""
+
+    if cfg.local_bucket_bandwidth:
+        time.sleep(n_bytes / cfg.local_bucket_bandwidth)
+
+
+def get_bucket(bucket_nm):
+    """Function to get a storage bucket, or its local stand-in if cfg.local_bucket_root is set
+
+    Buckets are looked up once per instance, with a client kept between
+    invocations, so only the first call makes a request.
+
+    Args:
+        bucket_nm: The name of the bucket
+    Returns:
+        Bucket: a google.cloud.storage Bucket or a LocalBucket
+    """
+
+    if cfg.local_bucket_root:
+        return LocalBucket(bucket_nm, os.path.join(cfg.local_bucket_root, bucket_nm))
+
+    return swat_cache.memo('bucket', bucket_nm, lambda: swat_cache.storage_client().get_bucket(bucket_nm))
+
+
+def blob_uri(blob):
+    """Function to get the URI a load job reads a blob from, a local path for a LocalBlob"""
+
+    if isinstance(blob, LocalBlob):
+        return blob.path
+
+    return 'gs://{}/{}'.format(blob.bucket.name, blob.name)
+
+
+def to_arrow(df):
+    """Function to convert a dataframe to an Arrow Table, storing any date
+    field as a DATE rather than a TIMESTAMP, and giving every dictionary
+    field int32 indices, so the chunks of a file share one schema however
+    many values their dictionaries hold
+
+    Args:
+        df: DataFrame, or Arrow RecordBatch or Table
+    Returns:
+        Table: the same columns as an Arrow Table
+    """
+
+    if isinstance(df, pa.RecordBatch):
+        table = pa.Table.from_batches([df])
+    elif isinstance(df, pa.Table):
+        table = df
+    else:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+
+    if 'date' in table.column_names:
+        i = table.column_names.index('date')
+        table = table.set_column(i, 'date', table.column(i).cast(pa.date32()))
+
+    for i, field in enumerate(table.schema):
+        if pa.types.is_dictionary(field.type) and (field.type.index_type != pa.int32()):
+            table = table.set_column(i, field.name, table.column(i).cast(pa.dictionary(pa.int32(), field.type.value_type)))
+
+    return table
+
+
+def parquet_bytes(df, compression=None):
+    """Function to serialise a dataframe as a compressed parquet file
+
+    Args:
+        df: DataFrame, or Arrow RecordBatch or Table, to be written
+        compression: parquet compression codec, defaults to cfg.staging_compression
+    Returns:
+        bytes: the parquet file
+    """
+
+    sink = pa.BufferOutputStream()
+    pq.write_table(to_arrow(df), sink, compression=compression or cfg.staging_compression)
+
+    return sink.getvalue().to_pybytes()
+
+
+def upload_parquet(df, blob, compression=None):
+    """Function to write a dataframe to a blob as a compressed parquet file
+
+    Args:
+        df: DataFrame, or Arrow RecordBatch or Table, to be written
+        blob: the Blob (or LocalBlob) to write to
+        compression: parquet compression codec, defaults to cfg.staging_compression
+    Returns:
+        Int: the size of the parquet file in bytes
+    """
+
+    data = parquet_bytes(df, compression)
+    blob.upload_from_string(data)
+
+    return len(data)
+
+
+def download_sliced(blob, fpath, slice_size=None, workers=None):
+    """Function to download a large blob to a file as byte range slices fetched in
+    parallel, over several streams rather than one
+
+    The file is allocated at its full size first, and each slice is written
+    straight into its place in it through a file handle of its own, so no
+    slice is held in memory whole. Every slice is read from the generation
+    of the blob that was looked up, and the finished file is checked
+    against the blob's CRC32C, which Cloud Storage keeps for every object.
+
+    Args:
+        blob: the Blob (or LocalBlob) to download
+        fpath: location of the file to write
+        slice_size: bytes per slice, defaults to cfg.slice_mb
+        workers: slices downloaded at once, defaults to cfg.download_workers
+    Returns:
+        Int: the size of the file in bytes
+    """
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    if (blob.size is None) or (blob.generation is None):
+        blob.reload()
+
+    slice_size = slice_size or int(cfg.slice_mb * 2**20)
+    generation = blob.generation
+    expected = blob.crc32c
+
+    with open(fpath, 'wb') as file:
+        if hasattr(os, 'posix_fallocate'):
+            os.posix_fallocate(file.fileno(), 0, blob.size)
+        else:
+            file.truncate(blob.size)
+
+    def fetch(pos):
+        with open(fpath, 'r+b') as file:
+            file.seek(pos)
+            blob.download_to_file(file, start=pos, end=min(pos + slice_size, blob.size) - 1, if_generation_match=generation, checksum=None)
+            if file.tell() != min(pos + slice_size, blob.size):
+                raise IOError("Slice at {} of '{}' ended at {}".format(pos, blob.name, file.tell()))
+
+    with ThreadPoolExecutor(workers or cfg.download_workers) as pool:
+        for future in [pool.submit(fetch, pos) for pos in range(0, blob.size, slice_size)]:
+            future.result()
+
+    with swat_trace.span('verify', bytes_in = blob.size):
+        actual = file_crc32c(fpath)
+    if actual != expected:
+        print("CRC32C of the download of '{}' is {}, the object's is {}".format(blob.name, actual, expected))
+        raise IOError("Checksum mismatch downloading '{}'".format(blob.name))
+
+    return blob.size
+
+
+def prefetch(items, max_buffers):
+    """Generator running an iterator in a background thread, which works ahead of
+    the consumer by at most max_buffers items held in a bounded queue
+
+    Args:
+        items: iterator of the items, e.g. a generator downloading ranges
+        max_buffers: max items waiting for the consumer
+    Yields:
+        the items, in order. An error raised by the iterator is raised here
+    """
+
+    buffers = queue.Queue(max_buffers)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        # give up if the consumer has gone away, rather than blocking forever
+        while not stop.is_set():
+            try:
+                buffers.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def run():
+        try:
+            for item in items:
+                if not put(item):
+                    return
+            put(done)
+
+        except Exception as e:
+            put(e)
+
+        finally:
+            if hasattr(items, 'close'):
+                items.close()
+
+    worker = threading.Thread(target=swat_trace.bind(run), daemon=True)
+    worker.start()
+
+    try:
+        while True:
+            item = buffers.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    finally:
+        stop.set()
+        worker.join()
+
+
+def stream_ranges(blob, range_size=None, max_buffers=None, start=0):
+    """Generator downloading a blob as a sequence of ranged byte reads
+
+    Ranges are fetched by a background thread into a bounded queue, so the
+    download runs ahead of the consumer by at most max_buffers ranges.
+
+    Args:
+        blob: the Blob (or LocalBlob) to read
+        range_size: bytes per ranged read, defaults to cfg.stream_range_size
+        max_buffers: max ranges held in memory, defaults to cfg.stream_max_buffers
+        start: byte offset to start reading from
+    Yields:
+        bytes: consecutive ranges of the blob
+    """
+
+    range_size = range_size or cfg.stream_range_size
+
+    if blob.size is None:
+        blob.reload()
+
+    def fetch():
+        for pos in range(start, blob.size, range_size):
+            with swat_trace.span('download') as span:
+                data = blob.download_as_bytes(start=pos, end=min(pos + range_size, blob.size) - 1)
+                span.add(bytes_in = len(data))
+            yield data
+
+    yield from prefetch(fetch(), max_buffers or cfg.stream_max_buffers)
+
+
+class IterReader(io.RawIOBase):
+    """Read-only file over an iterator of byte blocks, e.g. from stream_ranges,
+    for readers that take a file such as pyarrow's CompressedInputStream"""
+
+    def __init__(self, blocks):
+
+        self.blocks = blocks
+        self.block = b''
+        self.pos = 0
+
+    def readable(self):
+
+        return True
+
+    def readinto(self, buffer):
+
+        while self.pos == len(self.block):
+            self.block = next(self.blocks, b'')
+            self.pos = 0
+            if not self.block:
+                return 0
+
+        n = min(len(buffer), len(self.block) - self.pos)
+        buffer[:n] = self.block[self.pos:self.pos + n]
+        self.pos += n
+
+        return n
+
+
+def stream_decompressed(blob, compression, range_size=None, max_buffers=None, start=0):
+    """Generator downloading a compressed blob in ranges and decompressing it as it arrives
+
+    The ranges are downloaded by one background thread and decompressed by
+    another, each working ahead by at most max_buffers blocks, so neither
+    the compressed nor the decompressed file is ever held whole.
+
+    Args:
+        blob: the Blob (or LocalBlob) of a compressed file
+        compression: 'gzip' or 'zstd', as named by cfg.compressed_files
+        range_size: bytes per ranged read and per decompressed block, defaults to cfg.stream_range_size
+        max_buffers: max blocks held in memory at each step, defaults to cfg.stream_max_buffers
+        start: offset in the decompressed file to start from. What comes before
+            it still has to be downloaded and decompressed, but isn't kept
+    Yields:
+        bytes: consecutive blocks of the decompressed file
+    """
+
+    range_size = range_size or cfg.stream_range_size
+    max_buffers = max_buffers or cfg.stream_max_buffers
+
+    def inflate():
+        ranges = stream_ranges(blob, range_size, max_buffers)
+        stream = pa.CompressedInputStream(pa.PythonFile(IterReader(ranges), mode='r'), compression)
+        skip = start
+        try:
+            while True:
+                with swat_trace.span('decompress') as span:
+                    data = stream.read(range_size)
+                    span.add(bytes_out = len(data))
+                if not data:
+                    break
+                if skip:
+                    cut = min(skip, len(data))
+                    data, skip = data[cut:], skip - cut
+                if data:
+                    yield data
+
+        finally:
+            ranges.close()
+
+    yield from prefetch(inflate(), max_buffers)
+
+
+def read_head(blob, n, compression=None):
+    """Function to read the first n bytes of a blob, or of the file it decompresses
+    to, with as few ranged reads as it takes
+
+    Returns:
+        bytes: the first n bytes, or the whole file if it's shorter
+    """
+
+    if compression is None:
+        if blob.size is None:
+            blob.reload()
+        return blob.download_as_bytes(start=0, end=min(n, blob.size) - 1)
+
+    # compressed text shrinks about 10x, so start with ranges of a tenth of what's wanted
+    blocks = stream_decompressed(blob, compression, range_size = max(n // 10, 2**20), max_buffers = 1)
+    head = b''
+    try:
+        for data in blocks:
+            head += data
+            if len(head) >= n:
+                break
+
+    finally:
+        blocks.close()
+
+    return head[:n]
+
+
+def stream_lines(blob, range_size=None, max_buffers=None, start=0, compression=None):
+    """Generator downloading a blob in ranges and splitting them on line boundaries
+
+    Args:
+        as for stream_ranges, and
+        compression: 'gzip' or 'zstd' to decompress the blob as it's downloaded,
+            in which case start is an offset in the decompressed file
+    Yields:
+        bytes: blocks of whole lines, in file order
+    """
+
+    if compression is None:
+        blocks = stream_ranges(blob, range_size, max_buffers, start)
+    else:
+        blocks = stream_decompressed(blob, compression, range_size, max_buffers, start)
+
+    carry = b''
+
+    for data in blocks:
+        data = carry + data
+        cut = data.rfind(b'\n') + 1
+        carry = data[cut:]
+        if cut:
+            yield data[:cut]
+
+    if carry:
+        yield carry
+
+
+def local_table_file(dataset_nm, table_nm, job_id=None):
+    """Function to name the parquet file of one load into a local stand-in for a
+    BigQuery table, after its job id if it has one, or numbered in load order
+
+    Returns:
+        String: the location to write the load to
+    """
+
+    table_dir = os.path.join(cfg.local_bq_root, dataset_nm, table_nm)
+
+    with table_lock:
+        os.makedirs(table_dir, exist_ok=True)
+        if job_id:
+            return os.path.join(table_dir, job_id + '.parquet')
+        # numbered from the loads already in place, not those still being written
+        n_loads = len([nm for nm in os.listdir(table_dir) if not nm.startswith('.')])
+        fpath = os.path.join(table_dir, 'load-{:06d}.parquet'.format(n_loads))
+        open(fpath, 'wb').close()
+
+    return fpath
+
+
+def local_job_done(job_id, dataset_nm, table_nm):
+    """Function to check whether a load into a local stand-in table with the given job id completed"""
+
+    return os.path.isfile(os.path.join(cfg.local_bq_root, dataset_nm, table_nm, job_id + '.parquet'))
+
+
+def append_local_table(df, dataset_nm, table_nm, job_id=None):
+    """Function to append a dataframe to a local stand-in for a BigQuery table,
+    stored as one parquet file per load under cfg.local_bq_root
+
+    Args:
+        df: DataFrame, or Arrow RecordBatch or Table, to be loaded
+        dataset_nm: name of the target data set
+        table_nm: name of the target table
+        job_id: id of the load, as given to a BigQuery load job
+    Returns:
+        String: the location of the parquet file written
+    """
+
+    fpath = local_table_file(dataset_nm, table_nm, job_id)
+
+    # renamed into place once written, so a load is either all there or not at all
+    tmp_path = hidden_path(fpath)
+    pq.write_table(to_arrow(df), tmp_path)
+    os.replace(tmp_path, fpath)
+
+    return fpath
+
+
+def load_local_table(uris, dataset_nm, table_nm, job_id=None):
+    """Function to load staged parquet files into a local stand-in for a BigQuery
+    table in one go, as the row groups of a single parquet file
+
+    Args:
+        uris: local paths of the staged parquet files
+        dataset_nm: name of the target data set
+        table_nm: name of the target table
+        job_id: id of the load, as given to a BigQuery load job
+    Returns:
+        Int: the number of rows loaded
+    """
+
+    fpath = local_table_file(dataset_nm, table_nm, job_id)
+    tmp_path = hidden_path(fpath)
+
+    n_rows = 0
+    writer = None
+    for uri in uris:
+        table = pq.read_table(uri)
+        if writer is None:
+            writer = pq.ParquetWriter(tmp_path, table.schema)
+        writer.write_table(table)
+        n_rows += table.num_rows
+
+    if writer is not None:
+        writer.close()
+        os.replace(tmp_path, fpath)
+
+    return n_rows
@@ -0,0 +1,387 @@
+
+import io
+import os
+import re
+import hashlib
+from collections import namedtuple
+import pandas as pd
+import config as cfg
+import swat_cache
+import swat_decode
+import swat_io
+
+
+# layouts compiled by this instance, keyed by header hash, so warm invocations skip detection
+layouts = {}
+
+
+class Layout(namedtuple('Layout', ['ftype', 'skip_rows', 'stride', 'col_widths', 'dtypes', 'names', 'usecols', 'n_locations', 'key'])):
+    """Column layout of an output file, worked out from its header and first
+    time step by detect(). Immutable, so one Layout can be shared by every
+    reader of files with the same header.
+
+    Fields:
+        ftype: the file type, e.g. 'hru'
+        skip_rows: number of lines (including the header) before the data
+        stride: characters per data line, without the line ending
+        col_widths: tuple of fixed column widths of the data lines
+        dtypes: tuple of the dtype of each column, None where it's inferred
+        names: tuple of the field name of each column
+        usecols: tuple of the columns decoded (the label column is cut from some types)
+        n_locations: rows per time step, i.e. reaches, HRUs or subbasins
+        key: hash of the header lines and line width the layout is cached by
+    """
+
+    __slots__ = ()
+
+    @property
+    def colspecs(self):
+
+        return swat_decode.col_specs(self.col_widths)
+
+    def dtype_map(self):
+        """Dict of column index to dtype, as taken by swat_decode.read_fixed and pd.read_fwf"""
+
+        return {i : d for i, d in enumerate(self.dtypes) if d is not None}
+
+    def out_names(self):
+        """Names of the decoded columns"""
+
+        return [self.names[c] for c in self.usecols]
+
+
+def clean_name(ftype, name):
+    """Function to turn a header field into the field name used in BigQuery for the file type"""
+
+    if ftype == 'hru':
+        return name.replace('/', '_')
+
+    return re.sub('[^A-Za-z0-9_ ]', '', name).replace(" ", "_")
+
+
+def parse_headers(data):
+    """Function to parse file_metadata_headers.csv, dropping the compiled layouts
+    as their field names may have come from an older version of it"""
+
+    layouts.clear()
+
+    return pd.read_csv(io.BytesIO(data))
+
+
+def csv_headers():
+    """Function to get file_metadata_headers.csv as a DataFrame
+
+    The table is downloaded the first time an instance needs it, and checked
+    for a new version once it's been cached for cfg.cache_ttl_s seconds.
+    """
+
+    blob = swat_io.get_bucket(cfg.headers_bucket).blob(cfg.headers_path)
+
+    return swat_cache.read_object('headers', blob, parse_headers, cfg.cache_ttl_s)
+
+
+def read_csv_names(ftype):
+    """Function to get the field names of a file type from file_metadata_headers.csv,
+    or None if the table has no column for the type
+
+    Types not in cfg.csv_header_files are always named from their header.
+    """
+
+    if ftype not in cfg.csv_header_files:
+        return None
+
+    headers = csv_headers()
+    if ftype not in headers.columns:
+        return None
+
+    return [str(v) for v in headers[ftype][~headers[ftype].isnull()].values]
+
+
+def find_header(lines, ftype):
+    """Function to find the header line of an output file, the first line starting
+    with the first field name of the type (cfg.header_first_field)
+
+    Returns:
+        Int: index of the header line, falling back on cfg.file_skips if there's none
+    """
+
+    for i, line in enumerate(lines):
+        if line.split()[:1] == [cfg.header_first_field[ftype]]:
+            return i
+
+    print("No header starting '{}' found in {} file, using {} header lines from config.py".format(
+        cfg.header_first_field[ftype], ftype, cfg.file_skips[ftype]))
+
+    return cfg.file_skips[ftype] - 1
+
+
+def label_pad(fixed, id_col, lines):
+    """Function to find how many characters wider than in config.py the label column
+    of the data lines is, from where the right-aligned location id ends
+
+    Args:
+        fixed: the fixed column widths from config.py
+        id_col: index of the location id column, None if the type has none
+        lines: sample data lines
+    Returns:
+        Int: characters to add to the first column
+    """
+
+    if not id_col:
+        return 0
+
+    end = sum(fixed[:id_col + 1])
+    for pad in range(3):
+        if all(line[end + pad - 1].isdigit() and (end + pad >= len(line) or line[end + pad] == ' ') for line in lines):
+            return pad
+
+    raise ValueError("Location ids don't line up with the column widths in config.py")
+
+
+def var_widths(start, width, var_width, lines):
+    """Function to split the variable part of the data lines into columns
+
+    Variable columns are var_width wide, but a SWAT file can have columns a
+    character wider than the rest (e.g. the 19th variable of output.sub).
+    Values are right-aligned, so where a column is too narrow the field after
+    it starts with a digit on every line rather than a space. Each wider
+    column is found as the first such field and widened by one, until the
+    columns fill the line.
+
+    Args:
+        start: character offset of the first variable column
+        width: characters per data line
+        var_width: the usual variable column width
+        lines: sample data lines
+    Returns:
+        List: the width of each variable column
+    """
+
+    n_var = (width - start) // var_width
+    widths = [var_width] * n_var
+    extra = width - start - (n_var * var_width)
+
+    # trailing spaces are padding rather than data
+    if not any(line[width - extra:width].strip() for line in lines):
+        return widths
+
+    for k in range(extra):
+        pos = start
+        for j in range(n_var - 1):
+            pos += widths[j]
+            if all(line[pos] != ' ' for line in lines):
+                widths[j] += 1
+                break
+        else:
+            raise ValueError("Data lines are {} characters wider than their {} variable columns".format(extra - k, n_var))
+
+    return widths
+
+
+def compile_layout(ftype, header, lines, skip_rows, key):
+    """Function to work out the columns of an output file from its header line
+    and a sample of data lines from the first time step
+
+    Returns:
+        Layout: with n_locations left as None
+    """
+
+    fixed = list(cfg.fixed_col_widths[ftype])
+    width = len(lines[0])
+
+    if ftype == 'pst':
+        col_widths = fixed
+        h_widths = fixed
+    else:
+        var_width = cfg.var_col_width[ftype]
+        h_names = swat_decode.header_names(header, fixed)
+        loc_nm = cfg.location_cols.get(ftype)
+        id_col = h_names.index(loc_nm) if loc_nm in h_names else None
+
+        pad = label_pad(fixed, id_col, lines)
+        col_widths = [fixed[0] + pad] + fixed[1:]
+        col_widths += var_widths(sum(col_widths), width, var_width, lines)
+
+        # the header isn't padded, its names line up with evenly spaced columns
+        h_widths = fixed + ([var_width] * (len(col_widths) - len(fixed)))
+
+    names = [clean_name(ftype, nm) for nm in swat_decode.header_names(header, h_widths)]
+    usecols = list(range(1 if ftype in cfg.file_cut else 0, len(col_widths)))
+
+    csv_names = read_csv_names(ftype)
+    if csv_names is not None:
+        if len(csv_names) != len(usecols):
+            raise ValueError("n columns in {} output file ({}) does not match n columns in 'file_metadata_headers.csv' ({})".format(
+                ftype, len(usecols), len(csv_names)))
+        names = names[:usecols[0]] + csv_names
+
+    if ftype in cfg.var_col_dtypes:
+        dtypes = list(cfg.fixed_col_dtypes[ftype]) + ([cfg.var_col_dtypes[ftype]] * (len(col_widths) - len(fixed)))
+    else:
+        dtypes = [None] * len(col_widths)
+
+    return Layout(ftype, skip_rows, width, tuple(col_widths), tuple(dtypes), tuple(names), tuple(usecols), None, key)
+
+
+def count_locations(layout, lines):
+    """Function to count the rows in the first time step, as the rows before the
+    first location id comes round again
+
+    Returns:
+        Int: rows per time step, 1 for types without a location field, or None
+        if the sample ends before the first time step does
+    """
+
+    loc_nm = cfg.location_cols.get(layout.ftype)
+    if (layout.ftype == 'pst') or (loc_nm not in layout.names):
+        return 1
+
+    s, e = layout.colspecs[layout.names.index(loc_nm)]
+    ids = [line[s:e] for line in lines]
+
+    if ids[0] in ids[1:]:
+        return ids.index(ids[0], 1)
+
+    return None
+
+
+def detect(ftype, sample, whole=False):
+    """Function to get the layout of an output file from the first bytes of it
+
+    The column layout is compiled once per distinct header and line width,
+    and cached; the location count is taken from the first time step of
+    each file, as files with the same header can come from different
+    watersheds.
+
+    Args:
+        ftype: the file type, e.g. 'rch'
+        sample: bytes from the start of the file
+        whole: sample is the whole file
+    Returns:
+        Layout: the layout, with n_locations None if the sample is too short to count them
+    """
+
+    lines = sample.decode('ascii', errors='replace').split('\n')
+    if not whole:
+        lines = lines[:-1]
+    lines = [line.rstrip('\r') for line in lines]
+
+    h = find_header(lines, ftype)
+    skip_rows = h + 1
+    data = [line for line in lines[skip_rows:skip_rows + cfg.layout_sample_lines] if line.strip()]
+    if not data:
+        raise ValueError("No data lines found after the header of the {} file".format(ftype))
+
+    # only full width lines of the first block, summary rows at the end of the file can be shorter
+    data = [line for line in data if len(line) == len(data[0])]
+
+    key = hashlib.sha1('\n'.join(lines[:skip_rows] + [str(len(data[0]))]).encode('utf-8')).hexdigest()[:16]
+
+    # a new version of file_metadata_headers.csv clears the layouts named from it
+    if ftype in cfg.csv_header_files:
+        csv_headers()
+
+    layout = layouts.get(key)
+    if layout is None:
+        layout = compile_layout(ftype, lines[h], data, skip_rows, key)
+        layouts[key] = layout
+        print("Compiled {} layout {}: {} header lines, {} columns".format(ftype, key, skip_rows, len(layout.col_widths)))
+
+    data = [line for line in lines[skip_rows:] if len(line) == layout.stride]
+
+    return layout._replace(n_locations=count_locations(layout, data))
+
+
+def read_layout(ftype, read_fn, size):
+    """Function to detect the layout of a file, reading more of it until the
+    sample covers the first time step
+
+    Args:
+        ftype: the file type
+        read_fn: function returning the first n bytes of the file
+        size: the size of the file in bytes, None if it isn't known until the
+            end is read (e.g. a compressed file)
+    Returns:
+        Layout: with n_locations from the file, or from cfg.unique_locations
+        if the first time step is longer than cfg.layout_sample_bytes
+    """
+
+    n = min(2**20, cfg.layout_sample_bytes)
+    while True:
+        data = read_fn(n if size is None else min(n, size))
+        complete = (len(data) < n) if size is None else (n >= size)
+        layout = detect(ftype, data, complete)
+        if (layout.n_locations is not None) or complete or (n >= cfg.layout_sample_bytes):
+            break
+        n *= 4
+
+    if layout.n_locations is None:
+        n_loc = cfg.unique_locations.get(ftype, 1)
+        print("First time step of {} file is longer than {} bytes, using {} locations from config.py".format(
+            ftype, cfg.layout_sample_bytes, n_loc))
+        layout = layout._replace(n_locations=n_loc)
+
+    return layout
+
+
+def file_reader(fpath):
+    """Function to get a function returning the first n bytes of a local file"""
+
+    def read_fn(n):
+        with open(fpath, 'rb') as file:
+            return file.read(n)
+
+    return read_fn
+
+
+def blob_reader(blob, compression=None):
+    """Function to get a function returning the first n bytes of a blob, with a ranged
+    read, or of the file a compressed blob decompresses to"""
+
+    if blob.size is None:
+        blob.reload()
+
+    return lambda n: swat_io.read_head(blob, n, compression)
+
+
+def file_layout(ftype, fpath):
+    """Function to detect the layout of a local output file"""
+
+    return read_layout(ftype, file_reader(fpath), os.path.getsize(fpath))
+
+
+def blob_layout(ftype, blob, compression=None):
+    """Function to detect the layout of an output file in a bucket, with ranged reads
+    of its start, decompressed if compression is 'gzip' or 'zstd'"""
+
+    read_fn = blob_reader(blob, compression)
+
+    return read_layout(ftype, read_fn, None if compression else blob.size)
+
+
+def data_position(layout, read_fn):
+    """Function to find where the data lines of a file start in bytes, so a
+    line can be located without reading the lines before it
+
+    The header lines and line ending aren't part of the layout, as files
+    sharing a layout can differ in both, so they're read from the file.
+
+    Args:
+        layout: the Layout of the file
+        read_fn: function returning the first n bytes of the file, e.g. from file_reader
+    Returns:
+        Tuple: (start, stride) - byte offset of the first data line and bytes
+        per line, including the line ending
+    """
+
+    head = read_fn(2**16)
+    while head.count(b'\n') <= layout.skip_rows:
+        more = read_fn(len(head) * 4)
+        if len(more) == len(head):
+            break
+        head = more
+
+    start = swat_decode.data_offset(head, layout.skip_rows)
+    stride, eol = swat_decode.line_stride(head, start)
+
+    return start, stride
@@ -0,0 +1,821 @@
+import pandas as pd 
+import config as cfg
+import swat_format
+import swat_decode
+import swat_io
+import swat_upload
+import swat_store
+import swat_trace
+import swat_memory
+import swat_runs
+import swat_layout
+import swat_state
+import swat_cache
+import swat_scratch
+import os
+import gc
+import time
+import io
+import pyarrow as pa
+from datetime import datetime
+
+
+def write_to_tmp(bucket_nm, file_path, scratch, size=None):
+    """Function to write a file in a bucket to temp folder for function to work with
+
+    Args:
+        bucket_nm: The name of the bucket the file is stored in 
+        file_path: The location of the file
+        scratch: the swat_scratch.Scratch folder of the invocation, in which
+            space for the file is reserved before it's downloaded
+        size: size of the file in bytes if known, e.g. from the event, otherwise
+            it's looked up
+    Returns:
+        String: the location of the file written to temp storage
+        e.g. 'tmp/swat_xxxxxxxx/file_name'
+    """
+
+    tmp_path = scratch.file(file_path.split('/')[-1])
+    
+    with swat_trace.span('download') as span:
+        bucket = swat_io.get_bucket(bucket_nm)
+        blob = bucket.blob(file_path)
+        if size is None:
+            blob.reload()
+            size = blob.size
+        scratch.reserve(int(size), file_path)
+
+        # large files are fetched over several streams at once
+        if int(size) >= cfg.sliced_download_mb * 10**6:
+            swat_io.download_sliced(blob, tmp_path)
+        else:
+            blob.download_to_filename(tmp_path)
+        span.add(bytes_in = os.path.getsize(tmp_path))
+    
+    return tmp_path
+
+
+def push_to_bq(df, dataset_nm, table_nm, job_id=None):
+    """Function to push a dataframe to a BigQuery table
+
+    Args:
+        df: dataframe to be loaded into BigQuery, or an Arrow RecordBatch,
+            which is sent as parquet without a round trip through pandas
+        dataset_nm: name of the target data set in in BigQuery
+        table_nm: name of the target table in BigQuery
+        job_id: id to give the load job, so a checkpointed load can tell
+            whether the chunk was loaded (see job_done)
+    Returns:
+        None; the number of rows uploaded is printed
+    """
+    
+    # write to local parquet stand-in for offline runs
+    if cfg.local_bq_root:
+        swat_io.append_local_table(df, dataset_nm, table_nm, job_id)
+        print('Loaded {} rows.'.format(len(df)))
+        return
+
+    from google.cloud import bigquery
+    from google.api_core.exceptions import BadRequest
+
+    bq_client = swat_cache.bq_client()
+    
+    job_config = bigquery.LoadJobConfig()
+    job_config.write_disposition = 'WRITE_APPEND' 
+
+    # load the date field as a DATE rather than a DATETIME, adding it and run_id to older tables
+    names = df.schema.names if isinstance(df, (pa.RecordBatch, pa.Table)) else df.columns
+    if 'date' in names:
+        job_config.schema = [bigquery.SchemaField('date', 'DATE')]
+    if ('date' in names) or ('run_id' in names):
+        job_config.schema_update_options = [bigquery.SchemaUpdateOption.ALLOW_FIELD_ADDITION]
+
+    table_ref = bq_client.dataset(dataset_nm).table(table_nm)
+
+    # send Arrow data, and dataframes with categorical fields, as parquet (dictionary fields load as STRING)
+    if isinstance(df, (pa.RecordBatch, pa.Table)) or any(isinstance(t, pd.CategoricalDtype) for t in df.dtypes):
+        job_config.source_format = bigquery.SourceFormat.PARQUET
+        job = bq_client.load_table_from_file(io.BytesIO(swat_io.parquet_bytes(df)), table_ref, job_id=job_id, job_config=job_config)
+    else:
+        job = bq_client.load_table_from_dataframe(df, table_ref, job_id=job_id, job_config=job_config) 
+    
+    try:
+        job.result()  # Waits for table load to complete.
+    except BadRequest as err:
+        print(job.errors)
+        raise
+        
+    print('Loaded {} rows.'.format(job.output_rows))
+
+
+def push_staged_to_bq(uris, dataset_nm, table_nm, job_id=None):
+    """Function to load staged parquet files into a BigQuery table with a single load job
+
+    Args:
+        uris: list of 'gs://' URIs of the staged parquet files
+        dataset_nm: name of the target data set in in BigQuery
+        table_nm: name of the target table in BigQuery
+        job_id: id to give the load job
+    Returns:
+        None; the number of rows uploaded is printed
+    """
+
+    # load into local parquet stand-in for offline runs
+    if cfg.local_bq_root:
+        n_rows = swat_io.load_local_table(uris, dataset_nm, table_nm, job_id)
+        print('Loaded {} rows from {} staged files.'.format(n_rows, len(uris)))
+        return
+
+    from google.cloud import bigquery
+    from google.api_core.exceptions import BadRequest
+
+    bq_client = swat_cache.bq_client()
+
+    job_config = bigquery.LoadJobConfig()
+    job_config.source_format = bigquery.SourceFormat.PARQUET
+    job_config.write_disposition = 'WRITE_APPEND'
+    job_config.schema_update_options = [bigquery.SchemaUpdateOption.ALLOW_FIELD_ADDITION]
+
+    table_ref = bq_client.dataset(dataset_nm).table(table_nm)
+    job = bq_client.load_table_from_uri(uris, table_ref, job_id=job_id, job_config=job_config)
+
+    try:
+        job.result()  # Waits for table load to complete.
+    except BadRequest as err:
+        print(job.errors)
+        raise
+
+    print('Loaded {} rows from {} staged files.'.format(job.output_rows, len(uris)))
+
+
+def job_done(job_id, dataset_nm, table_nm):
+    """Function to check whether the load job with the given id loaded its rows,
+    for a checkpointed load resuming after the invocation that started the job
+    was stopped. A job that's still running is waited for.
+
+    Args:
+        job_id: id the load job was given
+        dataset_nm: name of the target data set in in BigQuery
+        table_nm: name of the target table in BigQuery
+    Returns:
+        Bool: True if the job finished without errors
+    """
+
+    if cfg.local_bq_root:
+        return swat_io.local_job_done(job_id, dataset_nm, table_nm)
+
+    from google.api_core.exceptions import NotFound, GoogleAPICallError
+
+    try:
+        job = swat_cache.bq_client().get_job(job_id)
+        job.result()
+
+    except NotFound:
+        return False
+
+    except GoogleAPICallError as err:
+        print('Load job {} failed: {}'.format(job_id, err))
+        return False
+
+    return True
+
+
+def read_cio(fpath):
+    """Function to read the file.cio which model run information
+
+    Args:
+        fpath: the path to the file in temp, or a file-like object of it
+    Returns:
+        Dict; storing the start and end dates of the model run period
+        with two years added to the start, and 2 years subtracted from the
+        duration to account for the two year model wind up period.
+    """
+    
+    cio = pd.read_fwf(fpath, skiprows = 7, header = None, nrows = 4)
+    
+    # values may be parsed as numbers or as text running on into the description
+    n_years = int(str(cio.loc[0, 0]).split(' ')[0]) - 2
+    year_start = int(str(cio.loc[1, 0]).split(' ')[0]) + 2
+
+    dict_cio = {'start' : datetime(year_start,1,1),
+                'end' : datetime(year_start + n_years - 1,12,31)}
+    
+    return dict_cio
+
+
+def run_cio(bucket_nm, path_cio):
+    """Function to get the run period from the file.cio of a run folder in a bucket,
+    parsed once per generation of the file by an instance (see swat_cache.read_object)
+
+    Args:
+        bucket_nm: The name of the bucket the file is stored in
+        path_cio: The location of the file.cio
+    Returns:
+        Dict: as from read_cio, shared by every load of the run on the instance
+    """
+
+    blob = swat_io.get_bucket(bucket_nm).blob(path_cio)
+
+    return swat_cache.read_object('cio', blob, lambda data: read_cio(io.BytesIO(data)))
+
+
+def staged_load(ftype, model_desc, model_period, checkpoint=None):
+    """Function to get the StagedLoad a file's chunks are staged in
+
+    A checkpointed load is staged under a folder named for its checkpoint,
+    so a retry of it finds the chunks it staged, which are added back.
+
+    Returns:
+        StagedLoad: for the file
+    """
+
+    stage_id = checkpoint.key if checkpoint is not None else datetime.now().strftime("%Y%m%d%H%M%S%f")
+    stage = swat_upload.StagedLoad(cfg.staging_bucket, '/'.join([cfg.staging_prefix, model_desc + '_' + model_period, ftype, stage_id]))
+
+    if (checkpoint is not None) and checkpoint.resumed:
+        stage.restore(checkpoint.committed_jobs(), sum(n for _, n in checkpoint.committed()), "healthy_gulf", "SWAT_output_" + ftype)
+
+    return stage
+
+
+def load_chunks(chunks, formatter, ftype, model_desc, model_period, date_index, sizer=None, run_id=None, checkpoint=None, byte_offset=None,
+                upload_pool=None):
+    """Function to format a file's chunks and push them to BigQuery, with
+    uploads running on a thread pool while the next chunk is parsed.
+
+    For file types in cfg.staged_load_files the chunks are staged as parquet
+    files and loaded with one job once the whole file has been read, so a
+    failure part way through leaves nothing half-loaded in the table.
+
+    With a checkpoint, each chunk is noted in it as it's queued and once it's
+    uploaded, under a job id of its own. The chunks should start at the
+    checkpoint's resume row, and rows committed by an earlier attempt at the
+    load are skipped, so none are loaded twice.
+
+    Args:
+        chunks: iterator of DataFrame chunks of the output file, in file order
+        formatter: the swat_format function for the file type, e.g. format_hru
+        ftype: the file type, e.g. 'hru'
+        model_desc: model information from the folder name
+        model_period: either 'monthly' or 'daily'
+        date_index: swat_format.DateIndex for the file
+        sizer: the swat_memory.ChunkSizer picking the size of the chunks, told
+            the size of each chunk once it's queued so it can adjust the next
+        run_id: id of the load in the SWAT_runs table, written on each row in
+            place of the metadata fields if given
+        checkpoint: the swat_state.Checkpoint of the load, None to load without one
+        byte_offset: function of a data row number giving the byte offset of
+            its line in the file, for the checkpoint
+        upload_pool: thread pool the uploads run on, shared with other files
+            loaded at the same time, a pool of the file's own if None
+    Returns:
+        Int: rows loaded; the time spent in each stage is printed
+    """
+
+    if checkpoint is not None:
+        load_time = checkpoint.state['load_time']
+        row_offset = checkpoint.resume_row()
+    else:
+        load_time = datetime.now().strftime("%Y/%m/%d %H:%M:%S")
+        row_offset = 0
+
+    wall_start = time.perf_counter()
+    decode_s = 0.0
+    format_s = 0.0
+    n_loaded = 0
+    table_nm = "SWAT_output_" + ftype
+
+    if ftype in cfg.staged_load_files:
+        stage = staged_load(ftype, model_desc, model_period, checkpoint)
+        upload_fn = stage.write
+    else:
+        stage = None
+        upload_fn = push_to_bq
+
+    # also write the rows to the local parquet store, keeping those of the chunks a resumed load has committed
+    if cfg.store_root:
+        keep = checkpoint.committed_jobs() if (checkpoint is not None) and checkpoint.resumed else None
+        upload_fn = swat_store.tee(upload_fn, swat_store.RunWriter(ftype, model_desc, model_period, keep = keep))
+
+    def upload_chunk(df, dataset_nm, table_nm, chunk_id=None):
+        if chunk_id is None:
+            upload_fn(df, dataset_nm, table_nm)
+        else:
+            # the chunk is written to the checkpoint as pending before its upload starts
+            checkpoint.flush()
+            upload_fn(df, dataset_nm, table_nm, checkpoint.job_id(chunk_id))
+            checkpoint.commit(chunk_id)
+
+    try:
+        with swat_upload.Uploader(upload_chunk, pool = upload_pool) as uploader:
+
+            chunks = iter(chunks)
+            i = 0
+            while True:
+
+                start = time.perf_counter()
+                with swat_trace.span('decode') as span:
+                    chunk = next(chunks, None)
+                    if chunk is not None:
+                        span.add(rows = len(chunk), bytes_out = swat_trace.nbytes(chunk))
+                chunk_decode_s = time.perf_counter() - start
+                decode_s += chunk_decode_s
+                if chunk is None:
+                    break
+
+                # rows already committed by an earlier attempt at a checkpointed load are cut out
+                ranges = checkpoint.uncommitted(row_offset, len(chunk)) if checkpoint is not None else [(0, len(chunk))]
+
+                start = time.perf_counter()
+                pieces = []
+                with swat_trace.span('format', rows = len(chunk)):
+                    for s, e in ranges:
+                        df = chunk if (e - s == len(chunk)) else swat_format.slice_rows(chunk, s, e)
+
+                        # format chunk to add in date field, summary rows were skipped by the reader so row_offset counts data rows
+                        df = formatter(df, model_period, date_index, row_offset + s)
+
+                        # add model info
+                        df = swat_format.add_metadata(df, load_time, model_desc, model_period, run_id)
+                        pieces.append((row_offset + s, e - s, df))
+
+                    row_offset += len(chunk)
+                chunk_format_s = time.perf_counter() - start
+                format_s += chunk_format_s
+
+                for first_row, n_rows, df in pieces:
+                    if checkpoint is None:
+                        uploader.submit(df, "healthy_gulf", table_nm)
+                    else:
+                        chunk_id = checkpoint.queue(first_row, n_rows, byte_offset(first_row), byte_offset(first_row + n_rows))
+                        uploader.submit(df, "healthy_gulf", table_nm, chunk_id)
+
+                n_rows = sum(len(df) for _, _, df in pieces)
+                n_loaded += n_rows
+                swat_trace.chunk(i, rows = n_rows, row_offset = row_offset, decode_s = round(chunk_decode_s, 3),
+                                 format_s = round(chunk_format_s, 3))
+                print("Chunk {} queued, {} rows, RSS {:.1f}MB".format(i, n_rows, swat_trace.rss_mb()))
+                if sizer is not None:
+                    sizer.observe(len(chunk))
+                i += 1
+
+        # every time step of the run should have been loaded once the summary rows are dropped
+        if row_offset != date_index.n_rows:
+            print("Length of {} output file is not as expected from the file.cio, please check they're from the same model run".format(model_period))
+            raise ValueError("Output file has {} data rows, expected {}".format(row_offset, date_index.n_rows))
+
+        if stage is not None:
+            start = time.perf_counter()
+            with swat_trace.span('load', rows = stage.n_rows, bytes_out = stage.n_bytes):
+                stage.load(push_staged_to_bq, checkpoint.queue_load() if checkpoint is not None else None)
+            print("Bulk load took {:.1f}s".format(time.perf_counter() - start))
+
+        if checkpoint is not None:
+            checkpoint.finish()
+
+    finally:
+        # the staged chunks of a checkpointed load are kept for a retry until they've been loaded
+        if (stage is not None) and ((checkpoint is None) or checkpoint.loaded):
+            with swat_trace.span('cleanup'):
+                stage.cleanup()
+
+    wall_s = time.perf_counter() - wall_start
+    print("Stage timings for {} chunks: decode {:.1f}s, format {:.1f}s, upload {:.1f}s ({:.1f}s waiting on uploads), wall {:.1f}s, overlap saved {:.1f}s".format(
+        uploader.n_chunks, decode_s, format_s, uploader.upload_seconds, uploader.wait_seconds, wall_s,
+        decode_s + format_s + uploader.upload_seconds - wall_s))
+
+    if sizer is not None:
+        swat_trace.note(**sizer.summary())
+        print("Peak RSS {:.1f}MB of the {:.0f}MB memory budget, chunks of {} rows planned, largest {} rows".format(
+            swat_trace.peak_rss_mb(), sizer.budget_mb, sizer.planned, sizer.largest))
+
+    return n_loaded
+
+
+def chunks_SWAT(fpath, ftype, chunk_s, engine=cfg.read_engine, blob=None, workers=cfg.parse_workers, chunk_format=cfg.chunk_format, layout=None, summaries=None, start_line=0,
+                compression=None):
+    """Generator reading a SWAT model output file (any type but pst) in chunks
+
+    Args:
+        fpath: the file location in gcloud temp storage
+        ftype: the file type, e.g. 'hru'
+        chunk_s: the number of rows in each chunk, or a swat_memory.ChunkSizer to
+            size them from the memory budget
+        engine: 'numpy' to decode with swat_decode, 'pandas' for pd.read_fwf
+        blob: if given, the file is streamed from this Blob rather than read from fpath
+        workers: number of processes decoding chunks in parallel, numpy engine only
+        chunk_format: 'arrow' to yield pyarrow RecordBatches, numpy engine only
+        layout: the swat_layout.Layout of the file, detected from its header if None
+        summaries: swat_format.SummaryFilter of a monthly file, whose summary
+            rows are skipped as the file is decoded (dropped from each chunk
+            with the pandas engine)
+        start_line: number of data lines to seek past, to resume a load part
+            way through the file. A streamed file is only downloaded from there,
+            unless it's compressed, when the lines before are decompressed and dropped
+        compression: 'gzip' or 'zstd' to decompress blob as it's streamed
+    Yields:
+        DataFrame or RecordBatch: chunk of the output file with cleaned column names
+    """
+
+    with swat_trace.span('header'):
+        if layout is None:
+            layout = swat_layout.blob_layout(ftype, blob, compression) if blob is not None else swat_layout.file_layout(ftype, fpath)
+
+        col_widths = list(layout.col_widths)
+        dtypes = layout.dtype_map()
+        usecols = list(layout.usecols)
+
+        # vel chunks are reshaped by format_vel with pandas
+        if ftype == 'vel':
+            chunk_format = 'pandas'
+
+        if isinstance(chunk_s, swat_memory.ChunkSizer):
+            chunk_s.plan(col_widths, dtypes, usecols, arrow = (chunk_format == 'arrow') and (engine == 'numpy' or blob is not None))
+
+    # read file
+    if blob is not None:
+        skip_rows = layout.skip_rows
+        start_byte = 0
+        if start_line:
+            start, stride = swat_layout.data_position(layout, swat_layout.blob_reader(blob, compression))
+            skip_rows = 0
+            start_byte = start + (start_line * stride)
+
+        reader = swat_decode.iter_fixed_blocks(swat_io.stream_lines(blob, start = start_byte, compression = compression), 
+                                               skip_rows,
+                                               col_widths,
+                                               dtypes = dtypes,
+                                               names = list(layout.names),
+                                               usecols = usecols,
+                                               chunksize = chunk_s,
+                                               arrow = chunk_format == 'arrow',
+                                               row_filter = summaries)
+
+    elif engine == 'numpy':
+        reader = swat_decode.read_fixed(fpath, 
+                                        layout.skip_rows,
+                                        col_widths,
+                                        dtypes = dtypes,
+                                        names = list(layout.names),
+                                        usecols = usecols,
+                                        chunksize = chunk_s,
+                                        workers = workers,
+                                        arrow = chunk_format == 'arrow',
+                                        row_filter = summaries,
+                                        start_line = start_line)
+
+    else:
+        # keep the header line, which is read as the column names
+        header = layout.skip_rows - 1
+        reader = pd.read_fwf(fpath, 
+                             skiprows = (lambda i: (i < header + start_line + 1) and (i != header)) if start_line else header,
+                             widths = col_widths,
+                             dtype = dtypes, 
+                             chunksize = swat_decode.chunk_rows(chunk_s))
+
+    for chunk in reader:
+
+        if (blob is None) and (engine != 'numpy'):
+            chunk.columns = layout.names
+            chunk = chunk.iloc[:, usecols]
+            if summaries is not None:
+                chunk = summaries.drop(chunk)
+                if not len(chunk):
+                    continue
+
+        yield chunk
+
+
+def summary_filter(layout, model_period, date_index, row_offset=0):
+    """Function to get the filter skipping the summary rows of a monthly output file as it's decoded
+
+    Args:
+        row_offset: data rows before the first line decoded, when a load resumes
+    Returns:
+        swat_format.SummaryFilter: or None for daily files and types without a MON field
+    """
+
+    if (model_period == 'monthly') and ('MON' in layout.names):
+        return swat_format.SummaryFilter(date_index, layout.colspecs[layout.names.index('MON')], row_offset)
+
+    return None
+
+
+def read_SWAT_chunked(fpath, ftype, model_desc, model_period, date_index, engine=cfg.read_engine, blob=None, run_id=None, layout=None, checkpoint=None,
+                      budget_mb=None, upload_pool=None, compression=None):
+    """Function to load a SWAT model output file (any type but pst) into BigQuery
+    chunk by chunk, so no file is ever held in memory whole
+
+    Args:
+        fpath: the file location in gcloud temp storage, None if streamed from blob
+        ftype: the file type, e.g. 'rch'
+        model_desc: model information from the folder name
+        model_period: either 'monthly' or 'daily'
+        date_index: swat_format.DateIndex for the file
+        engine: 'numpy' to decode with swat_decode, 'pandas' for pd.read_fwf
+        blob: if given, the file is streamed from this Blob rather than read from fpath
+        run_id: id of the load in the SWAT_runs table
+        layout: the swat_layout.Layout of the file
+        checkpoint: the swat_state.Checkpoint of the load, which is resumed
+            from its first uncommitted row
+        budget_mb: memory the load's chunks are sized to fit in, defaults to cfg.memory_budget_mb
+        upload_pool: thread pool shared by the uploads of several files, as for load_chunks
+        compression: 'gzip' or 'zstd' to decompress blob as it's streamed
+    Returns:
+        Int: rows loaded
+    """
+
+    row = checkpoint.resume_row() if checkpoint is not None else 0
+    summaries = summary_filter(layout, model_period, date_index, row)
+    sizer = swat_memory.ChunkSizer(ftype, budget_mb)
+
+    # lines of the file before a row, counting the summary rows skipped, and their offset in bytes
+    line_offset = summaries.line_offset if summaries is not None else (lambda row: row)
+    byte_offset = None
+    if checkpoint is not None:
+        start, stride = swat_layout.data_position(layout, swat_layout.blob_reader(blob, compression) if blob is not None else swat_layout.file_reader(fpath))
+        byte_offset = lambda row: start + (line_offset(row) * stride)
+        if row:
+            print("Seeking to row {} of {} file, line {} at byte {}".format(row, ftype, line_offset(row), byte_offset(row)))
+
+    if row < date_index.n_rows:
+        chunks = chunks_SWAT(fpath, ftype, sizer, engine, blob, layout = layout, summaries = summaries, start_line = line_offset(row),
+                             compression = compression)
+    else:
+        chunks = iter([])
+
+    n_rows = load_chunks(chunks, getattr(swat_format, 'format_' + ftype), ftype, model_desc, model_period, date_index, sizer, run_id,
+                         checkpoint, byte_offset, upload_pool)
+
+    if summaries is not None:
+        print("Skipped {} summary rows".format(summaries.n_summary))
+
+    print("{} done!".format(ftype.upper()))
+
+    return n_rows
+
+
+def read_SWAT_pst(fpath, layout=None, data=None):
+    """Function to carry out custom read-in of a SWAT model output.pst file
+
+    Args:
+        fpath: the file location in gcloud temp storage, or just its name if data is given
+        layout: the swat_layout.Layout of the file, detected from its header if None
+        data: the contents of the file, if they were decompressed into memory
+            rather than written to fpath
+    Returns:
+        DataFrame: A basically formatted version of the output file
+        with the field names of its layout but no further 
+        file-specific formatting
+    """
+
+    # pull file type from the filename
+    ftype = fpath.split('.')[-1]
+
+    with swat_trace.span('header'):
+        layout = layout or swat_layout.file_layout(ftype, fpath)
+
+        # extract lines above the header from top of file
+        with (io.TextIOWrapper(io.BytesIO(data)) if data is not None else open(fpath)) as file:
+            head = [next(file) for x in range(layout.skip_rows - 1)]
+    
+    # the last line above the header ends with the chemical value, e.g. ' Pesticide # 1       1'
+    chem_val = [line for line in head if line.strip()][-1].split()[-1]
+    
+    
+    # read file - widths are fixed so the weird annual summary text at the bottom of the file doesn't throw them off
+    with swat_trace.span('decode', bytes_in = len(data) if data is not None else os.path.getsize(fpath)) as span:
+        df = pd.read_fwf(io.BytesIO(data) if data is not None else fpath, 
+                         skiprows = layout.skip_rows, 
+                         header = None, 
+                         widths = list(layout.col_widths)) 
+        span.add(rows = len(df), bytes_out = swat_trace.nbytes(df))
+    
+    # add in column headers
+    try:
+        df.columns = layout.out_names()
+
+    except ValueError:
+        print("n columns in output file {} does not match n columns in its layout".format(fpath))
+        raise
+    
+    # add in chemical value column
+    df['chem_value'] = chem_val
+    
+    return df
+
+
+
+def open_checkpoint(event, ftype, model_desc, model_period):
+    """Function to get the checkpoint of the load of an output file, working out
+    which of the writes left pending by an earlier attempt at it went through
+
+    Args:
+        event (dict): the Cloud Storage event of the output file
+        ftype: the file type, e.g. 'hru'
+        model_desc: model information from the folder name
+        model_period: either 'monthly' or 'daily'
+    Returns:
+        swat_state.Checkpoint: of the generation of the file in the event
+    """
+
+    generation = event.get('generation') or swat_io.get_bucket(event['bucket']).get_blob(event['name']).generation
+    checkpoint = swat_state.Checkpoint(event['name'], generation)
+
+    if checkpoint.resumed and not checkpoint.loaded:
+        table_nm = "SWAT_output_" + ftype
+        load_done = lambda job_id: job_done(job_id, "healthy_gulf", table_nm)
+
+        # chunks of staged types are written as staged files, of other types as load jobs
+        if ftype in cfg.staged_load_files:
+            stage = staged_load(ftype, model_desc, model_period, checkpoint)
+            checkpoint.resolve(lambda job_id: stage.part(job_id).exists(), load_done)
+            # the last attempt was stopped after its bulk load, leaving its staged files
+            if checkpoint.loaded:
+                staged_load(ftype, model_desc, model_period, checkpoint).cleanup()
+        else:
+            checkpoint.resolve(load_done)
+
+    return checkpoint
+
+
+def load_event(event, ftype, model_desc, model_period, compression=None):
+    """Function to load the output file named in a Cloud Storage event into BigQuery,
+    once main.route_event has found it's one to load
+
+    Args:
+        event (dict): as for main.bq_load
+        ftype: the file type, e.g. 'hru'
+        model_desc: model information from the folder name
+        model_period: either 'monthly' or 'daily'
+        compression: 'gzip' or 'zstd' for a compressed upload, None otherwise
+    Returns:
+        None
+    """
+
+    # skip a file whose content is already loaded for this model and file type, before anything is downloaded
+    hashes, loaded = find_duplicate(event, ftype, model_desc)
+    if loaded is not None:
+        return
+
+    # try reading in file.cio, unless this instance has already read the same version of it
+    try:
+        path_cio = os.path.split(event['name'])[0] + '/file.cio'
+        with swat_trace.span('header'):
+            cio_dict = run_cio(event['bucket'], path_cio)
+        
+    except:
+        print('file.cio is missing from directory. Please add in then re-upload output files.')
+        raise
+
+    # download into a folder of this invocation's own, so other invocations running on the instance keep their files
+    scratch = swat_scratch.Scratch()
+    try:
+        load_file(event, ftype, model_desc, model_period, cio_dict, hashes, scratch = scratch, compression = compression)
+
+    finally:
+        with swat_trace.span('cleanup'):
+            scratch.close()
+            # del df
+            gc.collect()
+
+
+def find_duplicate(event, ftype, model_desc):
+    """Function to look for an earlier load of the same content as the output file
+    in an event, for the same model and file type, from the file's hashes alone
+
+    Args:
+        event (dict): the Cloud Storage event of the output file
+        ftype: the file type, e.g. 'hru'
+        model_desc: model information from the folder name
+    Returns:
+        Tuple: (hashes, loaded) - the (md5, crc32c, size) of the file, None for
+        types not in cfg.dedup_files, and the record of the earlier load, or None
+    """
+
+    if ftype not in cfg.dedup_files:
+        return None, None
+
+    with swat_trace.span('dedup'):
+        hashes = swat_runs.source_hashes(event)
+        loaded = swat_state.find_loaded(model_desc, ftype, swat_runs.content_key(*hashes[:2]))
+
+    if loaded is not None:
+        print("'{}' has the same content as '{}', loaded as run {} at {}. Skipped {:.1f}MB".format(
+            event['name'], loaded['source_file'], loaded['run_id'], loaded['model_run_datetime'], hashes[2] / 10**6))
+        swat_trace.note(duplicate_of = loaded['run_id'], skipped_bytes = hashes[2])
+
+    return hashes, loaded
+
+
+def load_file(event, ftype, model_desc, model_period, cio_dict, hashes=None, local_blob=None, budget_mb=None, upload_pool=None,
+              scratch=None, compression=None):
+    """Function to load one output file into BigQuery, once its model info and
+    file.cio are known
+
+    Args:
+        event (dict): the Cloud Storage event of the output file
+        ftype: the file type, e.g. 'hru'
+        model_desc: model information from the folder name
+        model_period: either 'monthly' or 'daily'
+        cio_dict: the run period read from file.cio
+        hashes: (md5, crc32c, size) of the file from find_duplicate, to record
+            the content as loaded once it is. None to leave it unrecorded
+        local_blob: a swat_io.LocalBlob of a file on local disk, which is read
+            where it is rather than from the bucket in the event
+        budget_mb: memory the chunks are sized to fit in, defaults to the share
+            of the scratch folder's invocation
+        upload_pool: thread pool shared by the uploads of several files, as for load_chunks
+        scratch: swat_scratch.Scratch folder the file is downloaded to, needed
+            unless the file is streamed or local
+        compression: 'gzip' or 'zstd' if the file is compressed, in which case
+            it's streamed and decompressed as it's downloaded
+    Returns:
+        Int: rows loaded
+    """
+
+    # stream large and compressed files straight from the bucket, otherwise write file to temp location and read
+    if (ftype in cfg.stream_files) or (compression is not None):
+        blob = local_blob or swat_io.get_bucket(event['bucket']).get_blob(event['name'])
+        tmp_path = None
+        
+    else:
+        blob = None
+        tmp_path = local_blob.path if local_blob is not None else write_to_tmp(event['bucket'], event['name'], scratch, event.get('size'))
+
+    if (budget_mb is None) and (scratch is not None):
+        budget_mb = scratch.budget_mb()
+
+    # work out the columns of the file from its header, and the rows per time step from its first time step
+    with swat_trace.span('header'):
+        layout = swat_layout.blob_layout(ftype, blob, compression) if blob is not None else swat_layout.file_layout(ftype, tmp_path)
+        date_index = swat_format.DateIndex(cio_dict, model_period, layout.n_locations)
+
+    # pick up from the checkpoint of an earlier invocation that didn't finish loading this generation of the file
+    if ftype in cfg.checkpoint_files:
+        with swat_trace.span('checkpoint'):
+            checkpoint = open_checkpoint(event, ftype, model_desc, model_period)
+        if checkpoint.loaded:
+            print("Generation {} of '{}' is already loaded, ignoring".format(checkpoint.state['generation'], event['name']))
+            return 0
+    else:
+        checkpoint = None
+
+    # register the load in the runs table, its id is written on each row in place of the metadata fields
+    if (checkpoint is not None) and checkpoint.resumed:
+        load_time = checkpoint.state['load_time']
+        run_id = checkpoint.state['run_id']
+    else:
+        load_time = datetime.now().strftime("%Y/%m/%d %H:%M:%S")
+        if cfg.row_metadata == 'run_id':
+            with swat_trace.span('register'):
+                run_id = swat_runs.register_run(push_to_bq, event, ftype, model_desc, model_period, load_time, cio_dict, hashes = hashes)
+        else:
+            run_id = None
+        if checkpoint is not None:
+            checkpoint.start(run_id = run_id, load_time = load_time)
+
+    # pst files end in free text, so are read whole. All other types are read and loaded in chunks
+    if (ftype == 'pst'):
+        print('running pst read')
+        # a compressed pst file is decompressed into memory, where it's read whole anyway
+        if compression is not None:
+            df = read_SWAT_pst(event['name'], layout, b''.join(swat_io.stream_decompressed(blob, compression)))
+        else:
+            df = read_SWAT_pst(tmp_path, layout)
+
+        with swat_trace.span('format', rows = len(df)):
+            df = swat_format.format_pst(df, model_period, date_index)
+    
+            # METADATA
+            # add in date field
+            df = swat_format.add_metadata(df, load_time, model_desc, model_period, run_id)
+
+        # BQ LOAD
+        with swat_trace.span('upload', rows = len(df), bytes_in = swat_trace.nbytes(df)):
+            push_to_bq(df, "healthy_gulf", "SWAT_output_" + ftype)
+
+        if cfg.store_root:
+            with swat_trace.span('store', rows = len(df)):
+                swat_store.RunWriter(ftype, model_desc, model_period).write(df)
+
+        n_rows = len(df)
+
+    else:
+        print('running {} read'.format(ftype))
+        n_rows = read_SWAT_chunked(tmp_path, ftype, model_desc, model_period, date_index, blob = blob, run_id = run_id, layout = layout,
+                                   checkpoint = checkpoint, budget_mb = budget_mb, upload_pool = upload_pool, compression = compression)
+
+    # note the content as loaded, so an identical upload of the file is skipped
+    if hashes is not None:
+        swat_state.mark_loaded(model_desc, ftype, swat_runs.content_key(*hashes[:2]), run_id = run_id, source_file = event['name'],
+                               model_run_datetime = load_time, size = hashes[2])
+
+    # give the table a view with the metadata fields, for queries and dashboards written before run_id
+    if run_id is not None:
+        try:
+            swat_runs.ensure_view("healthy_gulf", ftype)
+        except Exception as e:
+            print("Could not create the view of SWAT_output_{}: {}".format(ftype, e))
+
+    return n_rows
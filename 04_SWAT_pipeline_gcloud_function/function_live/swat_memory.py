@@ -0,0 +1,142 @@
+
+import numpy as np
+import config as cfg
+import swat_decode
+import swat_trace
+
+
+def row_bytes(col_widths, dtypes=None, usecols=None, arrow=False):
+    """Function to estimate the memory taken by one line of a fixed width file,
+    as text and once decoded
+
+    Args:
+        col_widths: list of fixed column widths, in characters
+        dtypes: dict of column index to dtype, as for swat_decode.read_fixed
+        usecols: column indexes decoded, all columns if None
+        arrow: decoded to pyarrow RecordBatches rather than DataFrames
+    Returns:
+        Tuple: (text, decoded) - bytes per line of the file (with its line
+        ending) and bytes per row of the decoded chunk
+    """
+
+    dtypes = dtypes if dtypes is not None else {}
+    usecols = usecols if usecols is not None else range(len(col_widths))
+
+    decoded = 0
+    for c in usecols:
+        dtype = dtypes.get(c)
+        if dtype == 'category':
+            # a code per row, the dictionary of values is small enough to leave out
+            decoded += 4
+        elif swat_decode.is_text(dtype):
+            # characters plus an offset (arrow and 'string') or a pointer to a python str object
+            decoded += col_widths[c] + (8 if (arrow or dtype == 'string') else 64)
+        else:
+            decoded += np.dtype(dtype or np.float64).itemsize
+
+    return sum(col_widths) + 2, decoded
+
+
+class ChunkSizer:
+    """Picks the number of rows per chunk of a file from a memory budget,
+    and adjusts it as chunks are loaded
+
+    The first size is planned from the file layout: each row costs its text
+    times cfg.decode_overhead while it's being decoded, plus its decoded size
+    for every chunk that can be held at once (the one being decoded, the one
+    being formatted, and those running or queued in the Uploader). The rows
+    that fit in cfg.memory_target of the budget, less the memory already in
+    use, are clamped to cfg.chunk_min_rows - cfg.chunk_max_rows.
+
+    After each chunk, observe() works out the memory actually used per row
+    of the largest chunk so far from the peak RSS, and resizes the chunks to
+    fit. Chunks shrink straight away, but only grow (by at most 2x per chunk)
+    once the upload queue has had a chance to fill.
+
+    The sizer is passed to the decoders as their chunksize, which call it for
+    the size of each chunk.
+
+    Args:
+        ftype: the file type, for logging
+        budget_mb: memory available to the function in MB, defaults to cfg.memory_budget_mb
+    """
+
+    def __init__(self, ftype, budget_mb=None):
+
+        self.ftype = ftype
+        self.budget_mb = budget_mb or cfg.memory_budget_mb
+        self.in_flight = 2 + cfg.upload_workers + cfg.upload_queue
+        self.baseline_mb = swat_trace.rss_mb()
+        self.peak_mb = self.baseline_mb
+        self.rows = cfg.chunk_min_rows
+        self.planned = None
+        self.largest = 0
+        self.n_chunks = 0
+
+    def __call__(self):
+
+        return self.rows
+
+    def available_bytes(self):
+
+        return (self.budget_mb * cfg.memory_target - self.baseline_mb) * 10**6
+
+    def clamp(self, rows):
+
+        return int(min(max(rows, cfg.chunk_min_rows), cfg.chunk_max_rows))
+
+    def plan(self, col_widths, dtypes=None, usecols=None, arrow=False):
+        """Set the first chunk size from the layout of the file
+
+        Args:
+            as for row_bytes
+        Returns:
+            Int: rows per chunk
+        """
+
+        text, decoded = row_bytes(col_widths, dtypes, usecols, arrow)
+        per_row = (text * cfg.decode_overhead) + (decoded * self.in_flight)
+
+        self.baseline_mb = swat_trace.rss_mb()
+        if self.available_bytes() <= 0:
+            print("Warning: {:.0f}MB already in use leaves no room in the {:.0f}MB memory budget, using the smallest chunks".format(
+                self.baseline_mb, self.budget_mb))
+
+        self.rows = self.planned = self.clamp(self.available_bytes() / per_row)
+        print("Chunk size for {}: {} rows ({:.0f}MB budget, {:.0f}MB in use, ~{} bytes/row: {} text x {} + {} decoded x {} chunks in flight)".format(
+            self.ftype, self.rows, self.budget_mb, self.baseline_mb, per_row, text, cfg.decode_overhead, decoded, self.in_flight))
+
+        return self.rows
+
+    def observe(self, n_rows):
+        """Adjust the chunk size after a chunk of n_rows has been decoded and queued
+
+        Returns:
+            Int: rows in the next chunk
+        """
+
+        self.n_chunks += 1
+        self.largest = max(self.largest, n_rows)
+        self.peak_mb = max(self.peak_mb, swat_trace.peak_rss_mb())
+
+        used = max(self.peak_mb - self.baseline_mb, 1.0) * 10**6
+        fit = self.available_bytes() / (used / self.largest)
+
+        if fit < self.rows:
+            rows = self.clamp(fit)
+        elif self.n_chunks >= self.in_flight:
+            rows = self.clamp(min(fit, self.rows * 2))
+        else:
+            rows = self.rows
+
+        if rows != self.rows:
+            print("Chunk size for {} adjusted from {} to {} rows, peak RSS {:.1f}MB".format(self.ftype, self.rows, rows, self.peak_mb))
+            self.rows = rows
+
+        return self.rows
+
+    def summary(self):
+        """Fields describing the chunking of the file, for logs"""
+
+        return {'memory_budget_mb' : self.budget_mb, 'chunk_rows_planned' : self.planned,
+                'chunk_rows_final' : self.rows, 'chunk_rows_largest' : self.largest}
@@ -0,0 +1,150 @@
+
+import base64
+import hashlib
+import pandas as pd
+import config as cfg
+import swat_cache
+import swat_io
+
+
+# tables whose compatibility view has been checked by this instance
+views_checked = set()
+
+
+def make_run_id(source_file, source_md5, load_time):
+    """Function to derive the integer id of a load from what identifies it, so
+    concurrent loads get distinct ids without reading the runs table
+
+    Args:
+        source_file: the output file name in the bucket
+        source_md5: the base64 MD5 of the output file, or its CRC32C if it has no MD5
+        load_time: time of the load, as a string
+    Returns:
+        Int: a positive 63 bit id, which fits a BigQuery INT64
+    """
+
+    key = '|'.join([source_file, source_md5 or '', load_time]).encode('utf-8')
+
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'big') >> 1
+
+
+def source_hashes(event):
+    """Function to get the content hashes and size of the output file named in
+    an event, from the event itself where Cloud Storage supplies them, or else
+    from the object's metadata, so the file is never downloaded for them
+
+    Returns:
+        Tuple: (md5, crc32c, size) - base64 MD5 (None for composite objects),
+        base64 CRC32C and size in bytes
+    """
+
+    if event.get('crc32c'):
+        return event.get('md5Hash'), event['crc32c'], int(event.get('size') or 0)
+
+    blob = swat_io.get_bucket(event['bucket']).get_blob(event['name'])
+    if blob is None:
+        return None, None, 0
+
+    return blob.md5_hash, blob.crc32c, blob.size
+
+
+def content_key(md5, crc32c):
+    """Function to turn a file's hashes into the key its content is known by,
+    the MD5 where there is one, as hex so it can be used in object names"""
+
+    if md5:
+        return 'md5-' + base64.b64decode(md5).hex()
+
+    if crc32c:
+        return 'crc32c-' + base64.b64decode(crc32c).hex()
+
+    return None
+
+
+def run_record(run_id, event, ftype, model_desc, model_period, load_time, cio_dict, md5, crc32c=None):
+    """Function to build the SWAT_runs row describing one load
+
+    Returns:
+        DataFrame: one row, with the fields of the runs table
+    """
+
+    return pd.DataFrame({'run_id' : [run_id],
+                         'model_info' : [model_desc],
+                         'model_time_interval' : [model_period],
+                         'model_run_datetime' : [load_time],
+                         'file_type' : [ftype],
+                         'run_start' : [pd.Timestamp(cio_dict['start']).date()],
+                         'run_end' : [pd.Timestamp(cio_dict['end']).date()],
+                         'source_file' : [event['name']],
+                         'source_md5' : [md5],
+                         'source_crc32c' : [crc32c]})
+
+
+def view_sql(dataset_nm, ftype, legacy=True):
+    """Function to get the SQL of the view giving an output table its per-row
+    metadata fields back, for queries written before run_id was added
+
+    Args:
+        dataset_nm: name of the data set
+        ftype: the file type, e.g. 'rch'
+        legacy: the table holds rows loaded before run_id, which keep the
+            metadata fields themselves, so the view falls back on them
+    Returns:
+        String: a CREATE VIEW IF NOT EXISTS statement
+    """
+
+    fields = ['model_run_datetime', 'model_info', 'model_time_interval']
+
+    if legacy:
+        select = ['o.* EXCEPT(run_id, {})'.format(', '.join(fields))] + \
+                 ['COALESCE(r.{0}, o.{0}) AS {0}'.format(f) for f in fields] + ['o.run_id']
+    else:
+        select = ['o.*'] + ['r.{}'.format(f) for f in fields]
+
+    return """CREATE VIEW IF NOT EXISTS `{dataset}.SWAT_output_{ftype}{suffix}` AS
+SELECT
+  {select}
+FROM `{dataset}.SWAT_output_{ftype}` o
+LEFT JOIN `{dataset}.{runs}` r USING (run_id)""".format(dataset=dataset_nm, ftype=ftype, suffix=cfg.runs_view_suffix,
+                                                     select=',\n  '.join(select), runs=cfg.runs_table)
+
+
+def ensure_view(dataset_nm, ftype):
+    """Function to create the compatibility view of an output table, if it doesn't
+    exist yet, once the table has been loaded with run_id rows"""
+
+    if cfg.local_bq_root or ((dataset_nm, ftype) in views_checked):
+        return
+
+    bq_client = swat_cache.bq_client()
+    names = [f.name for f in bq_client.get_table('{}.SWAT_output_{}'.format(dataset_nm, ftype)).schema]
+
+    bq_client.query(view_sql(dataset_nm, ftype, legacy='model_info' in names)).result()
+    views_checked.add((dataset_nm, ftype))
+
+
+def register_run(push_fn, event, ftype, model_desc, model_period, load_time, cio_dict, dataset_nm='healthy_gulf', hashes=None):
+    """Function to add a load to the SWAT_runs table, before its rows are loaded,
+    so no rows are ever loaded without the run they belong to
+
+    Args:
+        push_fn: function loading a dataframe into a table, e.g. push_to_bq
+        event (dict): the Cloud Storage event of the output file
+        ftype: the file type, e.g. 'hru'
+        model_desc: model information from the folder name
+        model_period: either 'monthly' or 'daily'
+        load_time: time of the load, as a string
+        cio_dict: the run period read from file.cio
+        dataset_nm: name of the target data set
+        hashes: (md5, crc32c, size) of the output file from source_hashes, looked up if None
+    Returns:
+        Int: the run_id to write on each row of the output table
+    """
+
+    md5, crc32c, _ = hashes or source_hashes(event)
+    run_id = make_run_id(event['name'], md5 or crc32c, load_time)
+
+    push_fn(run_record(run_id, event, ftype, model_desc, model_period, load_time, cio_dict, md5, crc32c), dataset_nm, cfg.runs_table)
+    print('Registered run {} ({} {}, {})'.format(run_id, model_desc, model_period, ftype))
+
+    return run_id
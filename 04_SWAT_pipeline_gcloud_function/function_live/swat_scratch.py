@@ -0,0 +1,139 @@
+import os
+import time
+import errno
+import shutil
+import tempfile
+import threading
+import config as cfg
+
+
+# bytes of downloads held by the scratch folders of the invocations running on this instance, and the number of those invocations
+reserved = 0
+running = 0
+space = threading.Condition()
+
+# whether this instance has removed the scratch folders left by earlier ones
+swept = False
+
+
+def sweep():
+    """Function to remove scratch folders in cfg.tmp_dir that were left behind by
+    invocations that were stopped, once they're cfg.scratch_stale_s seconds old"""
+
+    for name in os.listdir(cfg.tmp_dir):
+        path = os.path.join(cfg.tmp_dir, name)
+        try:
+            if name.startswith('swat_') and os.path.isdir(path) and (time.time() - os.path.getmtime(path) > cfg.scratch_stale_s):
+                shutil.rmtree(path)
+                print("Removed stale scratch folder {}".format(path))
+        except OSError as e:
+            print('Failed to delete %s. Reason: %s' % (path, e))
+
+
+class Scratch:
+    """Temporary folder of one invocation, in cfg.tmp_dir, for the files it downloads
+
+    Each invocation only removes its own folder, so several can run at once
+    on an instance without deleting each other's files. Before a file is
+    downloaded its size is reserved against cfg.scratch_quota_mb, shared by
+    all the invocations running on the instance, and against the free space
+    of tmp_dir. A download that doesn't fit waits for other invocations to
+    finish, for up to cfg.scratch_wait_s seconds.
+
+    Args:
+        prefix: start of the folder name, which is followed by random characters
+    """
+
+    def __init__(self, prefix='swat_'):
+
+        global swept, running
+
+        os.makedirs(cfg.tmp_dir, exist_ok=True)
+        if not swept:
+            swept = True
+            sweep()
+
+        self.path = tempfile.mkdtemp(prefix=prefix, dir=cfg.tmp_dir)
+        self.reserved = 0
+        self.closed = False
+
+        with space:
+            running += 1
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *exc):
+
+        self.close()
+
+    def file(self, name):
+        """Location in the folder to write a file called name to"""
+
+        return os.path.join(self.path, name)
+
+    def fits(self, n_bytes):
+
+        # reserved files are counted as if none of them were written yet, so two downloads can't both take the same free space
+        free = shutil.disk_usage(self.path).free
+
+        return (reserved + n_bytes <= cfg.scratch_quota_mb * 10**6) and (reserved + n_bytes <= free)
+
+    def reserve(self, n_bytes, name=''):
+        """Reserve space for a download of n_bytes, waiting for other invocations
+        to free some if there isn't enough
+
+        Args:
+            n_bytes: size of the file to be downloaded
+            name: name of the file, for logging
+        Returns:
+            None; raises OSError (ENOSPC) if the space isn't free in time
+        """
+
+        global reserved
+
+        if n_bytes > cfg.scratch_quota_mb * 10**6:
+            print("'{}' is {:.0f}MB, more than the {:.0f}MB scratch quota. Add its type to stream_files to load it without a copy in tmp".format(
+                name, n_bytes / 10**6, cfg.scratch_quota_mb))
+            raise OSError(errno.ENOSPC, 'File larger than the scratch quota', name)
+
+        deadline = time.monotonic() + cfg.scratch_wait_s
+        with space:
+            if not self.fits(n_bytes):
+                print("Waiting for {:.0f}MB of scratch space for '{}', {:.0f}MB held by {} running invocations".format(
+                    n_bytes / 10**6, name, reserved / 10**6, running))
+
+            while not self.fits(n_bytes):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    print("No scratch space for '{}' after {}s".format(name, cfg.scratch_wait_s))
+                    raise OSError(errno.ENOSPC, 'No scratch space free', name)
+                space.wait(remaining)
+
+            reserved += n_bytes
+            self.reserved += n_bytes
+
+    def budget_mb(self):
+        """Memory in MB the chunks of this invocation's load are sized to fit in: its
+        share of cfg.memory_budget_mb with the other running invocations, less
+        the scratch files held (tmp is held in memory on Cloud Functions)"""
+
+        with space:
+            return (cfg.memory_budget_mb - reserved / 10**6) / max(running, 1)
+
+    def close(self):
+        """Remove the folder and everything in it, and free its reserved space"""
+
+        global reserved, running
+
+        if self.closed:
+            return
+        self.closed = True
+
+        shutil.rmtree(self.path, ignore_errors=True)
+
+        with space:
+            reserved -= self.reserved
+            running -= 1
+            space.notify_all()
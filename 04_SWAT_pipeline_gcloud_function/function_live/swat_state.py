@@ -0,0 +1,281 @@
+
+import json
+import time
+import hashlib
+import threading
+import config as cfg
+import swat_io
+
+
+def state_blob(file_nm, bucket_nm=None):
+    """Function to get the blob the checkpoint of an output file is kept in"""
+
+    return swat_io.get_bucket(bucket_nm or cfg.state_bucket).blob('{}/{}.json'.format(cfg.state_prefix, file_nm))
+
+
+def clear(file_nm, bucket_nm=None):
+    """Function to remove the checkpoint of an output file, so its next load starts
+    from the top even if the same generation has been loaded"""
+
+    blob = state_blob(file_nm, bucket_nm)
+    if blob.exists():
+        blob.delete()
+
+
+def loaded_blob(model_desc, ftype, content_key, bucket_nm=None):
+    """Function to get the blob marking a file's content as loaded for a model and file type"""
+
+    return swat_io.get_bucket(bucket_nm or cfg.state_bucket).blob('/'.join([cfg.state_prefix, 'loaded', model_desc, ftype, content_key + '.json']))
+
+
+def find_loaded(model_desc, ftype, content_key):
+    """Function to look for an earlier load of a file with the same content,
+    for the same model and file type
+
+    Args:
+        model_desc: model information from the folder name
+        ftype: the file type, e.g. 'hru'
+        content_key: key of the file's content, from swat_runs.content_key
+    Returns:
+        Dict: what mark_loaded recorded about the earlier load, or None
+    """
+
+    if content_key is None:
+        return None
+
+    blob = loaded_blob(model_desc, ftype, content_key)
+    if not blob.exists():
+        return None
+
+    return json.loads(blob.download_as_bytes())
+
+
+def mark_loaded(model_desc, ftype, content_key, **fields):
+    """Function to record that a file's content has been loaded for a model and
+    file type, once the load has finished, e.g. with its run_id and source file"""
+
+    if content_key is not None:
+        loaded_blob(model_desc, ftype, content_key).upload_from_string(json.dumps(fields, sort_keys=True))
+
+
+class Checkpoint:
+    """Chunk-level progress of the load of one output file, kept as a small
+    JSON object under cfg.state_prefix so a retried invocation can pick the
+    load up where the last one stopped.
+
+    Each chunk is noted as pending before its upload starts, with its first
+    data row, row count, the byte offset of its first line and the job id
+    it's written under, and as committed once the upload is done. Job ids
+    are derived from the file, its generation and the chunk number, so a
+    write that's repeated lands on the same BigQuery job or staged file
+    rather than adding the rows again.
+
+    A checkpoint belongs to one generation of the file: a new upload of the
+    object gets a new generation, and its load starts again from row 0.
+
+    The object is written by one thread at a time, at most once every
+    cfg.checkpoint_interval_s seconds. Pending chunks are written before
+    their upload starts, by the upload thread so the next chunk is read
+    meanwhile. Committed chunks go out with the next write, as a retry
+    checks pending chunks for writes that went through anyway.
+
+    Args:
+        file_nm: name of the output file in its bucket
+        generation: generation of the output file object
+        bucket_nm: the bucket checkpoints are kept in, defaults to cfg.state_bucket
+    """
+
+    def __init__(self, file_nm, generation, bucket_nm=None):
+
+        self.lock = threading.Lock()
+        # held while the state is written, so an older state never overwrites a newer one
+        self.save_lock = threading.Lock()
+        self.version = 0
+        self.saved = 0
+        self.saved_at = None
+        self.blob = state_blob(file_nm, bucket_nm)
+        self.key = hashlib.sha1('{}|{}'.format(file_nm, generation).encode('utf-8')).hexdigest()[:16]
+
+        state = json.loads(self.blob.download_as_bytes()) if self.blob.exists() else None
+        if (state is not None) and (state['generation'] != str(generation)):
+            print("Checkpoint of {} is for generation {}, starting the load of generation {} from the top".format(
+                file_nm, state['generation'], generation))
+            state = None
+
+        self.resumed = state is not None
+        self.state = state or {'file' : file_nm, 'generation' : str(generation), 'status' : 'loading',
+                               'attempt' : 0, 'next_chunk' : 0, 'chunks' : {}, 'load_job' : None}
+        self.state['attempt'] += 1
+
+    @property
+    def loaded(self):
+
+        return self.state['status'] == 'loaded'
+
+    def save(self, wait=True):
+        """Note that the state has changed, and write it
+
+        Args:
+            wait: return once the state has been written, otherwise it goes
+                out with the next write
+        """
+
+        with self.lock:
+            self.version += 1
+        if wait:
+            self.flush()
+
+    def flush(self):
+        """Wait until the state as it is now has been written
+
+        Changes made while a write waits for its turn go out with it, so
+        threads flushing at once share a write rather than each making one.
+        """
+
+        from google.api_core import retry
+
+        with self.lock:
+            version = self.version
+
+        with self.save_lock:
+            if self.saved >= version:
+                return
+
+            if self.saved_at is not None:
+                time.sleep(max(0, self.saved_at + cfg.checkpoint_interval_s - time.monotonic()))
+
+            with self.lock:
+                data = json.dumps(self.state, sort_keys=True)
+                version = self.version
+
+            # writes that are rate limited (429) or fail on the server side are retried
+            retry.Retry(predicate=retry.if_transient_error)(self.blob.upload_from_string)(data)
+            self.saved = version
+            self.saved_at = time.monotonic()
+
+    def start(self, **fields):
+        """Record what a fresh load needs to be resumed, e.g. its run_id and load time"""
+
+        self.state.update(fields)
+        self.save()
+
+    def job_id(self, chunk_id):
+        """Id of the write carrying a chunk. Chunk ids aren't reused, as BigQuery
+        won't run a second job with the id of one that failed"""
+
+        return 'swat_{}_{:05d}'.format(self.key, chunk_id)
+
+    def resolve(self, chunk_done, load_done=None):
+        """Work out which writes left pending by the last attempt went through
+
+        Args:
+            chunk_done: function of a job id returning True if the chunk written
+                under it landed, waiting for it if it's still running
+            load_done: as chunk_done, for the bulk load of staged chunks
+        Returns:
+            Int: rows committed
+        """
+
+        chunks = self.state['chunks']
+        for k in [k for k, c in chunks.items() if not c['committed']]:
+            if chunk_done(self.job_id(int(k))):
+                chunks[k]['committed'] = True
+            else:
+                del chunks[k]
+
+        if self.state['load_job'] and load_done is not None and load_done(self.state['load_job']):
+            self.state['status'] = 'loaded'
+
+        self.save()
+        n_rows = sum(c['rows'] for c in chunks.values())
+        print("Resuming load of {} (attempt {}): {} chunks, {} rows committed, continuing from row {}".format(
+            self.state['file'], self.state['attempt'], len(chunks), n_rows, self.resume_row()))
+
+        return n_rows
+
+    def committed(self):
+        """(first_row, rows) of the committed chunks, in file order"""
+
+        return sorted((c['first_row'], c['rows']) for c in self.state['chunks'].values() if c['committed'])
+
+    def committed_jobs(self):
+
+        return [self.job_id(int(k)) for k in sorted(self.state['chunks'], key=int) if self.state['chunks'][k]['committed']]
+
+    def resume_row(self):
+        """First data row not in the run of committed chunks from the top of the file"""
+
+        row = 0
+        for first_row, rows in self.committed():
+            if first_row > row:
+                break
+            row = max(row, first_row + rows)
+
+        return row
+
+    def uncommitted(self, first_row, n_rows):
+        """Row ranges of a chunk not already in a committed chunk
+
+        Chunks can be committed out of order, as they're uploaded by several
+        threads, so a resumed load can meet rows that were committed after
+        the first gap.
+
+        Returns:
+            List: (start, end) row positions within the chunk
+        """
+
+        ranges = []
+        pos = first_row
+        for s, n in self.committed():
+            if (s + n <= pos) or (s >= first_row + n_rows):
+                continue
+            if s > pos:
+                ranges.append((pos - first_row, s - first_row))
+            pos = max(pos, s + n)
+        if pos < first_row + n_rows:
+            ranges.append((pos - first_row, n_rows))
+
+        return ranges
+
+    def queue(self, first_row, rows, byte_start, byte_end):
+        """Note a chunk as pending. The upload should flush the checkpoint
+        before it starts, so the chunk is written as pending first
+
+        Returns:
+            Int: the chunk id, numbered on from the chunks of earlier attempts
+        """
+
+        with self.lock:
+            chunk_id = self.state['next_chunk']
+            self.state['next_chunk'] += 1
+            self.state['chunks'][str(chunk_id)] = {'first_row' : first_row, 'rows' : rows, 'byte_start' : byte_start,
+                                     'byte_end' : byte_end, 'committed' : False}
+        self.save(wait=False)
+
+        return chunk_id
+
+    def commit(self, chunk_id):
+        """Note a chunk's upload as done. It's written with the next save, and
+        until then a retry finds the chunk pending and checks its write"""
+
+        with self.lock:
+            self.state['chunks'][str(chunk_id)]['committed'] = True
+        self.save(wait=False)
+
+    def queue_load(self):
+        """Note the bulk load of the staged chunks as pending before it starts
+
+        Returns:
+            String: the job id of the load
+        """
+
+        self.state['load_job'] = 'swat_{}_load_{}'.format(self.key, self.state['attempt'])
+        self.save()
+
+        return self.state['load_job']
+
+    def finish(self):
+        """Mark the file as loaded, so a retry of the invocation doesn't load it again"""
+
+        self.state['status'] = 'loaded'
+        self.save()
@@ -0,0 +1,258 @@
+
+import os
+import shutil
+import threading
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import config as cfg
+import swat_io
+import swat_trace
+
+
+def year_column(names):
+    """Function to find the calendar year field of an output table, named differently by file type"""
+
+    for nm in ['year', 'Year', 'YEAR']:
+        if nm in names:
+            return nm
+
+    return None
+
+
+def run_dir(root, ftype, model_desc, model_period):
+    """Function to get the folder holding one model run of one file type in the store"""
+
+    return os.path.join(root, ftype, 'model_info=' + model_desc, 'model_time_interval=' + model_period)
+
+
+class RunWriter:
+    """Writes the rows of one output file to a local parquet store, as they
+    are loaded, partitioned as
+
+        <root>/<ftype>/model_info=<model_info>/model_time_interval=<interval>/year=<year>/part-NNNNN.parquet
+
+    Each part is sorted by location then date and written in row groups of
+    cfg.store_row_group_size rows, so the min/max statistics of every row
+    group cover a narrow range of locations. The partition fields are held
+    in the folder names rather than the files, following the hive layout
+    read by pyarrow.dataset, duckdb and R arrow::open_dataset.
+
+    Any earlier load of the same run and file type is removed when the
+    writer is created, so reloading a file replaces its rows. When a load
+    resumes from a checkpoint, only the parts of the chunks it didn't
+    commit are removed. write() can be called from several upload threads
+    at once.
+
+    Args:
+        ftype: the file type, e.g. 'hru'
+        model_desc: model information from the folder name
+        model_period: either 'monthly' or 'daily'
+        root: the store folder, defaults to cfg.store_root
+        keep: job ids of the chunks committed before a resumed load, whose parts are kept
+    """
+
+    def __init__(self, ftype, model_desc, model_period, root=None, keep=None):
+
+        self.ftype = ftype
+        self.path = run_dir(root or cfg.store_root, ftype, model_desc, model_period)
+        self.lock = threading.Lock()
+        self.n_parts = 0
+        self.n_rows = 0
+
+        if keep is None:
+            shutil.rmtree(self.path, ignore_errors=True)
+        else:
+            self.remove_parts(set(keep))
+
+    def remove_parts(self, keep):
+        """Delete the parts not written for one of the chunk job ids in keep"""
+
+        for folder, _, files in os.walk(self.path):
+            for fname in files:
+                if fname.rsplit('.', 1)[0].split('-', 1)[-1] not in keep:
+                    os.remove(os.path.join(folder, fname))
+
+    def write(self, df, dataset_nm=None, table_nm=None, job_id=None):
+        """Add a chunk to the store, named after its job id if it has one. The BigQuery table is ignored"""
+
+        table = swat_io.to_arrow(df)
+        table = table.drop_columns([c for c in ['model_info', 'model_time_interval'] if c in table.column_names])
+
+        year_nm = year_column(table.column_names)
+        if year_nm is None:
+            raise ValueError("No year field found in {} output, can't partition it by year".format(self.ftype))
+
+        # sort each part by location then date, so row group statistics are selective on both
+        sort_keys = [(c, 'ascending') for c in [cfg.location_cols.get(self.ftype), 'date'] if c in table.column_names]
+
+        years = table.column(year_nm).to_numpy()
+        for year in np.unique(years):
+
+            part = table.filter(pa.array(years == year)).drop_columns([year_nm])
+            if sort_keys:
+                part = part.sort_by(sort_keys)
+
+            with self.lock:
+                fpath = os.path.join(self.path, 'year={}'.format(year), 'part-{}.parquet'.format(job_id or '{:05d}'.format(self.n_parts)))
+                self.n_parts += 1
+
+            os.makedirs(os.path.dirname(fpath), exist_ok=True)
+            pq.write_table(part, fpath, row_group_size=cfg.store_row_group_size,
+                           compression=cfg.staging_compression, write_statistics=True)
+
+        with self.lock:
+            self.n_rows += len(table)
+
+
+def tee(upload_fn, writer):
+    """Function to wrap an upload function so each chunk is also written to the store
+
+    Args:
+        upload_fn: function called as upload_fn(df, *args), e.g. push_to_bq
+        writer: the RunWriter for the file
+    Returns:
+        Function: taking the same arguments as upload_fn
+    """
+
+    def upload_and_store(df, *args):
+        upload_fn(df, *args)
+        with swat_trace.span('store', rows = len(df)):
+            writer.write(df, *args)
+
+    return upload_and_store
+
+
+def partition_value(name):
+    """Function to get the value from a hive partition folder name, e.g. 'year=2006' -> '2006'"""
+
+    return name.split('=', 1)[1]
+
+
+def list_dirs(path, values=None):
+    """Function to list the partition folders in path, keeping those whose value is in values"""
+
+    if not os.path.isdir(path):
+        return []
+
+    dirs = sorted(d for d in os.listdir(path) if '=' in d)
+    if values is not None:
+        dirs = [d for d in dirs if partition_value(d) in values]
+
+    return dirs
+
+
+def stats_overlap(stats, lo, hi):
+    """Function to check whether a row group's min/max statistics could hold values between lo and hi"""
+
+    if (stats is None) or not stats.has_min_max:
+        return True
+
+    return not (((hi is not None) and (stats.min > hi)) or ((lo is not None) and (stats.max < lo)))
+
+
+def read_store(ftype, model_info=None, locations=None, start=None, end=None, columns=None,
+               model_time_interval=None, root=None):
+    """Function to read rows of a file type from the local parquet store, skipping
+    the partitions and row groups that can't hold any of the rows asked for
+
+    Args:
+        ftype: the file type, e.g. 'rch'
+        model_info: a model_info value, or list of them, all runs if None
+        locations: list of location ids (the cfg.location_cols field), all if None
+        start: first date to read, e.g. '2006-01-01', from the start of the run if None
+        end: last date to read, to the end of the run if None
+        columns: list of fields to read, all if None
+        model_time_interval: 'monthly' or 'daily', both if None
+        root: the store folder, defaults to cfg.store_root
+    Returns:
+        DataFrame: the matching rows, with model_info, model_time_interval and year fields
+    """
+
+    import pyarrow.compute as pc
+
+    root = root or cfg.store_root
+    loc_nm = cfg.location_cols.get(ftype)
+    start = np.datetime64(start, 'D') if start is not None else None
+    end = np.datetime64(end, 'D') if end is not None else None
+
+    if isinstance(model_info, str):
+        model_info = [model_info]
+    if isinstance(model_time_interval, str):
+        model_time_interval = [model_time_interval]
+
+    tables = []
+    n_groups = 0
+    n_read = 0
+
+    for info_dir in list_dirs(os.path.join(root, ftype), model_info):
+        for period_dir in list_dirs(os.path.join(root, ftype, info_dir), model_time_interval):
+
+            path = os.path.join(root, ftype, info_dir, period_dir)
+            for year_dir in list_dirs(path):
+
+                # prune whole years outside the date range
+                year = int(partition_value(year_dir))
+                if ((start is not None) and (year < start.astype('M8[Y]').astype(int) + 1970)) or \
+                        ((end is not None) and (year > end.astype('M8[Y]').astype(int) + 1970)):
+                    continue
+
+                for fname in sorted(os.listdir(os.path.join(path, year_dir))):
+
+                    pfile = pq.ParquetFile(os.path.join(path, year_dir, fname))
+                    names = pfile.schema_arrow.names
+                    if (locations is not None) and (loc_nm not in names):
+                        raise ValueError("No location field '{}' found in stored {} output".format(loc_nm, ftype))
+
+                    # prune row groups using their min/max statistics
+                    groups = []
+                    for i in range(pfile.metadata.num_row_groups):
+                        group = pfile.metadata.row_group(i)
+                        stats = {group.column(j).path_in_schema : group.column(j).statistics for j in range(group.num_columns)}
+
+                        keep = True
+                        if locations is not None:
+                            keep = stats_overlap(stats.get(loc_nm), min(locations), max(locations))
+                        if keep and ('date' in stats) and ((start is not None) or (end is not None)):
+                            keep = stats_overlap(stats['date'], start.item() if start is not None else None,
+                                                 end.item() if end is not None else None)
+                        if keep:
+                            groups.append(i)
+
+                    n_groups += pfile.metadata.num_row_groups
+                    n_read += len(groups)
+                    if not groups:
+                        continue
+
+                    table = pfile.read_row_groups(groups)
+
+                    # exact filter on the rows of the row groups read
+                    conds = []
+                    if locations is not None:
+                        conds.append(pc.is_in(table.column(loc_nm), pa.array(locations, table.schema.field(loc_nm).type)))
+                    if ('date' in names) and (start is not None):
+                        conds.append(pc.greater_equal(table.column('date'), start.item()))
+                    if ('date' in names) and (end is not None):
+                        conds.append(pc.less_equal(table.column('date'), end.item()))
+                    if conds:
+                        mask = conds[0]
+                        for cond in conds[1:]:
+                            mask = pc.and_(mask, cond)
+                        table = table.filter(mask)
+
+                    if columns is not None:
+                        table = table.select([c for c in columns if c in names])
+
+                    n = len(table)
+                    table = table.append_column('model_info', pa.repeat(pa.scalar(partition_value(info_dir), pa.string()), n))
+                    table = table.append_column('model_time_interval', pa.repeat(pa.scalar(partition_value(period_dir), pa.string()), n))
+                    table = table.append_column('year', pa.array(np.full(n, year, dtype=np.int64)))
+                    tables.append(table)
+
+    print("Read {} of {} row groups from the {} store".format(n_read, n_groups, ftype))
+
+    if not tables:
+        return pd.DataFrame()
+
+    return pa.concat_tables(tables).to_pandas(date_as_object=False)
@@ -0,0 +1,325 @@
+
+import os
+import sys
+import json
+import time
+import threading
+import resource
+from contextlib import contextmanager
+import config as cfg
+
+
+# the trace of the invocation each thread is working for, and the spans open in it, innermost last,
+# so nested code can add to them. Spans opened with no trace running are dropped
+local = threading.local()
+
+try:
+    PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (ValueError, AttributeError, OSError):
+    PAGE_SIZE = 4096
+
+
+def nbytes(df):
+    """Function to get the in-memory size of a DataFrame or Arrow data in bytes,
+    without counting the characters of Python string objects"""
+
+    if hasattr(df, 'memory_usage'):
+        return int(df.memory_usage(index=False).sum())
+
+    return int(getattr(df, 'nbytes', 0))
+
+
+def rss_mb():
+    """Function to get the current resident memory of the process in MB, falling back
+    to the peak (ru_maxrss) where /proc isn't available"""
+
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * PAGE_SIZE / 10**6
+    except (OSError, IndexError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 10**3
+
+
+class Span:
+    """Totals for one named stage, summed over every time the stage runs
+    (e.g. once per chunk), possibly from several threads at once"""
+
+    def __init__(self, name):
+
+        self.name = name
+        self.count = 0
+        self.wall_s = 0.0
+        self.cpu_s = 0.0
+        self.rows = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.peak_rss_mb = 0.0
+
+    def record(self):
+
+        return {'count' : self.count, 'wall_s' : round(self.wall_s, 3), 'cpu_s' : round(self.cpu_s, 3), 'rows' : self.rows,
+                'bytes_in' : self.bytes_in, 'bytes_out' : self.bytes_out, 'peak_rss_mb' : round(self.peak_rss_mb, 1)}
+
+
+class Measure:
+    """One run of a span, handed to the with block so it can add rows and bytes as they're known"""
+
+    def __init__(self, span):
+
+        self.span = span
+        self.rows = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.peak_rss_mb = rss_mb()
+
+    def add(self, rows=0, bytes_in=0, bytes_out=0):
+
+        self.rows += rows
+        self.bytes_in += bytes_in
+        self.bytes_out += bytes_out
+
+
+class Trace:
+    """Timing and memory record of one invocation, split into named spans
+    (import, dedup, download, verify, decompress, header, checkpoint, register, decode, format, upload, load, store, cleanup)
+
+    Each span sums wall time, CPU time, rows and bytes in/out over its runs,
+    and keeps the highest RSS seen while it was running. RSS is sampled by a
+    background thread every cfg.trace_sample_interval seconds, which is cheap
+    enough to leave on. CPU time is process CPU time (thread CPU time for
+    spans run in upload threads), so spans that overlap can both count the
+    same CPU seconds. tracemalloc is only started if cfg.trace_tracemalloc
+    is set, as it slows allocation heavy code down a lot.
+
+    Spans can nest, e.g. header detection runs inside the first decode of a
+    chunked file and the store write inside each upload, so the span times
+    don't always add up to the wall time of the invocation. RSS and process
+    CPU time are those of the whole instance, so invocations running at once
+    count each other's memory and CPU.
+
+    Args:
+        name: the name of the invocation, e.g. 'bq_load'
+        **fields: extra fields for the log line, e.g. the file name
+    """
+
+    def __init__(self, name, **fields):
+
+        self.fields = dict(fields, event=name)
+        self.spans = {}
+        self.running = set()
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        self.peak_rss_mb = rss_mb()
+        self.n_chunks = 0
+
+        if cfg.trace_tracemalloc:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+
+        self.stopped = threading.Event()
+        self.sampler = threading.Thread(target=self.sample, daemon=True)
+        self.sampler.start()
+
+    def sample(self):
+
+        while not self.stopped.wait(cfg.trace_sample_interval):
+            self.update_peak(rss_mb())
+
+    def update_peak(self, rss):
+
+        with self.lock:
+            self.peak_rss_mb = max(self.peak_rss_mb, rss)
+            for measure in self.running:
+                measure.peak_rss_mb = max(measure.peak_rss_mb, rss)
+
+    @contextmanager
+    def span(self, name, rows=0, bytes_in=0, bytes_out=0):
+
+        with self.lock:
+            span = self.spans.setdefault(name, Span(name))
+            measure = Measure(span)
+            self.running.add(measure)
+
+        measure.add(rows, bytes_in, bytes_out)
+        in_main = threading.current_thread() is threading.main_thread()
+        cpu_clock = time.process_time if in_main else time.thread_time
+
+        stack = local.__dict__.setdefault('stack', [])
+        stack.append(measure)
+
+        start = time.perf_counter()
+        cpu_start = cpu_clock()
+        try:
+            yield measure
+
+        finally:
+            stack.pop()
+            wall = time.perf_counter() - start
+            cpu = cpu_clock() - cpu_start
+            self.update_peak(rss_mb())
+
+            with self.lock:
+                self.running.discard(measure)
+                span.count += 1
+                span.wall_s += wall
+                span.cpu_s += cpu
+                span.rows += measure.rows
+                span.bytes_in += measure.bytes_in
+                span.bytes_out += measure.bytes_out
+                span.peak_rss_mb = max(span.peak_rss_mb, measure.peak_rss_mb)
+
+    def chunk(self, i, **fields):
+        """Record the progress of one chunk, logged as its own line if cfg.trace_chunks is set"""
+
+        self.n_chunks = max(self.n_chunks, i + 1)
+
+        if cfg.trace_chunks:
+            record = dict(fields, event=self.fields['event'] + '_chunk', chunk=i, rss_mb=round(rss_mb(), 1),
+                          elapsed_s=round(time.perf_counter() - self.start, 3))
+            print(json.dumps(record))
+
+    def finish(self, status='ok', error=None):
+        """Stop sampling and log the whole invocation as one JSON line
+
+        Returns:
+            Dict: the record logged
+        """
+
+        self.stopped.set()
+        self.sampler.join()
+        self.update_peak(rss_mb())
+
+        record = dict(self.fields, status=status, wall_s=round(time.perf_counter() - self.start, 3),
+                      cpu_s=round(time.process_time() - self.cpu_start, 3), peak_rss_mb=round(self.peak_rss_mb, 1),
+                      chunks=self.n_chunks, spans={nm : span.record() for nm, span in self.spans.items()})
+        if error is not None:
+            record['error'] = error
+
+        tracemalloc = sys.modules.get('tracemalloc')
+        if (tracemalloc is not None) and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            record['traced_peak_mb'] = round(peak / 10**6, 1)
+            tracemalloc.stop()
+
+        print(json.dumps(record, default=str))
+
+        return record
+
+
+def current():
+    """Function to get the active trace, that of the invocation running in this thread"""
+
+    return getattr(local, 'trace', None)
+
+
+def start(name, **fields):
+    """Function to start the trace of an invocation, making it the active trace of this thread
+
+    Invocations running at once on an instance, in threads of their own,
+    each have their own trace.
+
+    Args:
+        name: the name of the invocation, e.g. 'bq_load'
+        **fields: extra fields for the log line
+    Returns:
+        Trace: the new active trace
+    """
+
+    local.trace = Trace(name, **fields)
+
+    return local.trace
+
+
+def finish(status='ok', error=None):
+    """Function to log and close the active trace
+
+    Returns:
+        Dict: the record logged, or None if no trace was running
+    """
+
+    trace, local.trace = current(), None
+
+    return trace.finish(status, error) if trace is not None else None
+
+
+def bind(fn):
+    """Function to wrap fn so it runs with the active trace of the calling thread,
+    for work handed to other threads, e.g. uploads or ranged downloads
+
+    Args:
+        fn: function to run in another thread
+    Returns:
+        function: taking the same arguments as fn
+    """
+
+    trace = current()
+
+    def run(*args, **kwargs):
+        previous = current()
+        local.trace = trace
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            local.trace = previous
+
+    return run
+
+
+@contextmanager
+def span(name, rows=0, bytes_in=0, bytes_out=0):
+    """Context manager timing a stage of the active trace, e.g.
+
+        with swat_trace.span('download') as s:
+            ...
+            s.add(bytes_in = n_bytes)
+
+    Does nothing but hand back a throwaway Measure if no trace is running.
+    """
+
+    trace = current()
+    if trace is None:
+        yield Measure(Span(name))
+        return
+
+    with trace.span(name, rows, bytes_in, bytes_out) as measure:
+        yield measure
+
+
+def add(rows=0, bytes_in=0, bytes_out=0):
+    """Function to add rows or bytes to the innermost span open in this thread,
+    for code that doesn't open the span itself"""
+
+    stack = getattr(local, 'stack', None)
+    if stack:
+        stack[-1].add(rows, bytes_in, bytes_out)
+
+
+def peak_rss_mb():
+    """Function to get the peak RSS of the active trace in MB, or of the whole process
+    (ru_maxrss) if no trace is running, e.g. in a benchmark"""
+
+    trace = current()
+    if trace is None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 10**3
+
+    trace.update_peak(rss_mb())
+
+    return trace.peak_rss_mb
+
+
+def note(**fields):
+    """Function to add fields to the log line of the active trace, e.g. settings picked at runtime"""
+
+    trace = current()
+    if trace is not None:
+        trace.fields.update(fields)
+
+
+def chunk(i, **fields):
+    """Function to record the progress of chunk i against the active trace"""
+
+    trace = current()
+    if trace is not None:
+        trace.chunk(i, **fields)
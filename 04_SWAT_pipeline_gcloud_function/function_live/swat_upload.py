@@ -0,0 +1,204 @@
+
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+import config as cfg
+import swat_io
+import swat_trace
+
+
+class Uploader:
+    """Upload stage running on a thread pool, so chunk N+1 can be parsed
+    while chunk N is uploading.
+
+    submit() blocks once `concurrency` uploads are running and `max_queued`
+    more are waiting, which keeps the number of chunks held in memory
+    bounded. If an upload fails, later uploads that haven't started are
+    cancelled and the error of the earliest failed chunk is raised, either
+    from the next submit() or from close().
+
+    Args:
+        upload_fn: function called as upload_fn(df, *args) for each chunk, e.g. push_to_bq
+        concurrency: number of uploads running at once, defaults to cfg.upload_workers
+        max_queued: number of chunks waiting for an upload thread, defaults to cfg.upload_queue
+        pool: a ThreadPoolExecutor shared with the Uploaders of other files, e.g.
+            by a batch load, which is left running when this one closes. Each
+            Uploader still holds at most concurrency + max_queued chunks
+    """
+
+    def __init__(self, upload_fn, concurrency=None, max_queued=None, pool=None):
+
+        self.upload_fn = upload_fn
+        self.concurrency = concurrency or cfg.upload_workers
+        max_queued = cfg.upload_queue if max_queued is None else max_queued
+
+        self.shared = pool is not None
+        self.pool = pool if self.shared else ThreadPoolExecutor(self.concurrency)
+        self.slots = threading.BoundedSemaphore(self.concurrency + max_queued)
+        self.lock = threading.Lock()
+        self.futures = []
+        self.failed = False
+
+        # seconds spent uploading (summed over threads) and blocked waiting for a free slot
+        self.upload_seconds = 0.0
+        self.wait_seconds = 0.0
+        self.n_chunks = 0
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+        return False
+
+    def run(self, df, args):
+
+        try:
+            if self.failed:
+                return
+            start = time.perf_counter()
+            with swat_trace.span('upload', rows = len(df), bytes_in = swat_trace.nbytes(df)):
+                self.upload_fn(df, *args)
+            with self.lock:
+                self.upload_seconds += time.perf_counter() - start
+
+        except Exception:
+            self.failed = True
+            raise
+
+        finally:
+            self.slots.release()
+
+    def raise_failed(self):
+        """Raise the error of the earliest failed upload, if any, after cancelling the rest"""
+
+        if not self.failed:
+            return
+
+        # wait on uploads in submit order so the earliest failure is the one raised
+        for future in self.futures:
+            if not future.cancelled() and future.exception() is not None:
+                self.abort()
+                raise future.exception()
+
+    def submit(self, df, *args):
+        """Queue a chunk for upload, blocking while the queue is full"""
+
+        self.raise_failed()
+
+        start = time.perf_counter()
+        self.slots.acquire()
+        self.wait_seconds += time.perf_counter() - start
+
+        self.futures.append(self.pool.submit(swat_trace.bind(self.run), df, args))
+        self.futures = [f for f in self.futures if not f.done() or f.exception() is not None]
+        self.n_chunks += 1
+
+    def close(self):
+        """Wait for all uploads to finish, raising the error of the earliest failed chunk"""
+
+        start = time.perf_counter()
+        try:
+            for future in self.futures:
+                future.result()
+        except Exception:
+            self.abort()
+            raise
+        finally:
+            self.wait_seconds += time.perf_counter() - start
+
+        if not self.shared:
+            self.pool.shutdown()
+
+    def abort(self):
+        """Cancel uploads that haven't started and wait for running ones to stop"""
+
+        self.failed = True
+        for future in self.futures:
+            future.cancel()
+
+        if self.shared:
+            wait(self.futures)
+        else:
+            self.pool.shutdown(wait=True)
+
+
+class StagedLoad:
+    """Collects a file's chunks as compressed parquet files under a staging
+    prefix, so the whole file can go into BigQuery with a single load job
+    rather than one job per chunk.
+
+    write() has the same signature as push_to_bq, so it can be handed to an
+    Uploader and staged from several threads at once. Chunks given a job id
+    are staged under it, so a checkpointed load that's resumed under the
+    same prefix can find the chunks staged before it failed.
+
+    Args:
+        bucket_nm: the bucket to stage chunks in
+        prefix: the folder the chunks are staged under, unique to the load
+    """
+
+    def __init__(self, bucket_nm, prefix):
+
+        self.bucket = swat_io.get_bucket(bucket_nm)
+        self.prefix = prefix.rstrip('/')
+        self.lock = threading.Lock()
+        self.blobs = []
+        self.n_rows = 0
+        self.n_bytes = 0
+
+    def part(self, job_id):
+        """The blob a chunk with the given job id is staged as"""
+
+        return self.bucket.blob('{}/{}.parquet'.format(self.prefix, job_id))
+
+    def write(self, df, dataset_nm, table_nm, job_id=None):
+        """Stage a chunk as a parquet file, noting the table it's bound for"""
+
+        with self.lock:
+            blob = self.part(job_id) if job_id else self.bucket.blob('{}/part-{:05d}.parquet'.format(self.prefix, len(self.blobs)))
+            self.blobs.append(blob)
+            self.table = (dataset_nm, table_nm)
+
+        n_bytes = swat_io.upload_parquet(df, blob)
+        swat_trace.add(bytes_out = n_bytes)
+
+        with self.lock:
+            self.n_rows += len(df)
+            self.n_bytes += n_bytes
+
+    def restore(self, job_ids, n_rows, dataset_nm, table_nm):
+        """Add the chunks staged by an earlier attempt at the load, from its checkpoint"""
+
+        with self.lock:
+            self.blobs += [self.part(job_id) for job_id in job_ids]
+            self.n_rows += n_rows
+            self.table = (dataset_nm, table_nm)
+
+    def uris(self):
+
+        return [swat_io.blob_uri(blob) for blob in self.blobs]
+
+    def load(self, load_fn, job_id=None):
+        """Load all staged chunks with one call of load_fn(uris, dataset_nm, table_nm, job_id), e.g. push_staged_to_bq"""
+
+        if not self.blobs:
+            return
+
+        print('Staged {} rows in {} parquet files, {:.1f}MB'.format(self.n_rows, len(self.blobs), self.n_bytes / 10**6))
+        load_fn(self.uris(), *self.table, job_id = job_id)
+
+    def cleanup(self):
+        """Delete the staged chunks"""
+
+        for blob in self.blobs:
+            try:
+                blob.delete()
+            except Exception as e:
+                print('Could not delete staged file {}: {}'.format(blob.name, e))
@@ -0,0 +1,370 @@
+import os
+import argparse
+import numpy as np
+import pandas as pd
+import config as cfg
+
+
+# variable names written to the headers of generated files, cycled and numbered if more are asked for
+var_names = {'rch' : ['FLOW_IN', 'FLOW_OUT', 'EVAP', 'TLOSS', 'SED_IN', 'SED_OUT', 'ORGN_IN', 'ORGN_OUT', 'ORGP_IN', 'ORGP_OUT',
+                      'NO3_IN', 'NO3_OUT', 'NH4_IN', 'NH4_OUT', 'NO2_IN', 'NO2_OUT', 'MINP_IN', 'MINP_OUT', 'CHLA_IN', 'CHLA_OUT',
+                      'CBOD_IN', 'CBOD_OUT', 'DISOX_IN', 'DISOX_OUT', 'SOLPST_IN', 'SOLPST_OUT', 'SORPST_IN', 'SORPST_OUT',
+                      'REACTPST', 'VOLPST', 'SETTLPST', 'RESUSP_PST', 'DIFFUSEPST', 'REACBEDPST', 'BURYPST', 'BED_PST',
+                      'BACTP_OUT', 'BACTLP_OUT', 'CMETAL1', 'CMETAL2', 'CMETAL3', 'TOT_N', 'TOT_P', 'NO3CONC', 'WTMP'],
+             'sed' : ['SED_IN', 'SED_OUT', 'SAND_IN', 'SAND_OUT', 'SILT_IN', 'SILT_OUT', 'CLAY_IN', 'CLAY_OUT',
+                      'SMAG_IN', 'SMAG_OUT', 'LAG_IN', 'LAG_OUT', 'GRA_IN', 'GRA_OUT', 'CH_BNK', 'CH_BED', 'CH_DEP',
+                      'FP_DEP', 'TSS'],
+             'rsv' : ['VOLUME', 'FLOW_IN', 'FLOW_OUT', 'PRECIP', 'EVAP', 'SEEPAGE', 'SED_IN', 'SED_OUT', 'SED_CONC',
+                      'ORGN_IN', 'ORGN_OUT', 'RES_ORGN', 'ORGP_IN', 'ORGP_OUT', 'RES_ORGP', 'NO3_IN', 'NO3_OUT',
+                      'RES_NO3', 'NO2_IN', 'NO2_OUT', 'RES_NO2', 'NH3_IN', 'NH3_OUT', 'RES_NH3', 'MINP_IN', 'MINP_OUT',
+                      'RES_MINP', 'CHLA_IN', 'CHLA_OUT', 'SECCHIDEPTH', 'PEST_IN', 'REACTPST', 'VOLPST', 'SETTLPST',
+                      'RESUSP_PST', 'DIFFUSEPST', 'REACBEDPST', 'BURYPST', 'PEST_OUT', 'PSTCNC', 'PSTCNCB'],
+             'hru' : ['PRECIPmm', 'SNOFALLmm', 'SNOMELTmm', 'IRRmm', 'PETmm', 'ETmm', 'SW_INITmm', 'SW_ENDmm', 'PERCmm',
+                      'GW_RCHGmm', 'DA_RCHGmm', 'REVAPmm', 'SA_IRRmm', 'DA_IRRmm', 'SA_STmm', 'DA_STmm', 'SURQ_GENmm',
+                      'SURQ_CNTmm', 'TLOSSmm', 'LATQGENmm', 'GW_Qmm', 'WYLDmm', 'DAILYCN', 'TMP_AVdgC', 'TMP_MXdgC',
+                      'TMP_MNdgC', 'SOL_TMPdgC', 'SOLARMJ/m2', 'SYLDt/ha', 'USLEt/ha'],
+             'sub' : ['PRECIPmm', 'SNOMELTmm', 'PETmm', 'ETmm', 'SWmm', 'PERCmm', 'SURQmm', 'GW_Qmm', 'WYLDmm',
+                      'SYLDt/ha', 'ORGNkg/ha', 'ORGPkg/ha', 'NSURQkg/ha', 'SOLPkg/ha', 'SEDPkg/ha', 'LAT Q(mm)',
+                      'LATNO3kg/h', 'GWNO3kg/ha', 'CHOLAmic/L', 'CBODU mg/L', 'DOXQ mg/L', 'TNO3kg/ha', 'QTILEmm',
+                      'TVAPkg/ha']}
+
+# default number of variable columns of each generated file
+n_vars = {'rch' : 45, 'sed' : 19, 'rsv' : 41, 'hru' : 30, 'sub' : 24}
+
+
+def var_list(ftype, n):
+    """Function to get n variable names for a file type"""
+
+    names = var_names[ftype]
+
+    return [names[i % len(names)] + ('' if i < len(names) else str(i // len(names))) for i in range(n)]
+
+
+def time_steps(year_start, n_years, model_period):
+    """Function to list the (year, MON) of every block of rows in an output file, in file order
+
+    Monthly files have a block of yearly summary rows, with MON holding the
+    year, after the twelve months of each year.
+
+    Args:
+        year_start: first year of output, after the warm up period
+        n_years: number of years of output
+        model_period: either 'monthly' or 'daily'
+    Returns:
+        List: (year, MON, is_summary) tuples
+    """
+
+    steps = []
+    for year in range(year_start, year_start + n_years):
+        if model_period == 'monthly':
+            steps += [(year, m, False) for m in range(1, 13)]
+            steps.append((year, year, True))
+        else:
+            n_days = 366 if (year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)) else 365
+            steps += [(year, d, False) for d in range(1, n_days + 1)]
+
+    return steps
+
+
+def fmt_e(values, width, digits=4):
+    """Function to format an array of floats in Fortran E notation, right aligned in width"""
+
+    return np.char.rjust(np.char.mod('%.{}E'.format(digits), values), width)
+
+
+def fmt_f(values, width, digits=3):
+    """Function to format an array of floats in fixed point, right aligned in width"""
+
+    return np.char.rjust(np.char.mod('%.{}f'.format(digits), values), width)
+
+
+def fmt_i(values, width):
+    """Function to format an array of ints, right aligned in width"""
+
+    return np.char.rjust(np.char.mod('%d', values), width)
+
+
+def write_block(file, cols):
+    """Function to write one time step of rows, given the formatted text of each column"""
+
+    lines = cols[0]
+    for col in cols[1:]:
+        lines = np.char.add(lines, col)
+
+    file.write('\n'.join(lines.tolist()) + '\n')
+
+
+def header_lines(n, title):
+    """Function to make the n-1 lines of run information above the column header of an output file"""
+
+    lines = [' ' + title, ' SWAT Oct 14 2016    VER 2012/Rev 664', ' General Input/Output section (file.cio):',
+             ' Synthetic SWAT run for pipeline benchmarking']
+
+    return (lines + [''] * n)[:n - 1]
+
+
+def gen_reach(fpath, ftype, n_loc, steps, n_var, rng, final_summary):
+    """Function to write an output.rch or output.sed file"""
+
+    widths = cfg.fixed_col_widths[ftype]
+    names = var_list(ftype, n_var)
+    fixed = ['', 'RCH', 'GIS', 'MON'] + (['AREAkm2'] if ftype == 'rch' else [])
+    header = ''.join(nm.rjust(w) for nm, w in zip(fixed, widths)) + ''.join(nm.rjust(cfg.var_col_width[ftype]) for nm in names)
+
+    loc = np.arange(1, n_loc + 1)
+    label = np.full(n_loc, 'REACH'.ljust(widths[0]))
+    area = rng.uniform(1, 5000, n_loc)
+    base = rng.lognormal(1, 2, (n_loc, n_var))
+
+    with open(fpath, 'w') as file:
+        file.write('\n'.join(header_lines(cfg.file_skips[ftype], 'output.' + ftype) + [header]) + '\n')
+
+        for year, mon, summary in steps + final_summary:
+            cols = [label, fmt_i(loc, widths[1]), fmt_i(np.zeros(n_loc, dtype=int), widths[2]), fmt_i(np.full(n_loc, mon), widths[3])]
+            if ftype == 'rch':
+                cols.append(fmt_e(area, widths[4]))
+            values = base * rng.uniform(0.5, 1.5, (n_loc, 1))
+            cols += [fmt_e(values[:, j], cfg.var_col_width[ftype]) for j in range(n_var)]
+            write_block(file, cols)
+
+
+def gen_rsv(fpath, n_loc, steps, n_var, rng):
+    """Function to write an output.rsv file"""
+
+    widths = cfg.fixed_col_widths['rsv']
+    names = var_list('rsv', n_var)
+    header = ''.join(nm.rjust(w) for nm, w in zip(['', 'RES', 'MON'], widths)) + ''.join(nm.rjust(cfg.var_col_width['rsv']) for nm in names)
+
+    loc = np.arange(1, n_loc + 1)
+    label = np.full(n_loc, 'RES'.ljust(widths[0]))
+    base = rng.lognormal(3, 2, (n_loc, n_var))
+
+    with open(fpath, 'w') as file:
+        file.write('\n'.join(header_lines(cfg.file_skips['rsv'], 'output.rsv') + [header]) + '\n')
+
+        for year, mon, summary in steps:
+            values = base * rng.uniform(0.5, 1.5, (n_loc, 1))
+            cols = [label, fmt_i(loc, widths[1]), fmt_i(np.full(n_loc, mon), widths[2])]
+            cols += [fmt_e(values[:, j], cfg.var_col_width['rsv']) for j in range(n_var)]
+            write_block(file, cols)
+
+
+def gen_vel(fpath, n_sub, steps, rng):
+    """Function to write an output.vel file, one row per day with a velocity column for each subbasin"""
+
+    width = cfg.var_col_width['vel']
+    header = 'Day'.rjust(5) + 'Year'.rjust(5) + ''.join(str(s).rjust(width) for s in range(1, n_sub + 1))
+    base = rng.uniform(0.01, 2, n_sub)
+    days = [(year, mon) for year, mon, summary in steps if not summary]
+
+    with open(fpath, 'w') as file:
+        file.write('\n'.join(header_lines(cfg.file_skips['vel'], 'output.vel') + [header]) + '\n')
+
+        day = np.array([d for y, d in days])
+        year = np.array([y for y, d in days])
+        values = base[None, :] * rng.uniform(0.5, 1.5, (len(days), 1))
+        cols = [fmt_i(day, 5), fmt_i(year, 5)] + [fmt_f(values[:, j], width, 4) for j in range(n_sub)]
+        write_block(file, cols)
+
+
+def gen_hru(fpath, n_loc, steps, n_var, rng, final_summary=()):
+    """Function to write an output.hru file, with its column header aligned to the fixed widths"""
+
+    widths = cfg.fixed_col_widths['hru']
+    width = cfg.var_col_width['hru']
+    names = var_list('hru', n_var)
+    header = 'LULC'.ljust(widths[0]) + ''.join(nm.rjust(w) for nm, w in zip(['HRU', 'GIS', 'SUB', 'MGT', 'MON', 'AREAkm2'], widths[1:])) \
+        + ''.join(nm.rjust(width) for nm in names)
+
+    loc = np.arange(1, n_loc + 1)
+    lulc = rng.choice(['FRSD', 'AGRR', 'URML', 'PAST', 'WETF', 'RNGE'], n_loc)
+    sub = (loc - 1) // max(1, n_loc // cfg.unique_locations['sub']) + 1
+    gis = np.char.add(np.char.zfill(np.char.mod('%d', sub), 5), np.char.zfill(np.char.mod('%d', loc), 4))
+    area = rng.uniform(0.01, 50, n_loc)
+    base = rng.lognormal(0, 2, (n_loc, n_var))
+
+    with open(fpath, 'w') as file:
+        file.write('\n'.join(header_lines(cfg.file_skips['hru'], 'output.hru') + [header]) + '\n')
+
+        for year, mon, summary in steps + list(final_summary):
+            values = base * rng.uniform(0, 2, (n_loc, 1))
+            cols = [np.char.ljust(lulc, widths[0]), fmt_i(loc, widths[1]), np.char.rjust(gis, widths[2]),
+                    fmt_i(sub, widths[3]), fmt_i(np.zeros(n_loc, dtype=int), widths[4]), fmt_i(np.full(n_loc, mon), widths[5]),
+                    fmt_f(area, widths[6], 5)]
+            cols += [fmt_f(values[:, j], width) for j in range(n_var)]
+            write_block(file, cols)
+
+
+def gen_sub(fpath, n_loc, steps, n_var, rng, final_summary=()):
+    """Function to write an output.sub file, where the 19th variable column is a character wider than the header"""
+
+    widths = cfg.fixed_col_widths['sub']
+    width = cfg.var_col_width['sub']
+    names = var_list('sub', n_var)
+    header = ''.join(nm.rjust(w) for nm, w in zip(['', 'SUB', 'GIS', 'MON', 'AREAkm2'], widths)) + ''.join(nm.rjust(width) for nm in names)
+
+    loc = np.arange(1, n_loc + 1)
+    label = np.full(n_loc, 'BIGSUB'.ljust(widths[0] + 1))
+    area = rng.uniform(1, 500, n_loc)
+    base = rng.lognormal(0, 2, (n_loc, n_var))
+
+    with open(fpath, 'w') as file:
+        file.write('\n'.join(header_lines(cfg.file_skips['sub'], 'output.sub') + [header]) + '\n')
+
+        for year, mon, summary in steps + list(final_summary):
+            values = base * rng.uniform(0, 2, (n_loc, 1))
+            cols = [label, fmt_i(loc, widths[1]), fmt_i(np.zeros(n_loc, dtype=int), widths[2]),
+                    fmt_i(np.full(n_loc, mon), widths[3]), fmt_e(area, widths[4])]
+            cols += [fmt_f(values[:, j], width + (1 if j == 18 else 0)) for j in range(n_var)]
+            write_block(file, cols)
+
+
+def gen_pst(fpath, n_loc, steps, rng, chem=1):
+    """Function to write an output.pst file for one chemical, ending in an annual summary"""
+
+    widths = cfg.fixed_col_widths['pst']
+    head = header_lines(cfg.file_skips['pst'] - 2, 'output.pst') + [' Pesticide # {}'.format(chem).ljust(20) + ' ' + str(chem), '']
+    header = ''.join(nm.rjust(w) for nm, w in zip(['GIS', 'YEAR', 'MON', 'SOLUBLE', 'SORBED'], widths))
+
+    gis = np.char.zfill(np.char.mod('%d', np.arange(1, n_loc + 1)), 9)
+
+    with open(fpath, 'w') as file:
+        file.write('\n'.join(head + [header]) + '\n')
+
+        for year, mon, summary in steps:
+            if summary:
+                continue
+            cols = [np.char.rjust(gis, widths[0]), fmt_i(np.full(n_loc, year), widths[1]), fmt_i(np.full(n_loc, mon), widths[2]),
+                    fmt_e(rng.lognormal(0, 2, n_loc), widths[3], 8), fmt_e(rng.lognormal(0, 2, n_loc), widths[4], 8)]
+            write_block(file, cols)
+
+        file.write(' ANNUAL AVERAGE\n')
+
+
+def gen_cio(fpath, year_start, n_years, warm_up=2):
+    """Function to write a file.cio for a run whose output starts in year_start
+
+    read_cio takes the number of years simulated from line 8 and the first
+    year from line 9, then drops the warm up years from both.
+    """
+
+    lines = ['Master Watershed File: file.cio', 'Project Description:', 'Synthetic SWAT run for pipeline benchmarking',
+             'General Input/Output section (file.cio):', 'Fri Oct 14 00:00:00 2022 ARCGIS-SWAT interface AV', '',
+             'General Information/Watershed Configuration:',
+             '{:>16}    | NBYR : Number of years simulated'.format(n_years + warm_up),
+             '{:>16}    | IYR : Beginning year of simulation'.format(year_start - warm_up),
+             '{:>16}    | IDAF : Beginning julian day of simulation'.format(1),
+             '{:>16}    | IDAL : Ending julian day of simulation'.format(365),
+             '{:>16}    | NYSKIP: number of years to skip output printing/summarization'.format(warm_up)]
+
+    with open(fpath, 'w') as file:
+        file.write('\n'.join(lines) + '\n')
+
+
+def headers_csv(n_var, n_loc):
+    """Function to make the file_metadata_headers.csv table read by read_SWAT, one column of field names per file type"""
+
+    cols = {'rch' : ['RCH', 'GIS', 'MON', 'AREAkm2'] + var_list('rch', n_var['rch']),
+            'sed' : ['RCH', 'GIS', 'MON'] + var_list('sed', n_var['sed']),
+            'rsv' : ['RES', 'MON'] + var_list('rsv', n_var['rsv']),
+            'vel' : ['Day', 'Year'] + [str(s) for s in range(1, n_loc['vel'] + 1)],
+            'pst' : ['GIS', 'YEAR', 'MON', 'SOLUBLE', 'SORBED']}
+
+    return pd.DataFrame({k : pd.Series(v) for k, v in cols.items()})
+
+
+def generate(out_dir, ftypes=None, n_years=2, model_period='daily', year_start=2000, locations=None, variables=None, seed=0):
+    """Function to write a set of synthetic SWAT output files, byte for byte in the
+    layouts in config.py, plus the file.cio and file_metadata_headers.csv they're read with
+
+    Args:
+        out_dir: folder to write to, created if needed
+        ftypes: file types to write, all of cfg.target_files if None
+        n_years: years of output, after the warm up period
+        model_period: either 'monthly' or 'daily'
+        year_start: first year of output
+        locations: dict of file type to number of locations, defaults to cfg.unique_locations
+            (vel takes the number of subbasins, pst the number of rows per time step)
+        variables: dict of file type to number of variable columns, defaults to n_vars
+        seed: random seed
+    Returns:
+        Dict: file type to the path written
+    """
+
+    ftypes = ftypes or cfg.target_files
+    n_loc = dict(cfg.unique_locations, vel=cfg.unique_locations['sub'], pst=cfg.unique_locations['sub'])
+    n_loc.update(locations or {})
+    n_var = dict(n_vars, **(variables or {}))
+    rng = np.random.default_rng(seed)
+
+    os.makedirs(out_dir, exist_ok=True)
+    steps = time_steps(year_start, n_years, model_period)
+
+    # monthly reach, hru and sub files end in a block of average annual values, with MON holding the number of years
+    final_summary = [(None, n_years, True)] if model_period == 'monthly' else []
+
+    paths = {}
+    for ftype in ftypes:
+        fpath = os.path.join(out_dir, 'output.' + ftype)
+
+        if ftype in ['rch', 'sed']:
+            gen_reach(fpath, ftype, n_loc[ftype], steps, n_var[ftype], rng, final_summary)
+        elif ftype == 'rsv':
+            gen_rsv(fpath, n_loc['rsv'], steps, n_var['rsv'], rng)
+        elif ftype == 'vel':
+            gen_vel(fpath, n_loc['vel'], steps, rng)
+        elif ftype == 'hru':
+            gen_hru(fpath, n_loc['hru'], steps, n_var['hru'], rng, final_summary)
+        elif ftype == 'sub':
+            gen_sub(fpath, n_loc['sub'], steps, n_var['sub'], rng, final_summary)
+        elif ftype == 'pst':
+            gen_pst(fpath, n_loc['pst'], steps, rng)
+
+        paths[ftype] = fpath
+
+    gen_cio(os.path.join(out_dir, 'file.cio'), year_start, n_years)
+    headers_csv(n_var, n_loc).to_csv(os.path.join(out_dir, 'file_metadata_headers.csv'), index=False)
+
+    return paths
+
+
+def generate_bucket(bucket_root, run_name, **kwargs):
+    """Function to lay out a synthetic run in a local bucket, as it would be uploaded to healthy_gulf
+
+    The files go to <bucket_root>/healthy_gulf/SWAT_outputs/<run_name>/, with
+    file_metadata_headers.csv in SWAT_outputs/, ready for bq_load with
+    SWAT_LOCAL_BUCKETS=<bucket_root>.
+
+    Args:
+        bucket_root: local folder standing in for cloud storage
+        run_name: run folder name in 'ModelInfo_TimeInterval' format, e.g. 'Bench_daily'
+        **kwargs: passed to generate, model_period is taken from run_name
+    Returns:
+        Dict: file type to the bucket path of the file, e.g. 'SWAT_outputs/Bench_daily/output.rch'
+    """
+
+    outputs = os.path.join(bucket_root, 'healthy_gulf', 'SWAT_outputs')
+    paths = generate(os.path.join(outputs, run_name), model_period=run_name.split('_')[-1], **kwargs)
+    os.replace(os.path.join(outputs, run_name, 'file_metadata_headers.csv'), os.path.join(outputs, 'file_metadata_headers.csv'))
+
+    return {ftype : '/'.join(['SWAT_outputs', run_name, os.path.basename(p)]) for ftype, p in paths.items()}
+
+
+if __name__ == '__main__':
+
+    # e.g. python synthetic.py tmp/bucket Bench_daily --years 3 --types rch hru --locations hru=500
+    parser = argparse.ArgumentParser(description='Write synthetic SWAT output files to a local bucket folder')
+    parser.add_argument('bucket_root')
+    parser.add_argument('run_name')
+    parser.add_argument('--years', type=int, default=2)
+    parser.add_argument('--types', nargs='+', default=None)
+    parser.add_argument('--locations', nargs='+', default=[], help='ftype=n pairs')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    locations = {kv.split('=')[0] : int(kv.split('=')[1]) for kv in args.locations}
+    paths = generate_bucket(args.bucket_root, args.run_name, ftypes=args.types, n_years=args.years,
+                            locations=locations, seed=args.seed)
+
+    for ftype, path in paths.items():
+        print(path)
@@ -0,0 +1,60 @@
+import os
+import sys
+import pytest
+
+# the function's modules are imported by name, as they are when deployed
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config as cfg
+import swat_cache
+import swat_layout
+import synthetic
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    """Start each test without the layouts and cached objects of the last one"""
+
+    swat_layout.layouts.clear()
+    swat_cache.values.clear()
+    swat_cache.objects.clear()
+    yield
+    swat_layout.layouts.clear()
+    swat_cache.values.clear()
+    swat_cache.objects.clear()
+
+
+@pytest.fixture
+def local_cloud(tmp_path, monkeypatch):
+    """Local stand-ins for cloud storage and BigQuery, as for offline runs
+
+    Returns:
+        Dict: the bucket root, BigQuery root and tmp folder
+    """
+
+    roots = {'buckets' : str(tmp_path / 'buckets'), 'bq' : str(tmp_path / 'bq'), 'tmp' : str(tmp_path / 'tmp')}
+    for path in roots.values():
+        os.makedirs(path)
+
+    monkeypatch.setattr(cfg, 'local_bucket_root', roots['buckets'])
+    monkeypatch.setattr(cfg, 'local_bq_root', roots['bq'])
+    monkeypatch.setattr(cfg, 'tmp_dir', roots['tmp'])
+    monkeypatch.setattr(cfg, 'store_root', None)
+
+    return roots
+
+
+@pytest.fixture(scope='session')
+def daily_run(tmp_path_factory):
+    """Small synthetic daily run of the hru and sub files, which are named from their own headers"""
+
+    return synthetic.generate(str(tmp_path_factory.mktemp('daily')), ['hru', 'sub'], n_years=1,
+                              locations={'hru' : 30, 'sub' : 7}, variables={'hru' : 12})
+
+
+@pytest.fixture(scope='session')
+def monthly_run(tmp_path_factory):
+    """Small synthetic monthly run of the hru and sub files, with yearly and run average summary rows"""
+
+    return synthetic.generate(str(tmp_path_factory.mktemp('monthly')), ['hru', 'sub'], n_years=3, model_period='monthly',
+                              locations={'hru' : 30, 'sub' : 7}, variables={'hru' : 12})
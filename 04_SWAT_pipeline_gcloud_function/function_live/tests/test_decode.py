@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+import pytest
+import swat_decode
+import swat_layout
+
+
+def read_fwf(fpath, layout):
+    """The decoded columns of a file as pd.read_fwf reads them, the reader swat_decode replaces"""
+
+    df = pd.read_fwf(fpath, skiprows=layout.skip_rows, header=None, widths=list(layout.col_widths),
+                     names=list(layout.names), dtype={layout.names[i] : d for i, d in layout.dtype_map().items()})
+
+    return df[layout.out_names()]
+
+
+def assert_same(df, expected):
+    """Check decoded columns hold the values pd.read_fwf gives, categories as their text"""
+
+    assert list(df.columns) == list(expected.columns)
+    assert len(df) == len(expected)
+
+    for name in df.columns:
+        if isinstance(expected[name].dtype, pd.CategoricalDtype):
+            assert isinstance(df[name].dtype, pd.CategoricalDtype)
+            assert df[name].astype(str).tolist() == expected[name].astype(str).tolist()
+        else:
+            assert df[name].dtype == expected[name].dtype, name
+            np.testing.assert_array_equal(df[name].to_numpy(), expected[name].to_numpy(), err_msg=name)
+
+
+@pytest.mark.parametrize('ftype', ['hru', 'sub'])
+def test_read_fixed_matches_read_fwf(daily_run, ftype):
+
+    fpath = daily_run[ftype]
+    layout = swat_layout.file_layout(ftype, fpath)
+
+    df = swat_decode.read_fixed(fpath, layout.skip_rows, layout.col_widths, layout.dtype_map(), layout.names, layout.usecols)
+
+    assert_same(df, read_fwf(fpath, layout))
+
+
+@pytest.mark.parametrize('ftype', ['hru', 'sub'])
+def test_chunks_share_categories(daily_run, ftype):
+
+    fpath = daily_run[ftype]
+    layout = swat_layout.file_layout(ftype, fpath)
+
+    chunks = list(swat_decode.read_fixed(fpath, layout.skip_rows, layout.col_widths, layout.dtype_map(), layout.names,
+                                         layout.usecols, chunksize=100))
+
+    assert len(chunks) > 1
+    assert_same(pd.concat(chunks, ignore_index=True), read_fwf(fpath, layout))
+
+
+def test_decode_rows_blank_fields(tmp_path):
+
+    lines = ['LULC  HRU      PRECIP       FLOW',
+             'AGRR    1     1.2345  1.000E+02',
+             'FRSD    2            -2.500E-01',
+             'AGRR    3     0.0010           ',
+             'URML    4    12.5000 3.1416E-10']
+    fpath = tmp_path / 'blanks.txt'
+    fpath.write_text('\n'.join(lines) + '\n')
+
+    widths = [4, 5, 11, 11]
+    names = ['LULC', 'HRU', 'PRECIP', 'FLOW']
+    rows = np.frombuffer(''.join(lines[1:]).encode('ascii'), dtype=np.uint8).reshape(len(lines) - 1, -1)
+
+    df = swat_decode.decode_rows(rows, widths, {0 : 'category'}, names)
+    expected = pd.read_fwf(fpath, skiprows=1, header=None, widths=widths, names=names, dtype={'LULC' : 'category'})
+
+    assert df['PRECIP'].isnull().tolist() == [False, True, False, False]
+    assert df['FLOW'].isnull().tolist() == [False, False, True, False]
+    assert df['HRU'].dtype == np.int64
+    assert df['LULC'].cat.categories.tolist() == ['AGRR', 'FRSD', 'URML']
+    assert_same(df, expected)
+
+
+def test_decode_rows_blank_integer(tmp_path):
+
+    rows = np.frombuffer(b'AGRR    1AGRR     ', dtype=np.uint8).reshape(2, -1)
+
+    with pytest.raises(ValueError):
+        swat_decode.decode_rows(rows, [4, 5], {0 : 'category', 1 : 'int16'}, ['LULC', 'HRU'])
@@ -0,0 +1,113 @@
+import os
+from datetime import datetime
+import numpy as np
+import pyarrow as pa
+import pandas as pd
+import pytest
+import swat_format
+import swat_layout
+import swat_load
+import synthetic
+
+
+def monthly_mon(n_years, n_loc, year_start=2000):
+    """MON values of a monthly file: twelve months then a yearly summary each year, then the run averages"""
+
+    mon = []
+    for year in range(year_start, year_start + n_years):
+        mon += [m for m in range(1, 13) for _ in range(n_loc)] + [year] * n_loc
+
+    return np.array(mon + [n_years] * n_loc)
+
+
+def test_summary_mask():
+
+    date_index = swat_format.DateIndex({'start' : datetime(2000, 1, 1), 'end' : datetime(2001, 12, 31)}, 'monthly', 3)
+    mon = monthly_mon(2, 3)
+
+    summary = date_index.summary_mask(mon)
+
+    assert len(mon) - summary.sum() == date_index.n_rows
+    assert (mon[~summary] <= 12).all()
+
+    # the yearly blocks after each twelve months, and the run averages at the end
+    expected = np.zeros(len(mon), dtype=bool)
+    expected[36:39] = expected[75:81] = True
+    assert (summary == expected).all()
+
+
+@pytest.mark.parametrize('chunk', [1, 4, 37, 40])
+def test_summary_mask_chunks(chunk):
+
+    date_index = swat_format.DateIndex({'start' : datetime(2000, 1, 1), 'end' : datetime(2001, 12, 31)}, 'monthly', 3)
+    mon = monthly_mon(2, 3)
+
+    # the final block is placed by the count of data rows before each chunk
+    masks = []
+    row_offset = 0
+    for start in range(0, len(mon), chunk):
+        masks.append(date_index.summary_mask(mon[start:start + chunk], row_offset))
+        row_offset += int((~masks[-1]).sum())
+
+    assert (np.concatenate(masks) == date_index.summary_mask(mon)).all()
+
+
+def test_summary_mask_too_long():
+
+    date_index = swat_format.DateIndex({'start' : datetime(2000, 1, 1), 'end' : datetime(2000, 12, 31)}, 'monthly', 3)
+
+    with pytest.raises(ValueError):
+        date_index.summary_mask(monthly_mon(2, 3))
+
+
+@pytest.mark.parametrize('ftype', ['hru', 'sub'])
+def test_monthly_summaries_dropped(monthly_run, ftype):
+
+    fpath = monthly_run[ftype]
+    layout = swat_layout.file_layout(ftype, fpath)
+    date_index = swat_format.DateIndex(swat_load.read_cio(os.path.join(os.path.dirname(fpath), 'file.cio')), 'monthly', layout.n_locations)
+    summaries = swat_load.summary_filter(layout, 'monthly', date_index)
+
+    chunks = []
+    row_offset = 0
+    for chunk in swat_load.chunks_SWAT(fpath, ftype, 50, engine='pandas', layout=layout, summaries=summaries):
+        chunks.append(date_index.add_dates(chunk, row_offset))
+        row_offset += len(chunk)
+    df = pd.concat(chunks, ignore_index=True)
+
+    # three years of months, each dated with its own month, with the yearly and run average rows gone
+    assert len(df) == date_index.n_rows == 36 * layout.n_locations
+    assert summaries.n_summary == 4 * layout.n_locations
+    assert (df['MON'].to_numpy() == pd.to_datetime(df['date']).dt.month.to_numpy()).all()
+    assert df['year'].tolist() == sorted(df['year'].tolist())
+
+
+@pytest.mark.parametrize('ftype', ['rch', 'sed', 'hru'])
+@pytest.mark.parametrize('chunk_format', ['pandas', 'arrow'])
+def test_summaries_skipped_while_decoding(local_cloud, ftype, chunk_format):
+
+    synthetic.generate_bucket(local_cloud['buckets'], 'Test_monthly', ftypes=[ftype], n_years=3, locations={ftype : 5}, variables={ftype : 6})
+    fpath = os.path.join(local_cloud['buckets'], 'healthy_gulf', 'SWAT_outputs', 'Test_monthly', 'output.' + ftype)
+    layout = swat_layout.file_layout(ftype, fpath)
+    date_index = swat_format.DateIndex(swat_load.read_cio(os.path.join(os.path.dirname(fpath), 'file.cio')), 'monthly', layout.n_locations)
+
+    def read(engine):
+        summaries = swat_load.summary_filter(layout, 'monthly', date_index)
+        chunks = [pa.Table.from_batches([c]).to_pandas() if isinstance(c, pa.RecordBatch) else c
+                  for c in swat_load.chunks_SWAT(fpath, ftype, 17, engine=engine, workers=1, chunk_format=chunk_format,
+                                                 layout=layout, summaries=summaries)]
+        return pd.concat(chunks, ignore_index=True), summaries
+
+    df, summaries = read('numpy')
+    expected, dropped = read('pandas')
+
+    # the lines skipped by the decoder are the rows the pandas engine drops once decoded
+    assert summaries.n_summary == dropped.n_summary == 4 * layout.n_locations
+    assert list(df.columns) == list(expected.columns)
+    assert len(df) == len(expected) == date_index.n_rows
+    for name in df.columns:
+        if pd.api.types.is_float_dtype(expected[name]):
+            # older pd.read_fwf parses floats to within an ulp rather than exactly
+            np.testing.assert_allclose(df[name].to_numpy(), expected[name].to_numpy(), rtol=1e-15, err_msg=name)
+        else:
+            assert df[name].astype(str).tolist() == expected[name].astype(str).tolist(), name
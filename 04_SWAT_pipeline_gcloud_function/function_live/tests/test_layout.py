@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+import config as cfg
+import swat_decode
+import swat_layout
+
+
+def lines_of(widths, n=3):
+    """Data lines of right-aligned values filling columns of the given widths"""
+
+    return [''.join(' ' + '{:.3f}'.format(1000 * (i + 1) + j).rjust(w - 1) for j, w in enumerate(widths)) for i in range(n)]
+
+
+def test_var_widths_even():
+
+    lines = lines_of([10] * 5)
+
+    assert swat_layout.var_widths(0, len(lines[0]), 10, lines) == [10] * 5
+
+
+def test_var_widths_wider_column():
+
+    widths = [10] * 18 + [11] + [10] * 5
+    lines = lines_of(widths)
+
+    assert swat_layout.var_widths(0, len(lines[0]), 10, lines) == widths
+
+
+def test_var_widths_after_fixed_columns():
+
+    lines = ['BIGSUB  1' + line for line in lines_of([10, 11, 10])]
+
+    assert swat_layout.var_widths(9, len(lines[0]), 10, lines) == [10, 11, 10]
+
+
+def test_var_widths_trailing_padding():
+
+    lines = [line + '   ' for line in lines_of([10] * 4)]
+
+    assert swat_layout.var_widths(0, len(lines[0]), 10, lines) == [10] * 4
+
+
+def test_var_widths_unsplittable():
+
+    # a digit past the last column, with no field starting early to show which column it belongs to
+    lines = [line + '7' for line in lines_of([10] * 3)]
+
+    with pytest.raises(ValueError):
+        swat_layout.var_widths(0, len(lines[0]), 10, lines)
+
+
+def test_sub_layout(daily_run):
+
+    layout = swat_layout.file_layout('sub', daily_run['sub'])
+    n_fixed = len(cfg.fixed_col_widths['sub'])
+    var = list(layout.col_widths[n_fixed:])
+
+    # the label column is a character wider than in config.py, and the 19th variable column one wider than the rest
+    assert layout.col_widths[:n_fixed] == (cfg.fixed_col_widths['sub'][0] + 1,) + tuple(cfg.fixed_col_widths['sub'][1:])
+    assert var == [10] * 18 + [11] + [10] * 5
+    assert layout.names[n_fixed:n_fixed + 2] == ('PRECIPmm', 'SNOMELTmm')
+    assert layout.names[n_fixed + 18] == 'CHOLAmicL'
+    assert layout.usecols[0] == 1
+    assert layout.n_locations == 7
+
+    # values on either side of the wider column decode whole
+    df = swat_decode.read_fixed(daily_run['sub'], layout.skip_rows, layout.col_widths, layout.dtype_map(), layout.names, layout.usecols)
+    assert np.isfinite(df[list(layout.names[n_fixed:])].to_numpy()).all()
+    assert (df['SUB'].to_numpy()[:14] == np.tile(np.arange(1, 8), 2)).all()
+
+
+def test_layout_cached_by_header(daily_run):
+
+    first = swat_layout.file_layout('hru', daily_run['hru'])
+    again = swat_layout.file_layout('hru', daily_run['hru'])
+
+    assert list(swat_layout.layouts) == [first.key]
+    assert again == first
+    assert first.n_locations == 30
@@ -0,0 +1,64 @@
+import os
+import glob
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+import config as cfg
+import main
+import swat_load
+import swat_upload
+import synthetic
+
+
+def output_table(local_cloud, ftype):
+    """All the rows loaded into the local stand-in of a file type's output table"""
+
+    files = glob.glob(os.path.join(local_cloud['bq'], 'healthy_gulf', 'SWAT_output_' + ftype, '*.parquet'))
+
+    return pa.concat_tables([pq.read_table(f) for f in files])
+
+
+@pytest.mark.parametrize('ftype', ['rch', 'hru'])
+def test_resume_after_failed_chunk(local_cloud, monkeypatch, ftype):
+
+    paths = synthetic.generate_bucket(local_cloud['buckets'], 'Test_daily', ftypes=[ftype], n_years=1, locations={ftype : 20}, variables={ftype : 6})
+    event = {'bucket' : 'healthy_gulf', 'name' : paths[ftype], 'generation' : '1'}
+    n_rows = 366 * 20
+
+    monkeypatch.setattr(cfg, 'chunk_min_rows', 1000)
+    monkeypatch.setattr(cfg, 'chunk_max_rows', 1000)
+    monkeypatch.setattr(cfg, 'checkpoint_interval_s', 0)
+
+    # rch chunks are loaded one job each, hru chunks are staged as parquet files for one load job
+    uploads = {'n' : 0, 'fail' : 3}
+    push_to_bq, write = swat_load.push_to_bq, swat_upload.StagedLoad.write
+
+    def failing(fn):
+        def upload(*args, **kwargs):
+            uploads['n'] += 1
+            if uploads['n'] == uploads['fail']:
+                raise RuntimeError('upload failed')
+            return fn(*args, **kwargs)
+        return upload
+
+    monkeypatch.setattr(swat_load, 'push_to_bq', failing(push_to_bq))
+    monkeypatch.setattr(swat_upload.StagedLoad, 'write', failing(write))
+
+    with pytest.raises(RuntimeError):
+        main.bq_load(event)
+
+    # the retry resumes from the failed chunk rather than loading the file again
+    uploads.update(n=0, fail=None)
+    main.bq_load(event)
+    assert 0 < uploads['n'] < -(-n_rows // 1000)
+
+    # and once the file is loaded, a repeat of the event loads nothing
+    uploads['n'] = 0
+    main.bq_load(event)
+    assert uploads['n'] == 0
+
+    table = output_table(local_cloud, ftype)
+    keys = set(zip(table.column(cfg.location_cols[ftype]).to_pylist(), table.column('date').to_pylist()))
+
+    assert table.num_rows == len(keys) == n_rows
+    assert len(set(table.column('run_id').to_pylist())) == 1
@@ -6,6 +6,7 @@ SELECT Subbasin, Width_m, Depth_m, Width_m-2*2*Depth_m bottom_width0_m
 FROM `edf-aq-data.healthy_gulf.channel_dims`
 )
 --calculate bankfull flow and identify bankfull events
+--the _view views give rows loaded with a run_id their model_info back
 , bankfull_status as (
 select Subbasin, DATE_ADD(DATE(b.year, 1, 1), INTERVAL CAST(c.MON as INT64) - 1 DAY) as datestamp
 , flow_out / (bankfull_xsec_m2*velocity) as bankfullpct
@@ -13,9 +14,9 @@ select Subbasin, DATE_ADD(DATE(b.year, 1, 1), INTERVAL CAST(c.MON as INT64) - 1
 , if(flow_out > bankfull_xsec_m2*velocity and lag(if(flow_out > bankfull_xsec_m2*velocity,1,0)) 
     over (partition by Subbasin order by DATE_ADD(DATE(b.year, 1, 1), INTERVAL CAST(c.MON as INT64) - 1 DAY)) = 0,1,0) isstartevent
 from channel_dims 
-join (select * from `edf-aq-data.healthy_gulf.SWAT_output_vel` where model_info = '20050101_20141231_res_c') b 
+join (select * from `edf-aq-data.healthy_gulf.SWAT_output_vel_view` where model_info = '20050101_20141231_res_c') b 
 on channel_dims.Subbasin = cast(b.sub as int64)
-join (select * from `edf-aq-data.healthy_gulf.SWAT_output_rch` where model_info = '20050101_20141231_res_c') c 
+join (select * from `edf-aq-data.healthy_gulf.SWAT_output_rch_view` where model_info = '20050101_20141231_res_c') c 
 on cast(b.sub as int64) = c.rch and b.year=c.year and b.Day = c.MON and b.model_info=c.model_info
 where b.model_info = '20050101_20141231_res_c'
 and b.velocity != 0
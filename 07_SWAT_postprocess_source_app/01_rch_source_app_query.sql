@@ -7,7 +7,8 @@ SELECT
 	avg(SORPST_IN) as avg_sorpst_in,
 	count(*) as count
     
-FROM `edf-aq-data.healthy_gulf.SWAT_output_rch` 
+-- the view gives rows loaded with a run_id their model_info and model_time_interval back
+FROM `edf-aq-data.healthy_gulf.SWAT_output_rch_view` 
 
 -- limit to daily chemtest runs
 WHERE 